@@ -20,23 +20,93 @@ CREATE TABLE IF NOT EXISTS kb_sections (
     meta TEXT DEFAULT '{}'
 );
 
+CREATE TABLE IF NOT EXISTS kb_paragraphs (
+    id TEXT PRIMARY KEY,
+    document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+    section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
+    seq INTEGER NOT NULL,
+    page INTEGER,
+    char_start INTEGER,
+    char_end INTEGER,
+    content TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sqlite_paragraphs_doc_seq
+    ON kb_paragraphs(document_id, seq);
+
+-- content is NULL for chunks stored as a paragraph_start..paragraph_end range.
+CREATE TABLE IF NOT EXISTS kb_embeddings (
+    content_hash TEXT PRIMARY KEY,
+    emb BLOB NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS kb_markdowns (
     id TEXT PRIMARY KEY,
     document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
     section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
-    content TEXT NOT NULL,
+    content TEXT,
     token_count INTEGER NOT NULL,
     char_start INTEGER,
     char_end INTEGER,
     start_page INTEGER,
     end_page INTEGER,
-    emb TEXT NOT NULL,
+    paragraph_start INTEGER,
+    paragraph_end INTEGER,
+    content_hash TEXT NOT NULL REFERENCES kb_embeddings(content_hash),
     tsv TEXT NOT NULL
 );
 
 CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_doc
     ON kb_markdowns(document_id);
 
+CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_hash
+    ON kb_markdowns(content_hash);
+
+CREATE VIEW IF NOT EXISTS kb_chunks AS
+SELECT
+    m.rowid AS chunk_rowid,
+    m.id, m.document_id, m.section_id,
+    COALESCE(m.content, (
+        SELECT group_concat(content, char(10) || char(10)) FROM (
+            SELECT p.content FROM kb_paragraphs p
+            WHERE p.document_id = m.document_id AND p.seq BETWEEN m.paragraph_start AND m.paragraph_end
+            ORDER BY p.seq
+        )
+    )) AS content,
+    m.token_count, m.char_start, m.char_end, m.start_page, m.end_page,
+    m.paragraph_start, m.paragraph_end, m.content_hash, e.emb, m.tsv
+FROM kb_markdowns m
+LEFT JOIN kb_embeddings e ON e.content_hash = m.content_hash;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS kb_markdowns_fts USING fts5(
+    content,
+    content='kb_chunks',
+    content_rowid='chunk_rowid',
+    tokenize="unicode61 tokenchars '_'"
+);
+
+CREATE TRIGGER IF NOT EXISTS kb_markdowns_fts_insert AFTER INSERT ON kb_markdowns BEGIN
+    INSERT INTO kb_markdowns_fts (rowid, content)
+    SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS kb_markdowns_fts_delete BEFORE DELETE ON kb_markdowns BEGIN
+    INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+    SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS kb_markdowns_fts_update_before BEFORE UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+    INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+    SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS kb_markdowns_fts_update_after AFTER UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+    INSERT INTO kb_markdowns_fts (rowid, content)
+    SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS kb_markdowns_terms USING fts5vocab(kb_markdowns_fts, 'row');
+
 CREATE TABLE IF NOT EXISTS kb_tables (
     id TEXT PRIMARY KEY,
     document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
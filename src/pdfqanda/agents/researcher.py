@@ -2,14 +2,16 @@
 
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass
 from typing import Sequence
 
+import numpy as np
+
 from ..config import get_settings
 from ..db import Database
-from ..embedding import build_tsvector, count_term_hits, cosine_similarity
+from ..embedding import build_tsvector, count_term_hits
 from ..models import ResearchHit
+from ..util.db import decode_embedding
 from ..util.embeddings import EmbeddingClient
 
 __all__ = ["ResearchOutput", "Researcher"]
@@ -40,17 +42,17 @@ class Researcher:
         if not question.strip():
             return ResearchOutput(hits=[], exhausted=True)
 
-        query_embedding = self.embedder.embed_query(question)
+        query_embedding = np.asarray(self.embedder.embed_query(question), dtype=np.float32)
         rows = self.database.fetch_markdowns()
         scored = []
-        for row in rows:
-            embedding_blob = row["emb"]
-            if isinstance(embedding_blob, str):
-                embedding = json.loads(embedding_blob)
-            else:  # pragma: no cover - legacy vector adapters
-                embedding = list(embedding_blob)
-            score = cosine_similarity(query_embedding, embedding)
-            scored.append((score, row, embedding))
+        if rows:
+            matrix = np.stack([decode_embedding(row["emb"]) for row in rows])
+            if matrix.shape[1] != query_embedding.shape[0]:
+                raise ValueError("Embedding dimension mismatch")
+            norms = np.linalg.norm(matrix, axis=1) * float(np.linalg.norm(query_embedding))
+            dots = matrix @ query_embedding
+            scores = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+            scored = [(float(score), row, embedding) for score, row, embedding in zip(scores, rows, matrix)]
         scored.sort(key=lambda item: item[0], reverse=True)
         vector_top_k = scored[: max(top_k, 12)]
 
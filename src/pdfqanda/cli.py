@@ -10,11 +10,14 @@ import typer
 from .config import get_settings
 from .ingest import PdfIngestor
 from .retrieval import Retriever, format_answer
-from .util.db import Database
+from .util.db import Database, IndexReport
+from .util.vector_index import SearchFilter
 
 app = typer.Typer(help="PDF Q&A pipeline backed by a SQLite spine.")
 db_app = typer.Typer(help="Database management commands.")
 app.add_typer(db_app, name="db")
+index_app = typer.Typer(help="Vector index maintenance commands.")
+app.add_typer(index_app, name="index")
 
 
 @db_app.command("init")
@@ -27,6 +30,42 @@ def db_init() -> None:
     typer.echo("Database initialised")
 
 
+@index_app.command("verify")
+def index_verify() -> None:
+    """Compare the vector index with the embeddings stored in SQLite."""
+
+    settings = get_settings()
+    database = Database(settings.db_path)
+    database.initialize()
+    report = database.verify_index()
+    _echo_report(report)
+    if database.router is not None:
+        typer.echo(f"Routing recall@10 on sampled chunks: {database.routing_accuracy():.3f}")
+    if not report.consistent:
+        raise typer.Exit(code=1)
+
+
+@index_app.command("rebuild")
+def index_rebuild() -> None:
+    """Rebuild the vector index from SQLite and swap it in."""
+
+    settings = get_settings()
+    database = Database(settings.db_path)
+    database.initialize()
+    report = database.rebuild_index()
+    _echo_report(report)
+    typer.echo(f"Rebuilt index with {database.index.count()} rows")
+
+
+def _echo_report(report: IndexReport, shown: int = 10) -> None:
+    typer.echo(report.describe())
+    for label, ids in (("missing", report.missing), ("orphaned", report.orphaned)):
+        for id_ in ids[:shown]:
+            typer.echo(f"  {label} {id_}")
+        if len(ids) > shown:
+            typer.echo(f"  ... {len(ids) - shown} more {label}")
+
+
 @app.command()
 def ingest(
     pdfs: Annotated[list[Path], typer.Argument(..., exists=True, readable=True, allow_dash=False)],
@@ -42,7 +81,8 @@ def ingest(
     for pdf_path in pdfs:
         result = ingestor.ingest(pdf_path, title=title)
         typer.echo(
-            f"Ingested {pdf_path.name} -> doc {result.document_id[:8]} (chunks: {result.chunk_count})"
+            f"Ingested {pdf_path.name} -> doc {result.document_id[:8]} "
+            f"(chunks: {result.chunk_count}, deduplicated: {result.dedup_ratio:.0%})"
         )
 
 
@@ -50,6 +90,15 @@ def ingest(
 def ask(
     question: Annotated[str, typer.Argument(..., help="Question to ask about the knowledge base.")],
     k: Annotated[int, typer.Option(6, help="Number of chunks to include in the answer.")] = 6,
+    doc: Annotated[
+        list[str] | None, typer.Option(None, "--doc", help="Restrict the search to these document ids.")
+    ] = None,
+    deadline_ms: Annotated[
+        float | None, typer.Option(None, "--deadline-ms", help="Latency budget; returns best-effort hits.")
+    ] = None,
+    explain: Annotated[
+        bool, typer.Option(False, "--explain", help="Print the retrieval plan and why it was chosen.")
+    ] = False,
 ) -> None:
     """Query the database for relevant snippets and return a cited answer."""
 
@@ -57,13 +106,21 @@ def ask(
     database = Database(settings.db_path)
     retriever = Retriever(database)
 
-    hits = retriever.search(question, k=k)
+    filters = SearchFilter(document_ids=doc) if doc else None
+    if explain:
+        typer.echo(f"Plan: {retriever.explain(question, k=k).describe()}", err=True)
+    try:
+        hits = retriever.search(question, k=k, filters=filters, deadline_ms=deadline_ms)
+    finally:
+        retriever.close()
     answer = format_answer(hits)
     if not hits or "【doc:" not in answer:
         typer.echo("No cited answer available.")
         raise typer.Exit(code=1)
 
     typer.echo(answer)
+    if hits.partial:
+        typer.echo("Note: the latency budget ran out; results are best-effort.", err=True)
 
 
 if __name__ == "__main__":  # pragma: no cover
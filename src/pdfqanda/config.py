@@ -35,6 +35,29 @@ class Settings:
     embedding_dim: int
     chunk_target_tokens: int
     chunk_overlap_ratio: float
+    index_mmap: bool = False
+    index_block_rows: int = 65536
+    index_storage: str | None = None
+    index_rerank_depth: int = 256
+    index_prefix_dims: int | None = None
+    vector_backend: str | None = None
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nlist: int | None = None
+    ivf_nprobe: int = 8
+    pq_m: int | None = None
+    ivf_rerank: bool = True
+    index_shards: int = 1
+    index_hot_rows: int | None = None
+    route_max_documents: int = 0
+    route_max_sections: int = 0
+    sqlite_wal: bool = True
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_mb: int = 64
+    sqlite_mmap_mb: int = 256
+    sqlite_readers: int = 4
+    sqlite_immutable: bool = False
 
 
 def _resolve_db_path(raw: str | None) -> str:
@@ -47,6 +70,13 @@ def _resolve_db_path(raw: str | None) -> str:
     return raw
 
 
+def _env_flag(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
 @lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Return cached configuration values loaded from the environment."""
@@ -56,6 +86,29 @@ def get_settings() -> Settings:
     embedding_dim = int(os.getenv("EMBEDDING_DIM", "1536"))
     chunk_target = int(os.getenv("CHUNK_TARGET_TOKENS", "1000"))
     overlap_ratio = float(os.getenv("CHUNK_OVERLAP_RATIO", "0.12"))
+    index_mmap = _env_flag("INDEX_MMAP")
+    index_block_rows = int(os.getenv("INDEX_BLOCK_ROWS", "65536"))
+    index_storage = os.getenv("INDEX_STORAGE") or None
+    index_rerank_depth = int(os.getenv("INDEX_RERANK_DEPTH", "256"))
+    index_prefix_dims = int(os.getenv("INDEX_PREFIX_DIMS", "0")) or None
+    vector_backend = os.getenv("VECTOR_BACKEND") or None
+    hnsw_m = int(os.getenv("HNSW_M", "16"))
+    hnsw_ef_construction = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+    hnsw_ef_search = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    ivf_nlist = int(os.getenv("IVF_NLIST", "0")) or None
+    ivf_nprobe = int(os.getenv("IVF_NPROBE", "8"))
+    pq_m = int(os.getenv("PQ_M", "0")) or None
+    ivf_rerank = _env_flag("IVF_RERANK", default=True)
+    index_shards = max(1, int(os.getenv("INDEX_SHARDS", "1")))
+    index_hot_rows = int(os.getenv("INDEX_HOT_ROWS", "0")) or None
+    route_max_documents = int(os.getenv("ROUTE_MAX_DOCUMENTS", "0"))
+    route_max_sections = int(os.getenv("ROUTE_MAX_SECTIONS", "0"))
+    sqlite_wal = _env_flag("SQLITE_WAL", default=True)
+    sqlite_synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    sqlite_cache_mb = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    sqlite_mmap_mb = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    sqlite_readers = max(0, int(os.getenv("SQLITE_READERS", "4")))
+    sqlite_immutable = _env_flag("SQLITE_IMMUTABLE")
 
     return Settings(
         db_path=db_path,
@@ -63,6 +116,29 @@ def get_settings() -> Settings:
         embedding_dim=embedding_dim,
         chunk_target_tokens=chunk_target,
         chunk_overlap_ratio=overlap_ratio,
+        index_mmap=index_mmap,
+        index_block_rows=index_block_rows,
+        index_storage=index_storage,
+        index_rerank_depth=index_rerank_depth,
+        index_prefix_dims=index_prefix_dims,
+        vector_backend=vector_backend,
+        hnsw_m=hnsw_m,
+        hnsw_ef_construction=hnsw_ef_construction,
+        hnsw_ef_search=hnsw_ef_search,
+        ivf_nlist=ivf_nlist,
+        ivf_nprobe=ivf_nprobe,
+        pq_m=pq_m,
+        ivf_rerank=ivf_rerank,
+        index_shards=index_shards,
+        index_hot_rows=index_hot_rows,
+        route_max_documents=route_max_documents,
+        route_max_sections=route_max_sections,
+        sqlite_wal=sqlite_wal,
+        sqlite_synchronous=sqlite_synchronous,
+        sqlite_cache_mb=sqlite_cache_mb,
+        sqlite_mmap_mb=sqlite_mmap_mb,
+        sqlite_readers=sqlite_readers,
+        sqlite_immutable=sqlite_immutable,
     )
 
 
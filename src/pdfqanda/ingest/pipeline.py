@@ -11,13 +11,15 @@ from datetime import datetime
 from pathlib import Path
 from typing import Sequence
 
+import numpy as np
+
 from ..config import get_settings
 from ..embedding import build_tsvector
 from ..util.cache import FileCache, stable_hash
-from ..util.db import Database
+from ..util.db import Database, content_hash
 from ..util.embeddings import EmbeddingClient
 
-__all__ = ["Section", "Chunk", "IngestResult", "PdfIngestor"]
+__all__ = ["Section", "Paragraph", "Chunk", "IngestResult", "PdfIngestor"]
 
 
 @dataclass(slots=True)
@@ -33,6 +35,21 @@ class Section:
     path: str
 
 
+@dataclass(slots=True)
+class Paragraph:
+    """A normalized paragraph, stored once and shared by the chunks covering it."""
+
+    id: str
+    document_id: str
+    section_id: str
+    seq: int
+    page: int
+    char_start: int
+    char_end: int
+    content: str
+    token_count: int
+
+
 @dataclass(slots=True)
 class Chunk:
     """A semantic chunk ready for persistence."""
@@ -46,17 +63,29 @@ class Chunk:
     char_end: int
     start_page: int
     end_page: int
-    embedding: list[float]
+    paragraph_start: int
+    paragraph_end: int
+    content_hash: str
+    embedding: np.ndarray | None
     tsv: str
 
 
 @dataclass(slots=True)
 class IngestResult:
-    """Summary of a successful ingestion run."""
+    """Summary of a successful ingestion run.
+
+    ``reused_chunks`` counts chunks whose content was already stored (by this
+    or another document) and therefore needed no new embedding.
+    """
 
     document_id: str
     sha256: str
     chunk_count: int
+    reused_chunks: int = 0
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.reused_chunks / self.chunk_count if self.chunk_count else 0.0
 
 
 class PdfIngestor:
@@ -90,11 +119,6 @@ class PdfIngestor:
         document_id = str(uuid.uuid4())
         now = datetime.utcnow().isoformat()
 
-        self.database.delete_document(sha256)
-        self.database.insert_document(
-            doc_id=document_id, title=title, sha256=sha256, created_at=now
-        )
-
         pages = self._load_pages(pdf_path, sha256)
         layout_key = stable_hash([sha256, "sections:v1"])
         cached_sections = self.table_cache.get("layouts", layout_key)
@@ -124,22 +148,6 @@ class PdfIngestor:
                 path=title,
             )
             sections = [root_section]
-        self.database.insert_sections(
-            [
-                {
-                    "id": section.id,
-                    "document_id": section.document_id,
-                    "parent_id": None,
-                    "title": section.title,
-                    "level": section.level,
-                    "start_page": section.start_page,
-                    "end_page": section.end_page,
-                    "path": section.path,
-                    "meta": {},
-                }
-                for section in sections
-            ]
-        )
         if not cached_sections:
             self.table_cache.set(
                 "layouts",
@@ -156,31 +164,84 @@ class PdfIngestor:
                 ],
             )
 
-        chunks = self._segment(document_id, sections[0], pages)
-        embeddings = self.embedder.embed_documents([chunk.content for chunk in chunks])
-        for idx, chunk in enumerate(chunks):
-            chunk.embedding = embeddings[idx]
-
-        self.database.insert_markdowns(
-            [
-                {
-                    "id": chunk.id,
-                    "document_id": chunk.document_id,
-                    "section_id": chunk.section_id,
-                    "content": chunk.content,
-                    "token_count": chunk.token_count,
-                    "char_start": chunk.char_start,
-                    "char_end": chunk.char_end,
-                    "start_page": chunk.start_page,
-                    "end_page": chunk.end_page,
-                    "emb": chunk.embedding,
-                    "tsv": chunk.tsv,
-                }
-                for chunk in chunks
-            ]
+        paragraphs = self._paragraphs(document_id, sections[0], pages)
+        chunks = self._segment(document_id, sections[0], paragraphs)
+        # identical content is embedded once, however many chunks or documents cite it
+        known = self.database.fetch_embeddings(chunk.content_hash for chunk in chunks)
+        fresh = {chunk.content_hash: chunk.content for chunk in chunks if chunk.content_hash not in known}
+        if fresh:
+            known.update(zip(fresh, self.embedder.embed_documents(list(fresh.values()))))
+        for chunk in chunks:
+            chunk.embedding = known[chunk.content_hash]
+        embeddings = (
+            np.stack([chunk.embedding for chunk in chunks])
+            if chunks
+            else np.empty((0, self.settings.embedding_dim), dtype=np.float32)
         )
 
-        return IngestResult(document_id=document_id, sha256=sha256, chunk_count=len(chunks))
+        with self.database.transaction():
+            self.database.delete_document(sha256)
+            self.database.insert_document(
+                doc_id=document_id, title=title, sha256=sha256, created_at=now
+            )
+            self.database.insert_sections(
+                [
+                    {
+                        "id": section.id,
+                        "document_id": section.document_id,
+                        "parent_id": None,
+                        "title": section.title,
+                        "level": section.level,
+                        "start_page": section.start_page,
+                        "end_page": section.end_page,
+                        "path": section.path,
+                        "meta": {},
+                    }
+                    for section in sections
+                ]
+            )
+            self.database.insert_paragraphs(
+                [
+                    {
+                        "id": paragraph.id,
+                        "document_id": paragraph.document_id,
+                        "section_id": paragraph.section_id,
+                        "seq": paragraph.seq,
+                        "page": paragraph.page,
+                        "char_start": paragraph.char_start,
+                        "char_end": paragraph.char_end,
+                        "content": paragraph.content,
+                    }
+                    for paragraph in paragraphs
+                ]
+            )
+            self.database.insert_markdowns(
+                [
+                    {
+                        "id": chunk.id,
+                        "document_id": chunk.document_id,
+                        "section_id": chunk.section_id,
+                        "token_count": chunk.token_count,
+                        "char_start": chunk.char_start,
+                        "char_end": chunk.char_end,
+                        "start_page": chunk.start_page,
+                        "end_page": chunk.end_page,
+                        "paragraph_start": chunk.paragraph_start,
+                        "paragraph_end": chunk.paragraph_end,
+                        "content_hash": chunk.content_hash,
+                        "tsv": chunk.tsv,
+                    }
+                    for chunk in chunks
+                ],
+                embeddings=embeddings,
+            )
+
+        return IngestResult(
+            document_id=document_id,
+            sha256=sha256,
+            chunk_count=len(chunks),
+            reused_chunks=len(chunks) - len(fresh),
+        )
 
     # Internal helpers -----------------------------------------------------
     def _load_pages(self, pdf_path: Path, sha256: str) -> list[str]:
@@ -238,35 +299,42 @@ class PdfIngestor:
             )
         ]
 
-    def _segment(self, document_id: str, section: Section, pages: Sequence[str]) -> list[Chunk]:
-        paragraphs: list[tuple[int, str]] = []
+    def _paragraphs(self, document_id: str, section: Section, pages: Sequence[str]) -> list[Paragraph]:
+        paragraphs: list[Paragraph] = []
+        running_chars = 0
         for page_idx, page_text in enumerate(pages):
-            for paragraph in self._normalize_paragraphs(page_text):
-                paragraphs.append((page_idx, paragraph))
-        if not paragraphs:
-            paragraphs = [(0, "")] if pages else []
+            for text in self._normalize_paragraphs(page_text):
+                char_start = running_chars
+                running_chars = char_start + len(text) + 2
+                paragraphs.append(
+                    Paragraph(
+                        id=str(uuid.uuid4()),
+                        document_id=document_id,
+                        section_id=section.id,
+                        seq=len(paragraphs),
+                        page=page_idx,
+                        char_start=char_start,
+                        char_end=char_start + len(text),
+                        content=text,
+                        token_count=self._count_tokens(text),
+                    )
+                )
+        return paragraphs
 
+    def _segment(self, document_id: str, section: Section, paragraphs: Sequence[Paragraph]) -> list[Chunk]:
         target_tokens = max(1, self.settings.chunk_target_tokens)
         overlap_tokens = max(1, int(target_tokens * self.settings.chunk_overlap_ratio))
 
         chunks: list[Chunk] = []
-        buffer: list[tuple[int, str, int, int, int]] = []  # page, text, tokens, char_start, char_end
+        buffer: list[Paragraph] = []
         running_tokens = 0
-        running_chars = 0
-        for page_idx, text in paragraphs:
-            tokens = self._count_tokens(text)
-            if not text.strip():
-                running_chars += len(text) + 2
-                continue
-            paragraph_start = running_chars
-            paragraph_end = paragraph_start + len(text)
-            running_chars = paragraph_end + 2
-            if running_tokens + tokens > target_tokens and buffer:
+        for paragraph in paragraphs:
+            if running_tokens + paragraph.token_count > target_tokens and buffer:
                 chunks.append(self._emit_chunk(document_id, section, buffer))
                 buffer = self._apply_overlap(buffer, overlap_tokens)
-                running_tokens = sum(item[2] for item in buffer)
-            buffer.append((page_idx, text, tokens, paragraph_start, paragraph_end))
-            running_tokens += tokens
+                running_tokens = sum(item.token_count for item in buffer)
+            buffer.append(paragraph)
+            running_tokens += paragraph.token_count
         if buffer:
             chunks.append(self._emit_chunk(document_id, section, buffer))
         return chunks
@@ -275,38 +343,36 @@ class PdfIngestor:
         self,
         document_id: str,
         section: Section,
-        buffer: list[tuple[int, str, int, int, int]],
+        buffer: list[Paragraph],
     ) -> Chunk:
-        content = "\n\n".join(item[1] for item in buffer).strip()
-        token_count = sum(item[2] for item in buffer)
-        char_start = buffer[0][3]
-        char_end = buffer[-1][4]
-        start_page = buffer[0][0]
-        end_page = buffer[-1][0]
+        content = "\n\n".join(item.content for item in buffer)
         return Chunk(
             id=str(uuid.uuid4()),
             document_id=document_id,
             section_id=section.id,
             content=content,
-            token_count=token_count,
-            char_start=char_start,
-            char_end=char_end,
-            start_page=start_page,
-            end_page=end_page,
-            embedding=[],
+            token_count=sum(item.token_count for item in buffer),
+            char_start=buffer[0].char_start,
+            char_end=buffer[-1].char_end,
+            start_page=buffer[0].page,
+            end_page=buffer[-1].page,
+            paragraph_start=buffer[0].seq,
+            paragraph_end=buffer[-1].seq,
+            content_hash=content_hash(content),
+            embedding=None,
             tsv=build_tsvector(content),
         )
 
     def _apply_overlap(
         self,
-        buffer: list[tuple[int, str, int, int, int]],
+        buffer: list[Paragraph],
         overlap_tokens: int,
-    ) -> list[tuple[int, str, int, int, int]]:
-        retained: list[tuple[int, str, int, int, int]] = []
+    ) -> list[Paragraph]:
+        retained: list[Paragraph] = []
         running = 0
         for item in reversed(buffer):
             retained.insert(0, item)
-            running += item[2]
+            running += item.token_count
             if running >= overlap_tokens:
                 break
         return retained
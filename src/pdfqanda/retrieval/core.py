@@ -3,12 +3,16 @@
 from __future__ import annotations
 
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 from dataclasses import dataclass
-from typing import Iterable
+from typing import Iterable, Sequence
 
 from ..config import get_settings
-from ..util.db import Database
+from ..util.db import Database, QueryPlan, SearchResults
 from ..util.embeddings import EmbeddingClient
+from ..util.vector_index import SearchFilter
 
 __all__ = ["RetrievalHit", "Retriever", "format_answer"]
 
@@ -42,22 +46,91 @@ class Retriever:
         self.embedder = embedder or EmbeddingClient(
             settings.embedding_model, settings.embedding_dim
         )
+        # Runs embedding calls that a ``deadline_ms`` may abandon; see close().
+        self._embed_pool: ThreadPoolExecutor | None = None
 
-    def search(self, query: str, k: int = 6) -> list[RetrievalHit]:
+    def close(self) -> None:
+        """Shut down the embedding thread; abandoned calls are not waited for."""
+
+        if self._embed_pool is not None:
+            self._embed_pool.shutdown(wait=False, cancel_futures=True)
+            self._embed_pool = None
+
+    def search(
+        self,
+        query: str,
+        k: int = 6,
+        *,
+        filters: SearchFilter | None = None,
+        deadline_ms: float | None = None,
+    ) -> SearchResults:
+        """Return the top ``k`` hits for ``query``.
+
+        With ``deadline_ms`` the whole call is budgeted: an embedding request
+        that overruns falls back to lexical-only hits, and the vector scan
+        returns what it found in time. The result's ``partial`` and
+        ``lexical_only`` flags say which of those happened.
+        """
+
+        if deadline_ms is None:
+            return self.search_many([query], k, filters=filters)[0]
+        deadline = time.monotonic() + deadline_ms / 1000.0
         query = query.strip()
         if not query:
-            return []
-        embedding = self.embedder.embed_query(query)
+            return SearchResults()
         keywords = self._keywords(query)
+        if self._embed_pool is None:
+            self._embed_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embed")
+        future = self._embed_pool.submit(self.embedder.embed_matrix, [query])
+        try:
+            embedding = future.result(timeout=max(deadline - time.monotonic(), 0.0))[0]
+        except FutureTimeout:
+            raw_hits = self.database.lexical_search(keywords, limit=max(12, k), filters=filters)
+            return SearchResults(self._hits(raw_hits, k), partial=True, lexical_only=True)
         raw_hits = self.database.vector_search(
-            embedding, limit=max(12, k), keywords=keywords
+            embedding,
+            limit=max(12, k),
+            keywords=keywords,
+            filters=filters,
+            deadline_ms=max(deadline - time.monotonic(), 0.0) * 1000.0,
+        )
+        return SearchResults(self._hits(raw_hits, k), partial=raw_hits.partial)
+
+    def search_many(
+        self, queries: Sequence[str], k: int = 6, *, filters: SearchFilter | None = None
+    ) -> list[SearchResults]:
+        """Answer several queries with a single batched index search."""
+
+        cleaned = [query.strip() for query in queries]
+        active = [idx for idx, query in enumerate(cleaned) if query]
+        output = [SearchResults() for _ in cleaned]
+        if not active:
+            return output
+        embeddings = self.embedder.embed_matrix([cleaned[idx] for idx in active])
+        raw_lists = self.database.search_many(
+            embeddings,
+            limit=max(12, k),
+            keywords=[self._keywords(cleaned[idx]) for idx in active],
+            filters=filters,
         )
+        for idx, raw_hits in zip(active, raw_lists):
+            output[idx] = SearchResults(self._hits(raw_hits, k), partial=raw_hits.partial)
+        return output
+
+    def explain(self, query: str, k: int = 6) -> QueryPlan:
+        """Return the plan the database would use to answer ``query``."""
+
+        return self.database.explain(self._keywords(query.strip()), limit=max(12, k))
+
+    def _hits(self, raw_hits: list[dict[str, object]], k: int) -> list[RetrievalHit]:
         ranked = sorted(
             raw_hits, key=lambda row: float(row.get("score", 0.0)), reverse=True
         )
         hits: list[RetrievalHit] = []
         for row in ranked[:k]:
-            citation = self._citation(row)
+            # content shared by several chunks is cited at every location
+            locations = row.get("locations") or [row]
+            citation = " ".join(self._citation(location) for location in locations)
             hits.append(
                 RetrievalHit(
                     document_id=str(row.get("document_id")),
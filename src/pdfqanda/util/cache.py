@@ -8,6 +8,8 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Callable, Iterable, Sequence
 
+import numpy as np
+
 
 def stable_hash(parts: Sequence[str]) -> str:
     """Return a deterministic SHA256 hash over the provided string parts."""
@@ -47,6 +49,22 @@ class FileCache:
         path.parent.mkdir(parents=True, exist_ok=True)
         path.write_text(json.dumps(value), encoding="utf-8")
 
+    def get_array(self, namespace: str, key: str) -> np.ndarray | None:
+        """Return an array stored with ``set_array``, read back as raw ``.npy`` data."""
+
+        path = self._key_path(namespace, key).with_suffix(".npy")
+        if not path.exists():
+            return None
+        try:
+            return np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def set_array(self, namespace: str, key: str, value: np.ndarray) -> None:
+        path = self._key_path(namespace, key).with_suffix(".npy")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, value, allow_pickle=False)
+
     def get_or_compute(
         self,
         namespace: str,
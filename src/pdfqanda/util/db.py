@@ -2,14 +2,27 @@
 
 from __future__ import annotations
 
+import hashlib
+import itertools
 import json
+import math
+import re
+import shutil
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Iterable, Sequence
+from typing import Callable, Iterable, Iterator, Sequence
 
+import numpy as np
+
+from ..config import Settings, get_settings
 from .migrations import Migration, apply_migrations
-from .vector_index import VectorIndex, VectorIndexBackend, VectorItem
+from .pool import ConnectionPool
+from .routing import CentroidRouter
+from .vector_index import SearchFilter, VectorIndex, VectorIndexBackend
 
 
 _MIGRATIONS: tuple[Migration, ...] = (
@@ -85,8 +98,310 @@ _MIGRATIONS: tuple[Migration, ...] = (
         );
         """,
     ),
+    Migration(
+        "003_binary_embeddings",
+        """
+        CREATE TABLE kb_markdowns_blob (
+            id TEXT PRIMARY KEY,
+            document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
+            content TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            char_start INTEGER,
+            char_end INTEGER,
+            start_page INTEGER,
+            end_page INTEGER,
+            emb BLOB NOT NULL,
+            tsv TEXT NOT NULL
+        );
+
+        INSERT INTO kb_markdowns_blob SELECT id, document_id, section_id, content, token_count,
+            char_start, char_end, start_page, end_page, emb, tsv FROM kb_markdowns;
+        DROP TABLE kb_markdowns;
+        ALTER TABLE kb_markdowns_blob RENAME TO kb_markdowns;
+
+        CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_doc
+            ON kb_markdowns(document_id);
+        """,
+    ),
+    Migration(
+        "004_fts5_lexical_index",
+        """
+        CREATE VIRTUAL TABLE kb_markdowns_fts USING fts5(
+            content,
+            content='kb_markdowns',
+            content_rowid='rowid',
+            tokenize="unicode61 tokenchars '_'"
+        );
+
+        CREATE TRIGGER kb_markdowns_fts_insert AFTER INSERT ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_delete AFTER DELETE ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_update AFTER UPDATE OF content ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO kb_markdowns_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+
+        INSERT INTO kb_markdowns_fts (kb_markdowns_fts) VALUES ('rebuild');
+        """,
+    ),
+    Migration(
+        "005_term_frequencies",
+        """
+        CREATE VIRTUAL TABLE kb_markdowns_terms USING fts5vocab(kb_markdowns_fts, 'row');
+        """,
+    ),
+    Migration(
+        "006_paragraphs",
+        """
+        CREATE TABLE kb_paragraphs (
+            id TEXT PRIMARY KEY,
+            document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
+            seq INTEGER NOT NULL,
+            page INTEGER,
+            char_start INTEGER,
+            char_end INTEGER,
+            content TEXT NOT NULL
+        );
+
+        CREATE UNIQUE INDEX idx_sqlite_paragraphs_doc_seq
+            ON kb_paragraphs(document_id, seq);
+
+        DROP TABLE kb_markdowns_terms;
+        DROP TRIGGER kb_markdowns_fts_insert;
+        DROP TRIGGER kb_markdowns_fts_delete;
+        DROP TRIGGER kb_markdowns_fts_update;
+        DROP TABLE kb_markdowns_fts;
+
+        CREATE TABLE kb_markdowns_ranges (
+            id TEXT PRIMARY KEY,
+            document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
+            content TEXT,
+            token_count INTEGER NOT NULL,
+            char_start INTEGER,
+            char_end INTEGER,
+            start_page INTEGER,
+            end_page INTEGER,
+            paragraph_start INTEGER,
+            paragraph_end INTEGER,
+            emb BLOB NOT NULL,
+            tsv TEXT NOT NULL
+        );
+
+        INSERT INTO kb_markdowns_ranges (id, document_id, section_id, content, token_count, char_start, char_end,
+            start_page, end_page, emb, tsv)
+        SELECT id, document_id, section_id, content, token_count, char_start, char_end,
+            start_page, end_page, emb, tsv FROM kb_markdowns;
+        DROP TABLE kb_markdowns;
+        ALTER TABLE kb_markdowns_ranges RENAME TO kb_markdowns;
+
+        CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_doc
+            ON kb_markdowns(document_id);
+
+        -- Chunks with a paragraph range and no stored content are assembled on read.
+        CREATE VIEW kb_chunks AS
+        SELECT
+            m.rowid AS chunk_rowid,
+            m.id, m.document_id, m.section_id,
+            COALESCE(m.content, (
+                SELECT group_concat(content, char(10) || char(10)) FROM (
+                    SELECT p.content FROM kb_paragraphs p
+                    WHERE p.document_id = m.document_id AND p.seq BETWEEN m.paragraph_start AND m.paragraph_end
+                    ORDER BY p.seq
+                )
+            )) AS content,
+            m.token_count, m.char_start, m.char_end, m.start_page, m.end_page,
+            m.paragraph_start, m.paragraph_end, m.emb, m.tsv
+        FROM kb_markdowns m;
+
+        CREATE VIRTUAL TABLE kb_markdowns_fts USING fts5(
+            content,
+            content='kb_chunks',
+            content_rowid='chunk_rowid',
+            tokenize="unicode61 tokenchars '_'"
+        );
+
+        CREATE TRIGGER kb_markdowns_fts_insert AFTER INSERT ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (rowid, content)
+            SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_delete BEFORE DELETE ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+            SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_update_before BEFORE UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+            SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_update_after AFTER UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (rowid, content)
+            SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+        END;
+
+        INSERT INTO kb_markdowns_fts (kb_markdowns_fts) VALUES ('rebuild');
+
+        CREATE VIRTUAL TABLE kb_markdowns_terms USING fts5vocab(kb_markdowns_fts, 'row');
+        """,
+    ),
+    Migration(
+        "007_content_addressed_embeddings",
+        """
+        -- Existing chunks keep their id as content hash, which matches their index row.
+        CREATE TABLE kb_embeddings (
+            content_hash TEXT PRIMARY KEY,
+            emb BLOB NOT NULL
+        );
+
+        INSERT INTO kb_embeddings (content_hash, emb) SELECT id, emb FROM kb_markdowns;
+
+        DROP VIEW kb_chunks;
+
+        CREATE TABLE kb_markdowns_hashed (
+            id TEXT PRIMARY KEY,
+            document_id TEXT NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            section_id TEXT REFERENCES kb_sections(id) ON DELETE SET NULL,
+            content TEXT,
+            token_count INTEGER NOT NULL,
+            char_start INTEGER,
+            char_end INTEGER,
+            start_page INTEGER,
+            end_page INTEGER,
+            paragraph_start INTEGER,
+            paragraph_end INTEGER,
+            content_hash TEXT NOT NULL REFERENCES kb_embeddings(content_hash),
+            tsv TEXT NOT NULL
+        );
+
+        INSERT INTO kb_markdowns_hashed (rowid, id, document_id, section_id, content, token_count, char_start,
+            char_end, start_page, end_page, paragraph_start, paragraph_end, content_hash, tsv)
+        SELECT rowid, id, document_id, section_id, content, token_count, char_start,
+            char_end, start_page, end_page, paragraph_start, paragraph_end, id, tsv FROM kb_markdowns;
+        DROP TABLE kb_markdowns;
+        ALTER TABLE kb_markdowns_hashed RENAME TO kb_markdowns;
+
+        CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_doc
+            ON kb_markdowns(document_id);
+
+        CREATE INDEX IF NOT EXISTS idx_sqlite_markdowns_hash
+            ON kb_markdowns(content_hash);
+
+        CREATE VIEW kb_chunks AS
+        SELECT
+            m.rowid AS chunk_rowid,
+            m.id, m.document_id, m.section_id,
+            COALESCE(m.content, (
+                SELECT group_concat(content, char(10) || char(10)) FROM (
+                    SELECT p.content FROM kb_paragraphs p
+                    WHERE p.document_id = m.document_id AND p.seq BETWEEN m.paragraph_start AND m.paragraph_end
+                    ORDER BY p.seq
+                )
+            )) AS content,
+            m.token_count, m.char_start, m.char_end, m.start_page, m.end_page,
+            m.paragraph_start, m.paragraph_end, m.content_hash, e.emb, m.tsv
+        FROM kb_markdowns m
+        LEFT JOIN kb_embeddings e ON e.content_hash = m.content_hash;
+
+        CREATE TRIGGER kb_markdowns_fts_insert AFTER INSERT ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (rowid, content)
+            SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_delete BEFORE DELETE ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+            SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_update_before BEFORE UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (kb_markdowns_fts, rowid, content)
+            SELECT 'delete', chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = old.rowid;
+        END;
+
+        CREATE TRIGGER kb_markdowns_fts_update_after AFTER UPDATE OF content, paragraph_start, paragraph_end ON kb_markdowns BEGIN
+            INSERT INTO kb_markdowns_fts (rowid, content)
+            SELECT chunk_rowid, content FROM kb_chunks WHERE chunk_rowid = new.rowid;
+        END;
+
+        INSERT INTO kb_markdowns_fts (kb_markdowns_fts) VALUES ('rebuild');
+        """,
+    ),
 )
 
+# Rows rewritten per statement by :meth:`Database.convert_embeddings`.
+_CONVERT_BATCH = 512
+
+# Embeddings streamed per bulk load by :meth:`Database.rebuild_index`.
+_REBUILD_BATCH = 8192
+
+# Keyword matches scored per block by the lexical-first plan; a deadline is
+# checked between blocks.
+_LEXICAL_BATCH = 1024
+
+# Planner cost units: scoring one row in a vector index pass versus reading
+# one chunk row (with its embedding BLOB) out of SQLite.
+_SCAN_ROW_COST = 1.0
+_FETCH_ROW_COST = 20.0
+
+_TERM_TOKEN_RE = re.compile(r"\w+")
+
+# Index metadata value standing in for "several documents/sections" when one
+# content hash is cited from more than one place; searches always admit it.
+_SHARED = "*"
+
+
+@dataclass(frozen=True, slots=True)
+class QueryPlan:
+    """How :meth:`Database.search_many` answers one query, and why."""
+
+    strategy: str
+    keywords: tuple[str, ...]
+    total_rows: int
+    estimated_matches: int
+    vector_cost: float
+    lexical_cost: float
+
+    @property
+    def reason(self) -> str:
+        if not self.keywords:
+            return "no keywords, so the vector index ranks all chunks directly"
+        share = self.estimated_matches / self.total_rows if self.total_rows else 0.0
+        return (
+            f"keywords match at most {self.estimated_matches} of {self.total_rows} chunks ({share:.1%}); "
+            f"estimated cost lexical-first {self.lexical_cost:.0f} vs vector-first {self.vector_cost:.0f}"
+        )
+
+    def describe(self) -> str:
+        return f"{self.strategy}: {self.reason}"
+
+
+@dataclass(frozen=True, slots=True)
+class IndexReport:
+    """Differences between the vector index and the embeddings SQLite cites."""
+
+    expected: int
+    indexed: int
+    missing: tuple[str, ...]
+    orphaned: tuple[str, ...]
+
+    @property
+    def consistent(self) -> bool:
+        return not self.missing and not self.orphaned
+
+    def describe(self) -> str:
+        return (
+            f"{self.expected} embeddings in SQLite, {self.indexed} index rows: "
+            f"{len(self.missing)} missing, {len(self.orphaned)} orphaned"
+        )
+
 
 class Database:
     """Lightweight wrapper exposing the few SQL features the project relies on."""
@@ -97,16 +412,45 @@ class Database:
         *,
         index_factory: Callable[[Path, str], VectorIndex] | None = None,
         index_backend: VectorIndexBackend | None = None,
+        index_options: dict[str, object] | None = None,
+        router: CentroidRouter | None = None,
     ) -> None:
+        settings = get_settings()
         self.path = self._normalize_path(path)
         Path(self.path).parent.mkdir(parents=True, exist_ok=True)
-        self.sqlite_conn = sqlite3.connect(self.path)
-        self.sqlite_conn.row_factory = sqlite3.Row
+        self.pool = ConnectionPool(
+            self.path,
+            readers=settings.sqlite_readers,
+            immutable=settings.sqlite_immutable,
+            configure=lambda connection, readonly: _configure_connection(connection, settings, readonly=readonly),
+        )
+        self.sqlite_conn = self.pool.writer_connection
+        self._depth = 0
+        self._owner: int | None = None
+        self._after_commit: list[Callable[[], None]] = []
         index_dir = Path(self.path).with_name(Path(self.path).name + ".index")
+        self._index_dir = index_dir
+        _recover_index(index_dir)
+        self._open_index: Callable[[Path], VectorIndex] | None
         if index_factory is not None:
-            self.index = index_factory(index_dir, "kb")
+            self._open_index = lambda directory: index_factory(directory, "kb")
+            self.index = self._open_index(index_dir)
         else:
-            self.index = VectorIndex(index_dir, backend=index_backend)
+            if index_options is None:
+                index_options = _index_options(settings)
+            options = index_options
+            self.index = VectorIndex(index_dir, backend=index_backend, **options)
+            # an injected backend is tied to its own storage and cannot be rebuilt elsewhere
+            self._open_index = None
+            if index_backend is None:
+                self._open_index = lambda directory: VectorIndex(directory, **options)
+        if router is None and settings.route_max_documents:
+            router = CentroidRouter(
+                index_dir,
+                max_documents=settings.route_max_documents,
+                max_sections=settings.route_max_sections,
+            )
+        self.router = router
 
     # ------------------------------------------------------------------
     @staticmethod
@@ -117,19 +461,113 @@ class Database:
 
     # ------------------------------------------------------------------
     def initialize(self) -> None:
-        apply_migrations(self.sqlite_conn, _MIGRATIONS)
+        with self.connect(write=True) as connection:
+            apply_migrations(connection, _MIGRATIONS)
+        self.convert_embeddings()
+
+    def convert_embeddings(self, *, vacuum: bool = True) -> int:
+        """Rewrite legacy JSON ``kb_embeddings.emb`` values as float32 BLOBs in place.
+
+        Returns the number of rows converted. Databases written before
+        migration ``003`` keep their JSON text until this runs; ``vacuum``
+        then hands the freed pages back to the filesystem.
+        """
+
+        converted = 0
+        with self.connect(write=True) as connection:
+            cursor = connection.cursor()
+            while True:
+                cursor.execute(
+                    "SELECT content_hash, emb FROM kb_embeddings WHERE typeof(emb) = 'text' LIMIT ?",
+                    (_CONVERT_BATCH,),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(
+                    "UPDATE kb_embeddings SET emb = ? WHERE content_hash = ?",
+                    [(decode_embedding(row["emb"]).tobytes(), row["content_hash"]) for row in rows],
+                )
+                connection.commit()
+                converted += len(rows)
+            if converted and vacuum:
+                connection.execute("VACUUM")
+        return converted
 
     # Context manager --------------------------------------------------
     @contextmanager
-    def connect(self):
-        yield self.sqlite_conn
+    def connect(self, *, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """Yield a connection the calling thread may use for the block.
+
+        Reads borrow a pooled read-only connection, so query threads run in
+        parallel. ``write`` (and any call from inside this thread's open
+        :meth:`transaction`) holds the single writer connection instead.
+        """
+
+        if write or self._owner == threading.get_ident():
+            with self.pool.writer() as connection:
+                yield connection
+        else:
+            with self.pool.reader() as connection:
+                yield connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the enclosed writes as a single SQLite transaction.
+
+        The writer connection is held until the block ends. Mutation helpers
+        called inside join the transaction and queue their vector index and
+        routing updates until the SQL commit succeeds; an exception rolls SQLite
+        back and drops the queue. A nested block runs in a savepoint: if it
+        raises, only its own writes and queued updates are discarded, even when
+        the enclosing block catches the exception and commits.
+        """
+
+        with self.pool.writer() as connection:
+            depth = self._depth
+            savepoint = f"kb_transaction_{depth}"
+            mark = len(self._after_commit)
+            if depth:
+                connection.execute(f"SAVEPOINT {savepoint}")
+            elif not connection.in_transaction:
+                # open the transaction now so a nested savepoint never becomes
+                # the outermost one, whose RELEASE would commit
+                connection.execute("BEGIN")
+            self._depth += 1
+            self._owner = threading.get_ident()
+            try:
+                yield connection
+            except BaseException:
+                self._depth -= 1
+                if depth:
+                    connection.execute(f"ROLLBACK TO {savepoint}")
+                    connection.execute(f"RELEASE {savepoint}")
+                    del self._after_commit[mark:]
+                else:
+                    self._owner = None
+                    connection.rollback()
+                    self._after_commit.clear()
+                raise
+            self._depth -= 1
+            if depth:
+                connection.execute(f"RELEASE {savepoint}")
+                return
+            self._owner = None
+            connection.commit()
+            queued, self._after_commit = self._after_commit, []
+            if queued:
+                with self.index.batch():
+                    for update in queued:
+                        update()
 
     # Lifecycle --------------------------------------------------------
     def close(self) -> None:
         try:
             self.index.close()
+            if self.router is not None:
+                self.router.close()
         finally:
-            self.sqlite_conn.close()
+            self.pool.close()
 
     def __enter__(self):  # pragma: no cover - context manager sugar
         return self
@@ -139,101 +577,223 @@ class Database:
 
     # Mutation helpers -------------------------------------------------
     def delete_document(self, sha256: str) -> None:
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute(
-            "SELECT id FROM kb_markdowns WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)",
-            (sha256,),
-        )
-        chunk_ids = [row[0] for row in cursor.fetchall()]
-        if chunk_ids:
-            self.index.delete(chunk_ids)
-        cursor.execute("DELETE FROM kb_markdowns WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)", (sha256,))
-        cursor.execute("DELETE FROM kb_sections WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)", (sha256,))
-        cursor.execute("DELETE FROM kb_documents WHERE sha256 = ?", (sha256,))
-        self.sqlite_conn.commit()
+        """Remove a document; embeddings still cited by other documents are kept."""
+
+        with self.transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT id, section_id, content_hash FROM kb_markdowns"
+                " WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)",
+                (sha256,),
+            )
+            chunks = cursor.fetchall()
+            hashes = sorted({row[2] for row in chunks})
+            if self.router is not None:
+                cursor.execute("SELECT id FROM kb_documents WHERE sha256 = ?", (sha256,))
+                document_ids = [row[0] for row in cursor.fetchall()]
+                section_ids = sorted({row[1] for row in chunks if row[1] is not None})
+                self._after_commit.append(lambda: self.router.remove(document_ids, section_ids))
+            cursor.execute("DELETE FROM kb_markdowns WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)", (sha256,))
+            cursor.execute("DELETE FROM kb_paragraphs WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)", (sha256,))
+            cursor.execute("DELETE FROM kb_sections WHERE document_id IN (SELECT id FROM kb_documents WHERE sha256 = ?)", (sha256,))
+            cursor.execute("DELETE FROM kb_documents WHERE sha256 = ?", (sha256,))
+            if hashes:
+                cursor.execute(
+                    "DELETE FROM kb_embeddings WHERE content_hash IN (SELECT value FROM json_each(?))"
+                    " AND content_hash NOT IN (SELECT content_hash FROM kb_markdowns)",
+                    (json.dumps(hashes),),
+                )
+                self._after_commit.append(lambda: self._sync_index(hashes))
 
     def insert_document(self, *, doc_id: str, title: str, sha256: str, created_at: str, meta: str = "{}") -> None:
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute(
-            "INSERT INTO kb_documents (id, title, sha256, meta, created_at) VALUES (?, ?, ?, ?, ?)",
-            (doc_id, title, sha256, meta, created_at),
-        )
-        self.sqlite_conn.commit()
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO kb_documents (id, title, sha256, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, title, sha256, meta, created_at),
+            )
 
     def insert_sections(self, rows: Iterable[dict[str, object]]) -> None:
         items = list(rows)
         if not items:
             return
-        cursor = self.sqlite_conn.cursor()
-        cursor.executemany(
-            "INSERT INTO kb_sections (id, document_id, parent_id, title, level, start_page, end_page, path, meta)"
-            " VALUES (:id, :document_id, :parent_id, :title, :level, :start_page, :end_page, :path, :meta)",
-            [
-                {
-                    "id": row.get("id"),
-                    "document_id": row.get("document_id"),
-                    "parent_id": row.get("parent_id"),
-                    "title": row.get("title"),
-                    "level": row.get("level"),
-                    "start_page": row.get("start_page"),
-                    "end_page": row.get("end_page"),
-                    "path": row.get("path"),
-                    "meta": json.dumps(row.get("meta", {})),
-                }
-                for row in items
-            ],
-        )
-        self.sqlite_conn.commit()
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO kb_sections (id, document_id, parent_id, title, level, start_page, end_page, path, meta)"
+                " VALUES (:id, :document_id, :parent_id, :title, :level, :start_page, :end_page, :path, :meta)",
+                [
+                    {
+                        "id": row.get("id"),
+                        "document_id": row.get("document_id"),
+                        "parent_id": row.get("parent_id"),
+                        "title": row.get("title"),
+                        "level": row.get("level"),
+                        "start_page": row.get("start_page"),
+                        "end_page": row.get("end_page"),
+                        "path": row.get("path"),
+                        "meta": json.dumps(row.get("meta", {})),
+                    }
+                    for row in items
+                ],
+            )
+
+    def insert_paragraphs(self, rows: Iterable[dict[str, object]]) -> None:
+        """Store paragraphs once; chunks refer to them by ``seq`` range."""
 
-    def insert_markdowns(self, rows: Iterable[dict[str, object]]) -> None:
         items = list(rows)
         if not items:
             return
-        cursor = self.sqlite_conn.cursor()
-        cursor.executemany(
-            "INSERT INTO kb_markdowns (id, document_id, section_id, content, token_count, char_start, char_end, start_page, end_page, emb, tsv)"
-            " VALUES (:id, :document_id, :section_id, :content, :token_count, :char_start, :char_end, :start_page, :end_page, :emb, :tsv)",
-            [
-                {
-                    "id": row.get("id"),
-                    "document_id": row.get("document_id"),
-                    "section_id": row.get("section_id"),
-                    "content": row.get("content"),
-                    "token_count": row.get("token_count"),
-                    "char_start": row.get("char_start"),
-                    "char_end": row.get("char_end"),
-                    "start_page": row.get("start_page"),
-                    "end_page": row.get("end_page"),
-                    "emb": json.dumps(row.get("emb")),
-                    "tsv": row.get("tsv"),
-                }
-                for row in items
-            ],
-        )
-        self.sqlite_conn.commit()
-        self.index.upsert(
-            VectorItem(
-                id=str(row.get("id")),
-                embedding=[float(value) for value in row.get("emb", [])],
-                metadata={
-                    "document_id": row.get("document_id"),
-                    "section_id": row.get("section_id"),
-                },
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO kb_paragraphs (id, document_id, section_id, seq, page, char_start, char_end, content)"
+                " VALUES (:id, :document_id, :section_id, :seq, :page, :char_start, :char_end, :content)",
+                [
+                    {
+                        "id": row.get("id"),
+                        "document_id": row.get("document_id"),
+                        "section_id": row.get("section_id"),
+                        "seq": row.get("seq"),
+                        "page": row.get("page"),
+                        "char_start": row.get("char_start"),
+                        "char_end": row.get("char_end"),
+                        "content": row.get("content"),
+                    }
+                    for row in items
+                ],
             )
-            for row in items
+
+    def insert_markdowns(
+        self,
+        rows: Iterable[dict[str, object]],
+        embeddings: np.ndarray | None = None,
+    ) -> None:
+        """Insert chunk rows; ``embeddings`` (one float32 row per chunk) overrides ``emb``.
+
+        A row with ``paragraph_start``/``paragraph_end`` and no ``content`` is
+        stored as a range over :meth:`insert_paragraphs` rows, which must be
+        inserted first. Each distinct ``content_hash`` (see :func:`content_hash`)
+        keeps one embedding and one vector index row however many chunks cite
+        it; rows without one are keyed by their ``id`` and never shared.
+        """
+
+        items = list(rows)
+        if not items:
+            return
+        if embeddings is None:
+            embeddings = np.stack([np.asarray(row.get("emb"), dtype=np.float32) for row in items])
+        else:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+        hashes = [str(row.get("content_hash") or row.get("id")) for row in items]
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO kb_embeddings (content_hash, emb) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in zip(hashes, embeddings)],
+            )
+            connection.executemany(
+                "INSERT INTO kb_markdowns (id, document_id, section_id, content, token_count, char_start, char_end,"
+                " start_page, end_page, paragraph_start, paragraph_end, content_hash, tsv)"
+                " VALUES (:id, :document_id, :section_id, :content, :token_count, :char_start, :char_end,"
+                " :start_page, :end_page, :paragraph_start, :paragraph_end, :content_hash, :tsv)",
+                [
+                    {
+                        "id": row.get("id"),
+                        "document_id": row.get("document_id"),
+                        "section_id": row.get("section_id"),
+                        "content": row.get("content"),
+                        "token_count": row.get("token_count"),
+                        "char_start": row.get("char_start"),
+                        "char_end": row.get("char_end"),
+                        "start_page": row.get("start_page"),
+                        "end_page": row.get("end_page"),
+                        "paragraph_start": row.get("paragraph_start"),
+                        "paragraph_end": row.get("paragraph_end"),
+                        "content_hash": key,
+                        "tsv": row.get("tsv"),
+                    }
+                    for row, key in zip(items, hashes)
+                ],
+            )
+            affected = sorted(set(hashes))
+            self._after_commit.append(lambda: self._sync_index(affected))
+            if self.router is not None:
+                document_ids = {str(row.get("document_id")) for row in items}
+                self._after_commit.append(lambda: self._refresh_routes(document_ids))
+
+    def fetch_embeddings(self, hashes: Iterable[str]) -> dict[str, np.ndarray]:
+        """Return the stored embeddings for the content ``hashes`` already known."""
+
+        ordered = sorted(set(hashes))
+        if not ordered:
+            return {}
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT content_hash, emb FROM kb_embeddings WHERE content_hash IN (SELECT value FROM json_each(?))",
+                (json.dumps(ordered),),
+            ).fetchall()
+        return {row["content_hash"]: decode_embedding(row["emb"]) for row in rows}
+
+    def _sync_index(self, hashes: Sequence[str]) -> None:
+        """Make the index rows of ``hashes`` match the chunks now citing them.
+
+        A hash cited from several documents (or sections) is stored once with
+        :data:`_SHARED` in place of the differing value and a page span covering
+        every location; searches widen their filters to admit it and then
+        check the exact locations in SQL.
+        """
+
+        with self.connect(write=True) as connection:
+            ids, embeddings, metadata = _index_entries(connection, hashes)
+        live = set(ids)
+        gone = [key for key in hashes if key not in live]
+        if gone:
+            self.index.delete(gone)
+        if ids:
+            self.index.bulk_load(ids, embeddings, metadata)
+
+    def _refresh_routes(self, document_ids: set[str]) -> None:
+        """Recompute the routing centroids of ``document_ids`` from their chunks."""
+
+        ordered = sorted(document_ids)
+        placeholders = ",".join("?" for _ in ordered)
+        with self.connect(write=True) as connection:
+            rows = connection.execute(
+                f"SELECT document_id, section_id, emb FROM kb_chunks WHERE document_id IN ({placeholders})",
+                ordered,
+            ).fetchall()
+        self.router.update(
+            (row["document_id"], row["section_id"], decode_embedding(row["emb"]))
+            for row in rows
+            if row["emb"] is not None
         )
 
     # Query helpers ----------------------------------------------------
     def fetch_sections(self, document_id: str) -> dict[str, dict[str, object]]:
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute("SELECT * FROM kb_sections WHERE document_id = ?", (document_id,))
-        rows = cursor.fetchall()
+        with self.connect() as connection:
+            rows = connection.execute("SELECT * FROM kb_sections WHERE document_id = ?", (document_id,)).fetchall()
         return {str(row["id"]): dict(row) for row in rows}
 
     def fetch_markdowns(self) -> list[dict[str, object]]:
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute("SELECT * FROM kb_markdowns")
-        return [dict(row) for row in cursor.fetchall()]
+        with self.connect() as connection:
+            return [dict(row) for row in connection.execute("SELECT * FROM kb_chunks")]
+
+    def fetch_paragraphs(
+        self, document_id: str, start: int | None = None, end: int | None = None
+    ) -> list[dict[str, object]]:
+        """Return a document's paragraphs in order, optionally only ``start``..``end`` (inclusive).
+
+        A hit's ``paragraph_start``/``paragraph_end`` select exactly the
+        paragraphs it was built from, e.g. for paragraph-level citations.
+        """
+
+        query = "SELECT * FROM kb_paragraphs WHERE document_id = ?"
+        params: list[object] = [document_id]
+        if start is not None:
+            query += " AND seq >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND seq <= ?"
+            params.append(end)
+        with self.connect() as connection:
+            return [dict(row) for row in connection.execute(query + " ORDER BY seq", params)]
 
     def vector_search(
         self,
@@ -241,87 +801,673 @@ class Database:
         *,
         limit: int,
         keywords: Sequence[str] | None = None,
-    ) -> list[dict[str, object]]:
-        total = self.index.count()
-        if total == 0:
-            return []
-        raw_hits = self.index.search(embedding, limit=total)
-        if not raw_hits:
-            return []
-        chunk_ids = [chunk_id for chunk_id, _ in raw_hits]
-        placeholders = ",".join("?" for _ in chunk_ids)
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute(
-            f"SELECT id, document_id, section_id, content, start_page, end_page, token_count, tsv FROM kb_markdowns WHERE id IN ({placeholders})",
-            chunk_ids,
-        )
-        rows = {row["id"]: row for row in cursor.fetchall()}
-        keywords_normalized = [kw.lower() for kw in keywords or []]
-        results: list[dict[str, object]] = []
-        for chunk_id, score in raw_hits:
-            row = rows.get(chunk_id)
-            if row is None:
-                continue
-            if keywords_normalized:
-                tokens = str(row["tsv"]).split()
-                if not any(term in tokens for term in keywords_normalized):
-                    continue
-            results.append(
-                {
-                    "id": chunk_id,
-                    "document_id": row["document_id"],
-                    "section_id": row["section_id"],
-                    "content": row["content"],
-                    "start_page": row["start_page"],
-                    "end_page": row["end_page"],
-                    "token_count": row["token_count"],
-                    "score": score,
+        filters: SearchFilter | None = None,
+        deadline_ms: float | None = None,
+    ) -> SearchResults:
+        """Rank chunks for ``embedding``.
+
+        With ``deadline_ms`` the index scan (or, on the lexical-first plan, the
+        scoring of keyword matches) stops once the budget is spent and the best
+        rows found so far are returned with ``partial`` set.
+        """
+
+        return self.search_many(
+            [embedding],
+            limit=limit,
+            keywords=[keywords or []],
+            filters=filters,
+            deadline_ms=deadline_ms,
+        )[0]
+
+    def search_many(
+        self,
+        embeddings: np.ndarray | Sequence[Sequence[float]],
+        *,
+        limit: int,
+        keywords: Sequence[Sequence[str]] | None = None,
+        filters: SearchFilter | None = None,
+        deadline_ms: float | None = None,
+    ) -> list[SearchResults]:
+        """Run :meth:`vector_search` for several queries with one index pass.
+
+        ``keywords`` optionally holds one keyword list per query. Candidates are
+        fetched from the index in growing pages (``limit``, then four times as
+        many, ...) until enough of them match the keywords, and only the
+        survivors are read back from SQLite. The index ranks distinct chunk
+        contents; each hit lists every chunk citing its content, filtered, in
+        ``locations``, and describes the first of them.
+        """
+
+        deadline = None if deadline_ms is None else time.monotonic() + deadline_ms / 1000.0
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if queries.size == 0:
+            return [SearchResults() for _ in range(queries.shape[0])]
+        keyword_lists = [tuple(sorted({kw.lower() for kw in terms})) for terms in keywords or []]
+        keyword_lists += [() for _ in range(queries.shape[0] - len(keyword_lists))]
+        with self.connect() as connection:
+            # read the index only while holding a reader, which rebuild_index waits for
+            total = self.index.count()
+            if total == 0 or limit <= 0:
+                return [SearchResults() for _ in range(queries.shape[0])]
+            survivors: list[list[tuple[str, float]]] = [[] for _ in range(queries.shape[0])]
+            truncated = [False] * queries.shape[0]
+            frequencies: dict[str, int] = {}
+            pending = []
+            for idx, terms in enumerate(keyword_lists):
+                plan = self._plan(connection, terms, limit, total, frequencies)
+                if plan.strategy == "lexical-first":
+                    survivors[idx], truncated[idx] = self._lexical_first(
+                        connection, queries[idx], terms, limit, filters, deadline
+                    )
+                else:
+                    pending.append(idx)
+            page = limit
+            while pending:
+                page = min(page, total)
+                hit_lists, cut = self._index_search(queries[pending], page, filters, deadline)
+                candidates: dict[tuple[str, ...], set[str]] = {}
+                for idx, hits in zip(pending, hit_lists):
+                    candidates.setdefault(keyword_lists[idx], set()).update(key for key, _ in hits)
+                matches = {
+                    terms: self._matching_hashes(connection, terms, filters, sorted(keys))
+                    for terms, keys in candidates.items()
                 }
-            )
-            if len(results) >= limit:
+                expired = cut or (deadline is not None and time.monotonic() >= deadline)
+                remaining: list[int] = []
+                for idx, hits in zip(pending, hit_lists):
+                    kept = [hit for hit in hits if hit[0] in matches[keyword_lists[idx]]]
+                    survivors[idx] = kept[:limit]
+                    # a short page means the index (or its filtered view) is exhausted
+                    if len(kept) >= limit or len(hits) < page or page >= total:
+                        truncated[idx] = cut
+                    elif expired:
+                        truncated[idx] = True
+                    else:
+                        remaining.append(idx)
+                pending = remaining
+                page *= 4
+            locations = self._fetch_chunks(connection, sorted({key for hits in survivors for key, _ in hits}), filters)
+            return [
+                SearchResults(
+                    (_hit(locations[key], score) for key, score in hits if key in locations),
+                    partial=partial,
+                )
+                for hits, partial in zip(survivors, truncated)
+            ]
+
+    def explain(self, keywords: Sequence[str], *, limit: int) -> QueryPlan:
+        """Return the plan :meth:`vector_search` would use for ``keywords``."""
+
+        terms = tuple(sorted({kw.lower() for kw in keywords}))
+        with self.connect() as connection:
+            return self._plan(connection, terms, limit, self.index.count(), {})
+
+    def _plan(
+        self,
+        connection: sqlite3.Connection,
+        terms: tuple[str, ...],
+        limit: int,
+        total: int,
+        frequencies: dict[str, int],
+    ) -> QueryPlan:
+        """Pick vector-first or lexical-first retrieval from term document frequencies.
+
+        Vector-first pays a full index pass per candidate page plus a keyword
+        check of every candidate; lexical-first reads each keyword match from
+        SQLite and scores it directly. ``frequencies`` caches lookups.
+        """
+
+        if not terms:
+            return QueryPlan("vector-first", terms, total, total, total * _SCAN_ROW_COST, math.inf)
+        for term in terms:
+            if term not in frequencies:
+                frequencies[term] = self._term_frequency(connection, term)
+        estimated = min(total, sum(frequencies[term] for term in terms))
+        needed = limit * total / estimated if estimated else math.inf
+        passes, fetched, page = 0, 0, max(limit, 1)
+        while True:
+            rows = min(page, total)
+            passes += 1
+            fetched += rows
+            if rows >= needed or rows >= total:
                 break
-        if len(results) < limit and keywords_normalized:
-            # fall back to scanning rows not surfaced by the index yet
-            seen = {row["id"] for row in results}
-            cursor.execute(
-                "SELECT id, document_id, section_id, content, start_page, end_page, token_count, emb, tsv FROM kb_markdowns"
-            )
-            for row in cursor.fetchall():
-                if row["id"] in seen:
-                    continue
-                tokens = str(row["tsv"]).split()
-                if not any(term in tokens for term in keywords_normalized):
-                    continue
-                vector = json.loads(row["emb"])
-                score = self._cosine_similarity(embedding, vector)
-                results.append(
-                    {
-                        "id": row["id"],
-                        "document_id": row["document_id"],
-                        "section_id": row["section_id"],
-                        "content": row["content"],
-                        "start_page": row["start_page"],
-                        "end_page": row["end_page"],
-                        "token_count": row["token_count"],
-                        "score": score,
-                    }
+            page *= 4
+        vector_cost = passes * total * _SCAN_ROW_COST + fetched * _FETCH_ROW_COST
+        lexical_cost = estimated * _FETCH_ROW_COST
+        strategy = "lexical-first" if lexical_cost < vector_cost else "vector-first"
+        return QueryPlan(strategy, terms, total, estimated, vector_cost, lexical_cost)
+
+    def _term_frequency(self, connection: sqlite3.Connection, term: str) -> int:
+        """Number of chunks containing ``term`` (an upper bound for phrases and prefixes)."""
+
+        prefix = term.endswith("*")
+        tokens = _TERM_TOKEN_RE.findall(term.rstrip("*"))
+        if not tokens:
+            return 0
+        cursor = connection.cursor()
+        counts = []
+        for position, token in enumerate(tokens):
+            if prefix and position == len(tokens) - 1:
+                cursor.execute(
+                    "SELECT COALESCE(SUM(doc), 0) FROM kb_markdowns_terms WHERE term >= ? AND term < ?",
+                    (token, token + "\U0010ffff"),
                 )
-                if len(results) >= limit:
+            else:
+                cursor.execute("SELECT COALESCE(SUM(doc), 0) FROM kb_markdowns_terms WHERE term = ?", (token,))
+            counts.append(int(cursor.fetchone()[0]))
+        return min(counts)
+
+    def _lexical_first(
+        self,
+        connection: sqlite3.Connection,
+        query: np.ndarray,
+        terms: Sequence[str],
+        limit: int,
+        filters: SearchFilter | None,
+        deadline: float | None = None,
+    ) -> tuple[list[tuple[str, float]], bool]:
+        """Score only the contents matching ``terms`` against ``query``.
+
+        Matches are scored in ``_LEXICAL_BATCH``-row blocks. Once ``deadline``
+        passes the scan stops after the current block and the second value,
+        ``partial``, is ``True``.
+        """
+
+        where, params = _filter_clause(filters, "kb_markdowns_fts MATCH ?")
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT kb_chunks.content_hash, emb FROM kb_markdowns_fts"
+            " JOIN kb_chunks ON kb_chunks.chunk_rowid = kb_markdowns_fts.rowid"
+            + where,
+            [*params, _fts_query(terms)],
+        )
+        query_norm = float(np.linalg.norm(query))
+        seen: set[str] = set()
+        best: list[tuple[str, float]] = []
+        while batch := cursor.fetchmany(_LEXICAL_BATCH):
+            rows = {row["content_hash"]: row for row in batch if row["content_hash"] not in seen}
+            if rows:
+                seen.update(rows)
+                matrix = np.stack([decode_embedding(row["emb"]) for row in rows.values()])
+                if matrix.shape[1] != query.shape[0]:
+                    raise ValueError("Embedding dimension mismatch")
+                norms = np.linalg.norm(matrix, axis=1) * query_norm
+                dots = matrix @ query
+                scores = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+                best.extend(zip(rows, scores.tolist()))
+                best.sort(key=lambda hit: -hit[1])
+                del best[limit:]
+            if deadline is not None and time.monotonic() >= deadline:
+                return best, cursor.fetchone() is not None
+        return best, False
+
+    def _fetch_chunks(
+        self, connection: sqlite3.Connection, hashes: Sequence[str], filters: SearchFilter | None = None
+    ) -> dict[str, list[sqlite3.Row]]:
+        """Read every chunk citing ``hashes`` (and passing ``filters``) in one statement."""
+
+        if not hashes:
+            return {}
+        where, params = _filter_clause(filters, "content_hash IN (SELECT value FROM json_each(?))")
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT id, document_id, section_id, content, start_page, end_page, token_count, paragraph_start,"
+            " paragraph_end, content_hash FROM kb_chunks"
+            + where
+            + " ORDER BY document_id, paragraph_start, id",
+            [*params, json.dumps(list(hashes))],
+        )
+        locations: dict[str, list[sqlite3.Row]] = {}
+        for row in cursor.fetchall():
+            locations.setdefault(row["content_hash"], []).append(row)
+        return locations
+
+    def lexical_search(
+        self,
+        keywords: Sequence[str],
+        *,
+        limit: int,
+        filters: SearchFilter | None = None,
+    ) -> SearchResults:
+        """Rank chunks by BM25 over the FTS5 index, without vectors.
+
+        A keyword containing spaces is matched as a phrase and a trailing ``*``
+        makes it a prefix query. Each hit carries ``offsets``, the character
+        spans of the matched terms inside ``content``. Chunks sharing one
+        content are folded into a single hit, as in :meth:`search_many`.
+        """
+
+        terms = sorted({kw.lower() for kw in keywords if kw.strip(" *")})
+        results = SearchResults(lexical_only=True)
+        if not terms or limit <= 0:
+            return results
+        where, params = _filter_clause(filters, "kb_markdowns_fts MATCH ?")
+        ranked: dict[str, sqlite3.Row] = {}
+        with self.connect() as connection:
+            cursor = connection.execute(
+                "SELECT kb_chunks.content_hash, bm25(kb_markdowns_fts) AS rank,"
+                " highlight(kb_markdowns_fts, 0, char(2), char(3)) AS marked"
+                " FROM kb_markdowns_fts JOIN kb_chunks ON kb_chunks.chunk_rowid = kb_markdowns_fts.rowid"
+                + where
+                + " ORDER BY rank",
+                [*params, _fts_query(terms)],
+            )
+            for row in cursor:
+                ranked.setdefault(row["content_hash"], row)
+                if len(ranked) >= limit:
                     break
-        results.sort(key=lambda item: float(item.get("score", 0.0)), reverse=True)
-        return results[:limit]
+            cursor.close()
+            locations = self._fetch_chunks(connection, sorted(ranked), filters)
+        for key, row in ranked.items():
+            if key not in locations:
+                continue
+            # bm25() is lower-is-better; flip it so scores sort like similarities
+            hit = _hit(locations[key], -float(row["rank"]))
+            hit["offsets"] = _highlight_offsets(row["marked"])
+            results.append(hit)
+        return results
 
-    # Utilities --------------------------------------------------------
-    @staticmethod
-    def _cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
-        if len(a) != len(b):
-            raise ValueError("Embedding dimension mismatch")
-        dot = sum(x * y for x, y in zip(a, b))
-        norm_a = sum(x * x for x in a) ** 0.5
-        norm_b = sum(x * x for x in b) ** 0.5
-        if norm_a == 0 or norm_b == 0:
-            return 0.0
-        return dot / (norm_a * norm_b)
-
-
-__all__ = ["Database"]
+    def _matching_hashes(
+        self,
+        connection: sqlite3.Connection,
+        terms: Sequence[str],
+        filters: SearchFilter | None,
+        hashes: Sequence[str],
+    ) -> set[str]:
+        """Return the ``hashes`` cited by a chunk that passes ``filters`` and matches any of ``terms``."""
+
+        if not hashes:
+            return set()
+        if not terms and filters is None:
+            return set(hashes)
+        conditions = ["kb_markdowns.content_hash IN (SELECT value FROM json_each(?))"]
+        if terms:
+            conditions.append("kb_markdowns_fts MATCH ?")
+        where, params = _filter_clause(filters, *conditions)
+        source = "kb_markdowns"
+        if terms:
+            source += " JOIN kb_markdowns_fts ON kb_markdowns_fts.rowid = kb_markdowns.rowid"
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT DISTINCT kb_markdowns.content_hash FROM {source}" + where,
+            [*params, json.dumps(list(hashes)), *([_fts_query(terms)] if terms else [])],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def _index_search(
+        self,
+        queries: np.ndarray,
+        limit: int,
+        filters: SearchFilter | None,
+        deadline: float | None = None,
+    ) -> tuple[list[list[tuple[str, float]]], bool]:
+        """Search the vector index, through the router when one is configured."""
+
+        groups: dict[SearchFilter | None, list[int]] = {}
+        for idx, query in enumerate(queries):
+            scope = self.router.route(query, filters) if self.router is not None else filters
+            groups.setdefault(_admit_shared(scope), []).append(idx)
+        hit_lists: list[list[tuple[str, float]]] = [[] for _ in range(queries.shape[0])]
+        partial = False
+        for scope, members in groups.items():
+            if deadline is None:
+                found = self.index.search_many(queries[members], limit=limit, filters=scope)
+            else:
+                found, cut = self.index.search_within(
+                    queries[members], limit, deadline=deadline, filters=scope
+                )
+                partial = partial or cut
+            for idx, hits in zip(members, found):
+                hit_lists[idx] = hits
+        return hit_lists, partial
+
+    # Index maintenance ------------------------------------------------
+    def verify_index(self) -> IndexReport:
+        """Compare the vector index with the content hashes SQLite cites.
+
+        ``missing`` hashes have no index row, e.g. after a crash between the
+        SQL commit and the index write; ``orphaned`` index rows belong to no
+        chunk. The writer is held so no ingest lands mid-comparison.
+        """
+
+        with self.connect(write=True) as connection:
+            return self._verify(connection)
+
+    def rebuild_index(self) -> IndexReport:
+        """Rebuild the vector index (and routing centroids) from SQLite and swap it in.
+
+        Embeddings are streamed in ``_REBUILD_BATCH``-row matrices into a fresh
+        index in ``<name>.index.rebuild`` while the writer is held, so searches
+        keep running on the old index. The swap itself waits for in-flight
+        searches to finish (:meth:`ConnectionPool.exclusive`), then renames the
+        new directory over the live one and reopens it as :attr:`index`.
+        Returns the inconsistencies found before the rebuild.
+
+        The writer lock only excludes writers in this process: another process
+        writing to the same database during a rebuild is not stopped, and its
+        index writes land in the directory about to be replaced. Run the
+        rebuild while nothing else writes, or verify afterwards. A crash
+        between the two renames leaves the old index in ``<name>.index.old``,
+        which the next :class:`Database` opened on the path moves back.
+        """
+
+        if self._open_index is None:
+            raise ValueError("rebuild_index needs an index opened by Database, not an injected backend")
+        staging = self._index_dir.with_name(self._index_dir.name + ".rebuild")
+        retired = self._index_dir.with_name(self._index_dir.name + ".old")
+        with self.connect(write=True) as connection:
+            report = self._verify(connection)
+            shutil.rmtree(staging, ignore_errors=True)
+            fresh = self._open_index(staging)
+            try:
+                for hashes in _cited_hashes(connection):
+                    fresh.bulk_load(*_index_entries(connection, hashes))
+            finally:
+                fresh.close()
+            rebuild_routes = self.router is not None and self.router.documents.base_path == self._index_dir
+            if rebuild_routes:
+                router = self._new_router(staging)
+                try:
+                    rows = connection.execute("SELECT document_id, section_id, emb FROM kb_chunks ORDER BY document_id")
+                    for _, chunks in itertools.groupby(rows, key=lambda row: row["document_id"]):
+                        router.update((row["document_id"], row["section_id"], decode_embedding(row["emb"])) for row in chunks)
+                finally:
+                    router.close()
+            with self.pool.exclusive():
+                if rebuild_routes:
+                    self.router.close()
+                # close before the rename so no pending write lands in the new directory
+                self.index.close()
+                shutil.rmtree(retired, ignore_errors=True)
+                if self._index_dir.exists():
+                    self._index_dir.rename(retired)
+                staging.rename(self._index_dir)
+                self.index = self._open_index(self._index_dir)
+                if rebuild_routes:
+                    self.router = self._new_router(self._index_dir)
+            shutil.rmtree(retired, ignore_errors=True)
+        return report
+
+    def _verify(self, connection: sqlite3.Connection) -> IndexReport:
+        unmatched = set(self.index.ids())
+        indexed = len(unmatched)
+        expected = 0
+        missing: list[str] = []
+        for hashes in _cited_hashes(connection):
+            expected += len(hashes)
+            missing.extend(key for key in hashes if key not in unmatched)
+            unmatched.difference_update(hashes)
+        return IndexReport(expected, indexed, tuple(missing), tuple(sorted(unmatched)))
+
+    def _new_router(self, directory: Path) -> CentroidRouter:
+        return CentroidRouter(
+            directory,
+            max_documents=self.router.max_documents,
+            max_sections=self.router.max_sections,
+            min_routes=self.router.min_routes,
+        )
+
+    def routing_accuracy(
+        self,
+        embeddings: np.ndarray | Sequence[Sequence[float]] | None = None,
+        *,
+        k: int = 10,
+        sample: int = 100,
+    ) -> float:
+        """Mean recall@k of routed searches against exhaustive ones for ``embeddings``.
+
+        Without ``embeddings``, up to ``sample`` stored chunk embeddings picked
+        at random stand in for queries.
+        """
+
+        if self.router is None:
+            return 1.0
+        with self.connect() as connection:
+            if embeddings is None:
+                rows = connection.execute(
+                    "SELECT emb FROM kb_embeddings WHERE emb IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+                    (sample,),
+                ).fetchall()
+                if not rows:
+                    return 1.0
+                embeddings = np.stack([decode_embedding(row["emb"]) for row in rows])
+            queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+            exact = self.index.search_many(queries, limit=k)
+            routed, _ = self._index_search(queries, k, None)
+        recalls = [
+            len({id_ for id_, _ in got} & {id_ for id_, _ in want}) / len(want)
+            for got, want in zip(routed, exact)
+            if want
+        ]
+        return float(np.mean(recalls)) if recalls else 1.0
+
+
+class SearchResults(list):
+    """Ranked hits plus flags describing how complete the search was.
+
+    ``partial`` is set when a deadline stopped the scan early and
+    ``lexical_only`` when no vector search ran at all.
+    """
+
+    def __init__(self, hits: Iterable[object] = (), *, partial: bool = False, lexical_only: bool = False) -> None:
+        super().__init__(hits)
+        self.partial = partial
+        self.lexical_only = lexical_only
+
+
+def _hit(locations: Sequence[sqlite3.Row], score: float) -> dict[str, object]:
+    row = locations[0]
+    return {
+        "id": row["id"],
+        "document_id": row["document_id"],
+        "section_id": row["section_id"],
+        "content": row["content"],
+        "start_page": row["start_page"],
+        "end_page": row["end_page"],
+        "token_count": row["token_count"],
+        "paragraph_start": row["paragraph_start"],
+        "paragraph_end": row["paragraph_end"],
+        "content_hash": row["content_hash"],
+        "score": score,
+        "locations": [
+            {
+                "id": location["id"],
+                "document_id": location["document_id"],
+                "section_id": location["section_id"],
+                "start_page": location["start_page"],
+                "end_page": location["end_page"],
+                "paragraph_start": location["paragraph_start"],
+                "paragraph_end": location["paragraph_end"],
+            }
+            for location in locations
+        ],
+    }
+
+
+def content_hash(text: str) -> str:
+    """Return the dedup key of a chunk: SHA-256 of its whitespace-normalised text."""
+
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def _index_entries(
+    connection: sqlite3.Connection, hashes: Sequence[str]
+) -> tuple[list[str], np.ndarray, list[dict[str, object]]]:
+    """Build the vector index rows (ids, embeddings, metadata) for cited ``hashes``."""
+
+    rows = connection.execute(
+        "SELECT m.content_hash, e.emb,"
+        " COUNT(DISTINCT m.document_id) AS documents, MIN(m.document_id) AS document_id,"
+        " COUNT(DISTINCT COALESCE(m.section_id, '')) AS sections, MIN(m.section_id) AS section_id,"
+        " MIN(m.start_page) AS start_page, MAX(COALESCE(m.end_page, m.start_page)) AS end_page"
+        " FROM kb_markdowns m JOIN kb_embeddings e ON e.content_hash = m.content_hash"
+        " WHERE m.content_hash IN (SELECT value FROM json_each(?)) GROUP BY m.content_hash",
+        (json.dumps(list(hashes)),),
+    ).fetchall()
+    if not rows:
+        return [], np.empty((0, 0), dtype=np.float32), []
+    metadata = [
+        {
+            "document_id": row["document_id"] if row["documents"] == 1 else _SHARED,
+            "section_id": row["section_id"] if row["sections"] == 1 else _SHARED,
+            "start_page": row["start_page"],
+            "end_page": row["end_page"],
+        }
+        for row in rows
+    ]
+    embeddings = np.stack([decode_embedding(row["emb"]) for row in rows])
+    return [row["content_hash"] for row in rows], embeddings, metadata
+
+
+def _cited_hashes(connection: sqlite3.Connection) -> Iterator[list[str]]:
+    """Yield every content hash cited by a chunk, in sorted batches of ``_REBUILD_BATCH``."""
+
+    last = ""
+    while True:
+        hashes = [
+            row[0]
+            for row in connection.execute(
+                "SELECT DISTINCT content_hash FROM kb_markdowns WHERE content_hash > ? ORDER BY content_hash LIMIT ?",
+                (last, _REBUILD_BATCH),
+            )
+        ]
+        if not hashes:
+            return
+        yield hashes
+        last = hashes[-1]
+
+
+def _recover_index(index_dir: Path) -> None:
+    """Finish a :meth:`Database.rebuild_index` swap that a crash interrupted."""
+
+    retired = index_dir.with_name(index_dir.name + ".old")
+    if not retired.exists():
+        return
+    if index_dir.exists():
+        # the rebuilt index was renamed into place; only the cleanup is left
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        retired.rename(index_dir)
+
+
+def _admit_shared(filters: SearchFilter | None) -> SearchFilter | None:
+    """Widen ``filters`` to index rows whose content several locations share."""
+
+    if filters is None:
+        return None
+    return SearchFilter(
+        document_ids=None if filters.document_ids is None else filters.document_ids | {_SHARED},
+        section_ids=None if filters.section_ids is None else filters.section_ids | {_SHARED},
+        pages=filters.pages,
+    )
+
+
+def decode_embedding(value: bytes | str) -> np.ndarray:
+    """Return a stored ``emb`` value as a float32 vector.
+
+    BLOBs are viewed without copying; JSON text from databases that predate
+    migration ``003`` is still parsed.
+    """
+
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.frombuffer(value, dtype=np.float32)
+
+
+def _fts_query(terms: Iterable[str]) -> str:
+    """Build an FTS5 ``MATCH`` expression that accepts any of ``terms``."""
+
+    clauses = []
+    for term in terms:
+        prefix = term.endswith("*")
+        quoted = '"' + term.rstrip("*").replace('"', '""') + '"'
+        clauses.append(quoted + "*" if prefix else quoted)
+    return " OR ".join(clauses)
+
+
+def _highlight_offsets(marked: str) -> list[tuple[int, int]]:
+    """Turn ``highlight()`` output delimited by char(2)/char(3) into character spans."""
+
+    offsets: list[tuple[int, int]] = []
+    position = 0
+    start = 0
+    for char in marked:
+        if char == "\x02":
+            start = position
+        elif char == "\x03":
+            offsets.append((start, position))
+        else:
+            position += 1
+    return offsets
+
+
+def _filter_clause(filters: SearchFilter | None, *conditions: str) -> tuple[str, list[object]]:
+    """Return a ``WHERE`` clause and parameters equivalent to ``filters``.
+
+    Extra ``conditions`` are ANDed after the filter; their parameters follow
+    the returned ones.
+    """
+
+    clauses: list[str] = []
+    params: list[object] = []
+    if filters is None:
+        filters = SearchFilter()
+    for column, values in (("document_id", filters.document_ids), ("section_id", filters.section_ids)):
+        if values is not None:
+            ordered = sorted(values)
+            clauses.append(f"{column} IN ({','.join('?' for _ in ordered) or 'NULL'})")
+            params.extend(ordered)
+    if filters.pages is not None:
+        clauses.append("start_page IS NOT NULL AND COALESCE(end_page, start_page) >= ? AND start_page <= ?")
+        params.extend(filters.pages)
+    clauses.extend(conditions)
+    if not clauses:
+        return "", []
+    return " WHERE " + " AND ".join(clauses), params
+
+
+def _configure_connection(connection: sqlite3.Connection, settings: Settings, *, readonly: bool = False) -> None:
+    """Apply the journaling and cache profile from ``settings`` to ``connection``."""
+
+    synchronous = settings.sqlite_synchronous.upper()
+    if synchronous not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+        raise ValueError(f"Unsupported SQLITE_SYNCHRONOUS value: {settings.sqlite_synchronous}")
+    if settings.sqlite_wal and not readonly:
+        connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(f"PRAGMA synchronous={synchronous}")
+    connection.execute(f"PRAGMA cache_size={-settings.sqlite_cache_mb * 1024}")
+    connection.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_mb * 1024 * 1024}")
+    connection.execute("PRAGMA temp_store=MEMORY")
+
+
+def _index_options(settings: Settings) -> dict[str, object]:
+    """Translate environment settings into vector index constructor options."""
+
+    options: dict[str, object] = {"preferred": settings.vector_backend, "shards": settings.index_shards}
+    if settings.vector_backend in ("hnsw", "chroma"):
+        options.update(
+            m=settings.hnsw_m,
+            ef_construction=settings.hnsw_ef_construction,
+            ef_search=settings.hnsw_ef_search,
+        )
+    elif settings.vector_backend == "ivfpq":
+        options.update(
+            nlist=settings.ivf_nlist,
+            nprobe=settings.ivf_nprobe,
+            pq_m=settings.pq_m,
+            rerank=settings.ivf_rerank,
+            block_rows=settings.index_block_rows,
+        )
+    else:
+        options.update(
+            mmap=settings.index_mmap,
+            block_rows=settings.index_block_rows,
+            storage=settings.index_storage,
+            rerank_depth=settings.index_rerank_depth,
+            prefix_dims=settings.index_prefix_dims,
+            hot_rows=settings.index_hot_rows,
+        )
+    return options
+
+
+__all__ = ["Database", "IndexReport", "QueryPlan", "SearchResults", "content_hash", "decode_embedding"]
@@ -2,13 +2,15 @@
 
 from __future__ import annotations
 
-import os
 import hashlib
+import os
 import random
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Iterable, Sequence
 
+import numpy as np
+
 try:  # pragma: no cover - optional dependency
     from openai import OpenAI  # type: ignore
 except Exception:  # pragma: no cover - optional dependency
@@ -28,6 +30,9 @@ class EmbeddingClient:
     _client: object = field(init=False)
     _fallback: bool = field(init=False, default=False)
 
+    # Requests larger than this are split; the API caps inputs per call.
+    _API_BATCH = 512
+
     def __post_init__(self) -> None:
         base = Path(".cache/emb")
         base.mkdir(parents=True, exist_ok=True)
@@ -47,30 +52,53 @@ class EmbeddingClient:
                 self._fallback = False
 
     def embed_texts(self, texts: Iterable[str]) -> list[list[float]]:
-        outputs: list[list[float]] = []
-        for text in texts:
-            key = stable_hash([self.model, text])
-            cached = self.cache.get("embeddings", key) if self.cache else None
+        return self.embed_matrix(list(texts)).tolist()
+
+    def embed_matrix(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a ``(len(texts), dimension)`` float32 matrix of embeddings.
+
+        Cached rows are read back as raw float32 ``.npy`` data and copied
+        straight into the output; misses are sent to the API in batches, so no
+        per-value Python floats are built here.
+        """
+
+        output = np.empty((len(texts), self.dimension), dtype=np.float32)
+        missing: list[int] = []
+        keys = [stable_hash([self.model, text]) for text in texts]
+        for idx, key in enumerate(keys):
+            cached = self._cached(key)
             if cached is not None:
-                outputs.append([float(v) for v in cached])
-                continue
-            embedding = self._embed_single(text)
+                output[idx] = cached
+            else:
+                missing.append(idx)
+        for start in range(0, len(missing), self._API_BATCH):
+            batch = missing[start : start + self._API_BATCH]
+            output[batch] = self._embed_batch([texts[idx] for idx in batch])
             if self.cache is not None:
-                self.cache.set("embeddings", key, embedding)
-            outputs.append(embedding)
-        return outputs
+                for idx in batch:
+                    self.cache.set_array("embeddings", keys[idx], output[idx])
+        return output
+
+    def _cached(self, key: str) -> np.ndarray | list[float] | None:
+        if self.cache is None:
+            return None
+        cached = self.cache.get_array("embeddings", key)
+        if cached is None:
+            # Entries cached as JSON lists before the array format still count.
+            cached = self.cache.get("embeddings", key)
+        return cached
 
     # ------------------------------------------------------------------
-    def _embed_single(self, text: str) -> list[float]:
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
         if self._client is None:
-            return self._fallback_embedding(text)
-        response = self._client.embeddings.create(model=self.model, input=[text])
-        vector = response.data[0].embedding
-        if len(vector) != self.dimension:
+            return np.asarray([self._fallback_embedding(text) for text in texts], dtype=np.float32)
+        response = self._client.embeddings.create(model=self.model, input=texts)
+        vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+        if vectors.shape[1] != self.dimension:
             raise ValueError(
-                f"Embedding dimension mismatch: expected {self.dimension}, got {len(vector)}"
+                f"Embedding dimension mismatch: expected {self.dimension}, got {vectors.shape[1]}"
             )
-        return list(map(float, vector))
+        return vectors
 
     def _fallback_embedding(self, text: str) -> list[float]:
         seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
@@ -82,8 +110,8 @@ class EmbeddingClient:
         return [float(v / norm) for v in values]
 
     # Convenience wrappers -------------------------------------------------
-    def embed_query(self, text: str) -> list[float]:
-        return self.embed_texts([text])[0]
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_matrix([text])[0]
 
-    def embed_documents(self, texts: Sequence[str]) -> list[list[float]]:
-        return self.embed_texts(texts)
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed_matrix(texts)
@@ -0,0 +1,302 @@
+"""Pure NumPy Hierarchical Navigable Small World graph for cosine search."""
+
+from __future__ import annotations
+
+import heapq
+import math
+import random
+
+import numpy as np
+
+
+class HnswGraph:
+    """Approximate nearest neighbour graph over unit-normalised vectors.
+
+    Nodes are addressed by dense integer ids in insertion order. Deleted nodes
+    stay in the graph for navigation but are never returned from ``search``.
+    Similarity is the dot product, i.e. cosine for normalised inputs.
+
+    The graph remembers which existing nodes had their links rewritten or were
+    deleted since ``mark_saved`` so ``changes`` can describe a flush as a delta
+    instead of a full snapshot.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        *,
+        m: int = 16,
+        ef_construction: int = 200,
+        seed: int = 0,
+    ) -> None:
+        if m < 2:
+            raise ValueError("m must be at least 2")
+        self.dimension = dimension
+        self.m = m
+        self.max_links0 = 2 * m
+        self.ef_construction = max(ef_construction, m)
+        self._level_mult = 1.0 / math.log(m)
+        self._rng = random.Random(seed)
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.size = 0
+        self.levels: list[int] = []
+        self.links: list[list[list[int]]] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.entry_point = -1
+        self.max_level = -1
+        self.touched: set[int] = set()
+        self.removed: list[int] = []
+
+    # ------------------------------------------------------------------
+    @property
+    def live_count(self) -> int:
+        return self.size - int(self.deleted[: self.size].sum())
+
+    def _reserve(self, rows: int) -> None:
+        capacity = self.vectors.shape[0]
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 64)
+        vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+        vectors[: self.size] = self.vectors[: self.size]
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[: self.size] = self.deleted[: self.size]
+        self.vectors, self.deleted = vectors, deleted
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+
+    def _similarities(self, query: np.ndarray, nodes: list[int]) -> np.ndarray:
+        return self.vectors[nodes] @ query
+
+    # ------------------------------------------------------------------
+    def add(self, vector: np.ndarray) -> int:
+        """Insert ``vector`` and return its node id."""
+
+        node = self.size
+        self._reserve(node + 1)
+        self.vectors[node] = vector
+        self.size += 1
+        level = self._random_level()
+        self.levels.append(level)
+        self.links.append([[] for _ in range(level + 1)])
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return node
+
+        entry = self.entry_point
+        entry_sim = float(self.vectors[entry] @ vector)
+        for layer in range(self.max_level, level, -1):
+            entry, entry_sim = self._greedy(vector, entry, entry_sim, layer)
+        candidates = [(entry_sim, entry)]
+        for layer in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(vector, candidates, self.ef_construction, layer)
+            limit = self.max_links0 if layer == 0 else self.m
+            neighbours = self._select(candidates, self.m)
+            self.links[node][layer] = neighbours
+            self.touched.update(neighbours)
+            for neighbour in neighbours:
+                links = self.links[neighbour][layer]
+                links.append(node)
+                if len(links) > limit:
+                    sims = self._similarities(self.vectors[neighbour], links)
+                    ranked = sorted(zip(sims.tolist(), links), reverse=True)
+                    self.links[neighbour][layer] = self._select(ranked, limit)
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+        return node
+
+    def mark_deleted(self, node: int) -> None:
+        self.deleted[node] = True
+        self.removed.append(node)
+
+    def search(self, query: np.ndarray, k: int, ef: int) -> list[tuple[int, float]]:
+        """Return up to ``k`` live ``(node, similarity)`` pairs, best first."""
+
+        if self.entry_point < 0 or k <= 0:
+            return []
+        entry = self.entry_point
+        entry_sim = float(self.vectors[entry] @ query)
+        for layer in range(self.max_level, 0, -1):
+            entry, entry_sim = self._greedy(query, entry, entry_sim, layer)
+        # Tombstoned nodes occupy slots in the beam, so widen it accordingly.
+        dead_ratio = 1.0 - self.live_count / max(self.size, 1)
+        beam = max(ef, k)
+        beam = int(beam / max(1.0 - dead_ratio, 0.05))
+        found = self._search_layer(query, [(entry_sim, entry)], beam, 0)
+        live = [(node, sim) for sim, node in found if not self.deleted[node]]
+        return live[:k]
+
+    # ------------------------------------------------------------------
+    def _greedy(self, query: np.ndarray, entry: int, entry_sim: float, layer: int) -> tuple[int, float]:
+        improved = True
+        while improved:
+            improved = False
+            links = self.links[entry][layer]
+            if not links:
+                break
+            sims = self._similarities(query, links)
+            best = int(np.argmax(sims))
+            if sims[best] > entry_sim:
+                entry, entry_sim = links[best], float(sims[best])
+                improved = True
+        return entry, entry_sim
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entries: list[tuple[float, int]],
+        ef: int,
+        layer: int,
+    ) -> list[tuple[float, int]]:
+        """Beam search on ``layer``; returns ``(similarity, node)`` sorted best first."""
+
+        visited = {node for _, node in entries}
+        frontier = [(-sim, node) for sim, node in entries]
+        heapq.heapify(frontier)
+        best = [(sim, node) for sim, node in entries]
+        heapq.heapify(best)
+        while len(best) > ef:
+            heapq.heappop(best)
+        while frontier:
+            neg_sim, node = heapq.heappop(frontier)
+            if len(best) >= ef and -neg_sim < best[0][0]:
+                break
+            fresh = [nb for nb in self.links[node][layer] if nb not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            sims = self._similarities(query, fresh)
+            for neighbour, sim in zip(fresh, sims.tolist()):
+                if len(best) < ef or sim > best[0][0]:
+                    heapq.heappush(frontier, (-sim, neighbour))
+                    heapq.heappush(best, (sim, neighbour))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+        return sorted(best, reverse=True)
+
+    def _select(self, candidates: list[tuple[float, int]], limit: int) -> list[int]:
+        """Diversity heuristic from the HNSW paper, topped up with the closest rejects."""
+
+        selected: list[int] = []
+        rejected: list[int] = []
+        for sim, node in candidates:
+            if len(selected) >= limit:
+                break
+            if selected:
+                closest = float(np.max(self._similarities(self.vectors[node], selected)))
+                if closest > sim:
+                    rejected.append(node)
+                    continue
+            selected.append(node)
+        for node in rejected:
+            if len(selected) >= limit:
+                break
+            selected.append(node)
+        return selected
+
+    # Persistence --------------------------------------------------------
+    def changes(self, start: int = 0) -> dict[str, np.ndarray]:
+        """Arrays recording the graph's changes since it held ``start`` nodes.
+
+        Nodes from ``start`` on are written whole; older nodes appear only when
+        their links were rewritten or they were deleted since ``mark_saved``.
+        ``changes(0)`` is therefore a full snapshot.
+        """
+
+        if start:
+            touched = sorted(node for node in self.touched if node < start)
+            deleted = sorted(set(self.removed))
+        else:
+            touched = []
+            deleted = np.flatnonzero(self.deleted[: self.size]).tolist()
+        offsets = [0]
+        flat: list[int] = []
+        for node in [*touched, *range(start, self.size)]:
+            for layer_links in self.links[node]:
+                flat.extend(layer_links)
+                offsets.append(len(flat))
+        return {
+            "vectors": self.vectors[start : self.size],
+            "levels": np.asarray(self.levels[start:], dtype=np.int32),
+            "touched": np.asarray(touched, dtype=np.int64),
+            "deleted": np.asarray(deleted, dtype=np.int64),
+            "link_offsets": np.asarray(offsets, dtype=np.int64),
+            "links": np.asarray(flat, dtype=np.int32),
+            "params": np.asarray(
+                [self.m, self.ef_construction, self.entry_point, self.max_level, start],
+                dtype=np.int64,
+            ),
+        }
+
+    def mark_saved(self) -> None:
+        """Forget the changes recorded so far; the next delta starts here."""
+
+        self.touched.clear()
+        self.removed.clear()
+
+    def apply(self, arrays: dict[str, np.ndarray]) -> None:
+        """Replay a ``changes`` record onto the graph it was taken from."""
+
+        *_, entry_point, max_level, start = (int(v) for v in arrays["params"])
+        if start != self.size:
+            raise ValueError(f"HNSW change record starts at node {start}, graph has {self.size}")
+        vectors = np.asarray(arrays["vectors"], dtype=np.float32)
+        self._reserve(start + vectors.shape[0])
+        self.vectors[start : start + vectors.shape[0]] = vectors
+        self.size += vectors.shape[0]
+        offsets = arrays["link_offsets"].tolist()
+        flat = arrays["links"].tolist()
+        cursor = 0
+
+        def take(level: int) -> list[list[int]]:
+            nonlocal cursor
+            node_links = [flat[offsets[cursor + i] : offsets[cursor + i + 1]] for i in range(level + 1)]
+            cursor += level + 1
+            return node_links
+
+        for node in arrays["touched"].tolist():
+            self.links[node] = take(self.levels[node])
+        for level in arrays["levels"].astype(int).tolist():
+            self.levels.append(level)
+            self.links.append(take(level))
+        self.deleted[arrays["deleted"]] = True
+        self.entry_point, self.max_level = entry_point, max_level
+
+    @classmethod
+    def from_changes(cls, records: list[dict[str, np.ndarray]], *, seed: int = 0) -> HnswGraph:
+        """Rebuild a graph from a snapshot followed by the deltas taken after it."""
+
+        m, ef_construction = (int(v) for v in records[0]["params"][:2])
+        dimension = records[0]["vectors"].shape[1]
+        graph = cls(dimension, m=m, ef_construction=ef_construction, seed=seed)
+        for arrays in records:
+            graph.apply(arrays)
+        return graph
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], *, seed: int = 0) -> HnswGraph:
+        """Load the single-file snapshot written before the change log existed."""
+
+        m, ef_construction, entry_point, max_level = (int(v) for v in arrays["params"])
+        vectors = np.asarray(arrays["vectors"], dtype=np.float32)
+        graph = cls(vectors.shape[1], m=m, ef_construction=ef_construction, seed=seed)
+        graph._reserve(vectors.shape[0])
+        graph.vectors[: vectors.shape[0]] = vectors
+        graph.size = vectors.shape[0]
+        graph.deleted[: graph.size] = arrays["deleted"]
+        graph.levels = arrays["levels"].astype(int).tolist()
+        offsets = arrays["link_offsets"].tolist()
+        flat = arrays["links"].tolist()
+        cursor = 0
+        for level in graph.levels:
+            node_links = []
+            for _ in range(level + 1):
+                node_links.append(flat[offsets[cursor] : offsets[cursor + 1]])
+                cursor += 1
+            graph.links.append(node_links)
+        graph.entry_point, graph.max_level = entry_point, max_level
+        return graph
+
+
+__all__ = ["HnswGraph"]
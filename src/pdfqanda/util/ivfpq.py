@@ -0,0 +1,147 @@
+"""Inverted-file product quantisation (IVF-PQ) primitives built on NumPy."""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def kmeans(
+    data: np.ndarray,
+    k: int,
+    *,
+    iterations: int = 20,
+    seed: int = 0,
+) -> np.ndarray:
+    """Lloyd's k-means returning ``min(k, len(data))`` float32 centroids."""
+
+    data = np.asarray(data, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, data.shape[0]))
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters on random points so k stays meaningful.
+            sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()))]
+            counts[empty] = 1
+        updated = sums / counts[:, None]
+        if np.allclose(updated, centroids, atol=1e-6):
+            centroids = updated.astype(np.float32)
+            break
+        centroids = updated.astype(np.float32)
+    return centroids
+
+
+def nearest_centroid(data: np.ndarray, centroids: np.ndarray, *, block_rows: int = 8192) -> np.ndarray:
+    """Return the index of the closest (L2) centroid for every row of ``data``."""
+
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    output = np.empty(data.shape[0], dtype=np.int32)
+    for start in range(0, data.shape[0], block_rows):
+        block = data[start : start + block_rows]
+        distances = centroid_norms[None, :] - 2.0 * (block @ centroids.T)
+        output[start : start + block.shape[0]] = np.argmin(distances, axis=1)
+    return output
+
+
+class IvfPqCodec:
+    """Coarse k-means lists plus product-quantised residuals scored by inner product.
+
+    A vector ``x`` assigned to list ``c`` is stored as the PQ code of
+    ``x - coarse[c]``. Because inner products are linear, a query's score is
+    ``q·coarse[c] + sum_j lut[j, code_j]`` with one lookup table per query.
+    """
+
+    def __init__(self, coarse: np.ndarray, codebooks: np.ndarray) -> None:
+        self.coarse = np.asarray(coarse, dtype=np.float32)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+        self.subspaces, self.ksub, self.subdim = self.codebooks.shape
+
+    @property
+    def dimension(self) -> int:
+        return self.subspaces * self.subdim
+
+    @property
+    def nlist(self) -> int:
+        return self.coarse.shape[0]
+
+    @classmethod
+    def train(
+        cls,
+        vectors: np.ndarray,
+        *,
+        nlist: int,
+        subspaces: int,
+        ksub: int = 256,
+        iterations: int = 20,
+        seed: int = 0,
+    ) -> IvfPqCodec:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dimension = vectors.shape[1]
+        if dimension % subspaces:
+            raise ValueError(f"PQ subspaces ({subspaces}) must divide the dimension ({dimension})")
+        if not 1 <= ksub <= 256:
+            raise ValueError("ksub must be in [1, 256] to fit uint8 codes")
+        coarse = kmeans(vectors, nlist, iterations=iterations, seed=seed)
+        residuals = vectors - coarse[nearest_centroid(vectors, coarse)]
+        subdim = dimension // subspaces
+        ksub = min(ksub, vectors.shape[0])
+        codebooks = np.zeros((subspaces, ksub, subdim), dtype=np.float32)
+        for sub in range(subspaces):
+            part = residuals[:, sub * subdim : (sub + 1) * subdim]
+            trained = kmeans(part, ksub, iterations=iterations, seed=seed + sub + 1)
+            codebooks[sub, : trained.shape[0]] = trained
+        return cls(coarse, codebooks)
+
+    def encode(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return ``(list_ids, codes)`` for ``vectors``."""
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        lists = nearest_centroid(vectors, self.coarse)
+        residuals = vectors - self.coarse[lists]
+        codes = np.empty((vectors.shape[0], self.subspaces), dtype=np.uint8)
+        for sub in range(self.subspaces):
+            part = residuals[:, sub * self.subdim : (sub + 1) * self.subdim]
+            codes[:, sub] = nearest_centroid(part, self.codebooks[sub])
+        return lists, codes
+
+    def probe(self, query: np.ndarray, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the ``nprobe`` best list ids and every list's coarse score."""
+
+        coarse_scores = self.coarse @ query
+        nprobe = min(max(nprobe, 1), self.nlist)
+        if nprobe < self.nlist:
+            lists = np.argpartition(coarse_scores, -nprobe)[-nprobe:]
+        else:
+            lists = np.arange(self.nlist)
+        return lists, coarse_scores
+
+    def lookup_table(self, query: np.ndarray) -> np.ndarray:
+        parts = query.reshape(self.subspaces, self.subdim)
+        return np.einsum("skd,sd->sk", self.codebooks, parts)
+
+    def score(
+        self,
+        codes: np.ndarray,
+        lists: np.ndarray,
+        coarse_scores: np.ndarray,
+        table: np.ndarray,
+    ) -> np.ndarray:
+        """Approximate inner products for encoded rows."""
+
+        partial = table[np.arange(self.subspaces)[None, :], codes.astype(np.intp)]
+        return coarse_scores[lists] + partial.sum(axis=1)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        return {"coarse": self.coarse, "codebooks": self.codebooks}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> IvfPqCodec:
+        return cls(arrays["coarse"], arrays["codebooks"])
+
+
+__all__ = ["IvfPqCodec", "kmeans", "nearest_centroid"]
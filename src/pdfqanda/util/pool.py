@@ -0,0 +1,116 @@
+"""Thread-safe SQLite connections: one shared writer and a pool of readers."""
+
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import quote
+
+
+class ConnectionPool:
+    """Hand out SQLite connections that may be used from any thread.
+
+    The single writer connection is serialised behind a re-entrant lock, while
+    up to ``readers`` read-only connections (``mode=ro``) serve queries in
+    parallel. ``immutable`` opens the readers with ``immutable=1`` for frozen
+    snapshots, which lets SQLite skip locking and change detection entirely.
+    In-memory databases cannot be shared, so readers fall back to the writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        readers: int = 4,
+        immutable: bool = False,
+        configure: Callable[[sqlite3.Connection, bool], None] | None = None,
+    ) -> None:
+        self.path = path
+        self.immutable = immutable
+        self._configure = configure
+        self._capacity = 0 if path in ("", ":memory:") else max(0, readers)
+        self._lock = threading.RLock()
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._readers: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self.writer_connection = self._open(readonly=False)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Hold the writer connection exclusively for the enclosed block."""
+
+        with self._lock:
+            yield self.writer_connection
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection, waiting when all of them are busy."""
+
+        if not self._capacity:
+            with self.writer() as connection:
+                yield connection
+            return
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                # a stray transaction would pin the reader to a stale snapshot
+                connection.rollback()
+            self._idle.put(connection)
+
+    @contextmanager
+    def exclusive(self) -> Iterator[sqlite3.Connection]:
+        """Hold the writer and wait for every reader to come back.
+
+        No query runs while the block is open, so state the readers depend on
+        (the vector index beside the database) can be swapped underneath them.
+        """
+
+        with self.writer() as connection, self._readers_lock:
+            # holding ``_readers_lock`` stops new readers being opened meanwhile
+            drained = [self._idle.get() for _ in self._readers]
+            try:
+                yield connection
+            finally:
+                for reader in drained:
+                    self._idle.put(reader)
+
+    def close(self) -> None:
+        with self._readers_lock:
+            for connection in self._readers:
+                connection.close()
+            self._readers = []
+        self.writer_connection.close()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if len(self._readers) < self._capacity:
+                connection = self._open(readonly=True)
+                self._readers.append(connection)
+                return connection
+        return self._idle.get()
+
+    def _open(self, *, readonly: bool) -> sqlite3.Connection:
+        if readonly:
+            uri = f"file:{quote(str(Path(self.path).resolve()))}?mode=ro"
+            if self.immutable:
+                uri += "&immutable=1"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        if self._configure is not None:
+            self._configure(connection, readonly)
+        return connection
+
+
+__all__ = ["ConnectionPool"]
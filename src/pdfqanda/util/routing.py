@@ -0,0 +1,158 @@
+"""Coarse-to-fine retrieval routing over document and section centroids."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from .vector_index import SearchFilter, VectorIndex, VectorItem
+
+# Suffix of the section centroid standing for a document's chunks outside any section.
+_UNSECTIONED = "\x1funsectioned"
+
+
+def adaptive_cut(
+    scores: Sequence[float],
+    max_m: int,
+    *,
+    min_m: int = 1,
+    min_gap: float = 0.02,
+    min_share: float = 0.5,
+) -> int:
+    """Return how many of the descending ``scores`` to keep.
+
+    The cut is placed at the largest drop between consecutive scores within the
+    first ``max_m`` entries, so a clear winner routes to few candidates. The
+    drop only counts when it is at least ``min_gap`` and at least ``min_share``
+    of the score spread it is taken from; a flat or evenly sloping
+    distribution keeps all ``max_m``.
+    """
+
+    count = min(len(scores), max_m)
+    if count <= min_m:
+        return count
+    # Only the scores from entry ``min_m - 1`` on can be cut between.
+    head = np.asarray(scores[min_m - 1 : count], dtype=np.float64)
+    gaps = head[:-1] - head[1:]
+    widest = int(np.argmax(gaps))
+    gap = float(gaps[widest])
+    if gap < min_gap or gap < min_share * float(head[0] - head[-1]):
+        return count
+    return widest + min_m
+
+
+class CentroidRouter:
+    """Rank document and section centroids to narrow a chunk search.
+
+    Centroids are the normalised mean of a document's (or section's) chunk
+    embeddings and live in two small NumPy indexes next to the chunk index.
+    ``route`` turns a query into a :class:`SearchFilter` naming the top
+    documents and, when ``max_sections`` is set, the top sections inside them.
+    Chunks without a section share one extra centroid per document; when it
+    ranks among the top sections the search stays at document level, since a
+    section filter cannot admit chunks whose section is unset.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str = "kb",
+        *,
+        max_documents: int = 8,
+        max_sections: int = 0,
+        min_routes: int = 1,
+    ) -> None:
+        self.max_documents = max_documents
+        self.max_sections = max_sections
+        self.min_routes = min_routes
+        self.documents = VectorIndex(base_path, f"{name}_document_centroids", preferred="numpy")
+        self.sections = VectorIndex(base_path, f"{name}_section_centroids", preferred="numpy")
+
+    def update(self, chunks: Iterable[tuple[str, str | None, Sequence[float]]]) -> None:
+        """Recompute centroids from every ``(document_id, section_id, embedding)`` given.
+
+        Callers pass all chunks of the documents being refreshed.
+        """
+
+        documents: dict[str, list[np.ndarray]] = {}
+        sections: dict[tuple[str, str], list[np.ndarray]] = {}
+        for document_id, section_id, embedding in chunks:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(vector))
+            if norm == 0.0:
+                continue
+            vector = vector / norm
+            documents.setdefault(document_id, []).append(vector)
+            if section_id is None:
+                section_id = document_id + _UNSECTIONED
+            sections.setdefault((document_id, section_id), []).append(vector)
+        self.documents.upsert(
+            VectorItem(id=document_id, embedding=_centroid(vectors), metadata={"document_id": document_id})
+            for document_id, vectors in documents.items()
+        )
+        self.sections.upsert(
+            VectorItem(
+                id=section_id,
+                embedding=_centroid(vectors),
+                metadata={"document_id": document_id, "section_id": section_id},
+            )
+            for (document_id, section_id), vectors in sections.items()
+        )
+        # A refreshed document whose chunks all have sections now drops that centroid.
+        self.sections.delete(
+            [
+                document_id + _UNSECTIONED
+                for document_id in documents
+                if (document_id, document_id + _UNSECTIONED) not in sections
+            ]
+        )
+
+    def remove(self, document_ids: Iterable[str], section_ids: Iterable[str]) -> None:
+        document_ids = list(document_ids)
+        self.documents.delete(document_ids)
+        self.sections.delete([*section_ids, *(document_id + _UNSECTIONED for document_id in document_ids)])
+
+    def route(self, embedding: Sequence[float], filters: SearchFilter | None = None) -> SearchFilter | None:
+        """Narrow ``filters`` to the best-matching documents (and sections)."""
+
+        scope = filters or SearchFilter()
+        hits = self.documents.search(
+            embedding,
+            self.max_documents,
+            filters=SearchFilter(document_ids=scope.document_ids) if scope.document_ids is not None else None,
+        )
+        if not hits:
+            return filters
+        keep = adaptive_cut([score for _, score in hits], self.max_documents, min_m=self.min_routes)
+        documents = frozenset(id_ for id_, _ in hits[:keep])
+        section_ids = scope.section_ids
+        if self.max_sections:
+            section_hits = self.sections.search(
+                embedding,
+                self.max_sections,
+                filters=SearchFilter(document_ids=documents, section_ids=scope.section_ids),
+            )
+            if section_hits:
+                keep = adaptive_cut([score for _, score in section_hits], self.max_sections, min_m=self.min_routes)
+                kept = [id_ for id_, _ in section_hits[:keep]]
+                if not any(id_.endswith(_UNSECTIONED) for id_ in kept):
+                    section_ids = frozenset(kept)
+        return SearchFilter(document_ids=documents, section_ids=section_ids, pages=scope.pages)
+
+    def close(self) -> None:
+        self.documents.close()
+        self.sections.close()
+
+
+def _centroid(vectors: list[np.ndarray]) -> np.ndarray:
+    mean = np.mean(np.stack(vectors), axis=0)
+    norm = float(np.linalg.norm(mean))
+    if norm == 0.0:
+        # Opposing chunks cancel out; fall back to the first one.
+        mean, norm = vectors[0], 1.0
+    return mean / norm
+
+
+__all__ = ["CentroidRouter", "adaptive_cut"]
@@ -2,17 +2,41 @@
 
 from __future__ import annotations
 
+import hashlib
 import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, ExitStack, contextmanager, nullcontext
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Protocol, Sequence
+from typing import Iterable, Iterator, Protocol, Sequence
 
 import numpy as np
 
+from .hnsw import HnswGraph
+from .ivfpq import IvfPqCodec
+
 try:  # pragma: no cover - optional dependency
     import chromadb  # type: ignore
+    from chromadb import errors as chroma_errors  # type: ignore
 except Exception:  # pragma: no cover - optional dependency
     chromadb = None  # type: ignore[assignment]
+    chroma_errors = None  # type: ignore[assignment]
+
+# ``get_collection`` reports a missing collection as ``ValueError`` before
+# chromadb 0.5, ``InvalidCollectionException`` in 0.5 and ``NotFoundError`` since.
+_CHROMA_NOT_FOUND: tuple[type[Exception], ...] = (
+    ValueError,
+    *(
+        getattr(chroma_errors, name)
+        for name in ("InvalidCollectionException", "NotFoundError")
+        if hasattr(chroma_errors, name)
+    ),
+)
 
 
 @dataclass(slots=True)
@@ -20,10 +44,43 @@ class VectorItem:
     """Payload for vector index updates."""
 
     id: str
-    embedding: Sequence[float]
+    embedding: Sequence[float] | np.ndarray
     metadata: dict[str, object]
 
 
+@dataclass(frozen=True, slots=True)
+class SearchFilter:
+    """Restrict a search to chunks matching every constraint that is set.
+
+    ``pages`` is an inclusive ``(first, last)`` range of zero-based page
+    numbers; a chunk matches when its ``start_page``/``end_page`` span overlaps.
+    """
+
+    document_ids: frozenset[str] | None = None
+    section_ids: frozenset[str] | None = None
+    pages: tuple[int, int] | None = None
+
+    def __post_init__(self) -> None:
+        for field_name in ("document_ids", "section_ids"):
+            value = getattr(self, field_name)
+            if value is not None and not isinstance(value, frozenset):
+                object.__setattr__(self, field_name, frozenset(str(item) for item in value))
+
+    def matches(self, metadata: dict[str, object]) -> bool:
+        if self.document_ids is not None and metadata.get("document_id") not in self.document_ids:
+            return False
+        if self.section_ids is not None and metadata.get("section_id") not in self.section_ids:
+            return False
+        if self.pages is not None:
+            start, end = metadata.get("start_page"), metadata.get("end_page")
+            if start is None:
+                return False
+            end = start if end is None else end
+            if int(end) < self.pages[0] or int(start) > self.pages[1]:
+                return False
+        return True
+
+
 class VectorIndexBackend(Protocol):
     """Runtime interface a vector backend must implement."""
 
@@ -31,11 +88,18 @@ class VectorIndexBackend(Protocol):
 
     def delete(self, ids: list[str]) -> None: ...
 
-    def search(self, embedding: Sequence[float], limit: int | None) -> list[tuple[str, float]]: ...
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]: ...
 
     def count(self) -> int: ...
 
-    def get_embeddings(self, ids: Iterable[str]) -> dict[str, list[float]]: ...
+    def ids(self) -> list[str]: ...
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]: ...
 
     def close(self) -> None: ...
 
@@ -50,6 +114,7 @@ class VectorIndex:
         *,
         backend: VectorIndexBackend | None = None,
         preferred: str | None = None,
+        **options: object,
     ) -> None:
         self.name = name
         self.base_path = Path(base_path)
@@ -57,7 +122,7 @@ class VectorIndex:
         if backend is not None:
             self._backend = backend
         else:
-            self._backend = _select_backend(self.base_path, name, preferred)
+            self._backend = _select_backend(self.base_path, name, preferred, options)
 
     # ------------------------------------------------------------------
     def upsert(self, items: Iterable[VectorItem]) -> None:
@@ -66,208 +131,2211 @@ class VectorIndex:
             return
         self._backend.upsert(payload)
 
+    def bulk_load(
+        self,
+        ids: Sequence[str],
+        embeddings: np.ndarray,
+        metadata: Sequence[dict[str, object]] | None = None,
+    ) -> None:
+        """Upsert a ``(len(ids), dimension)`` matrix without per-row conversions."""
+
+        if not len(ids):
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("bulk_load expects one embedding row per id")
+        metadata = metadata if metadata is not None else [{} for _ in ids]
+        bulk_load = getattr(self._backend, "bulk_load", None)
+        if bulk_load is not None:
+            bulk_load(list(ids), matrix, list(metadata))
+            return
+        self._backend.upsert(
+            [VectorItem(id=id_, embedding=row, metadata=meta) for id_, row, meta in zip(ids, matrix, metadata)]
+        )
+
     def delete(self, ids: Iterable[str]) -> None:
         payload = [item for item in ids]
         if not payload:
             return
         self._backend.delete(payload)
 
-    def search(self, embedding: Sequence[float], limit: int | None = None) -> list[tuple[str, float]]:
-        return self._backend.search(embedding, limit)
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None = None,
+        *,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        return self._backend.search(embedding, limit, filters)
+
+    def search_many(
+        self,
+        embeddings: np.ndarray | Sequence[Sequence[float]],
+        limit: int | None = None,
+        *,
+        filters: SearchFilter | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Search for every row of ``embeddings``; results keep the input order."""
+
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if queries.shape[0] == 0 or queries.size == 0:
+            return [[] for _ in range(queries.shape[0])]
+        search_many = getattr(self._backend, "search_many", None)
+        if search_many is not None:
+            return search_many(queries, limit, filters)
+        return [self._backend.search(query, limit, filters) for query in queries]
+
+    def search_within(
+        self,
+        embeddings: np.ndarray | Sequence[Sequence[float]],
+        limit: int | None = None,
+        *,
+        deadline: float,
+        filters: SearchFilter | None = None,
+    ) -> tuple[list[list[tuple[str, float]]], bool]:
+        """Like :meth:`search_many`, but stop scanning at ``deadline``.
+
+        ``deadline`` is a :func:`time.monotonic` timestamp. Returns the results
+        and whether the scan was cut short; backends that cannot stop early
+        always finish and report ``False``.
+        """
+
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        search_within = getattr(self._backend, "search_within", None)
+        if search_within is not None and queries.size:
+            return search_within(queries, limit, filters, deadline)
+        return self.search_many(queries, limit, filters=filters), False
 
     def count(self) -> int:
         return self._backend.count()
 
-    def get_embeddings(self, ids: Iterable[str]) -> dict[str, list[float]]:
+    def ids(self) -> list[str]:
+        """Return the id of every live row, e.g. to reconcile the index with its source."""
+
+        return list(self._backend.ids())
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
+        """Return stored (normalised) float32 vectors for the ``ids`` present."""
+
         return self._backend.get_embeddings(ids)
 
+    def batch(self) -> AbstractContextManager[None]:
+        """Group writes so backends that support it persist them in one commit."""
+
+        batch = getattr(self._backend, "batch", None)
+        return batch() if batch is not None else nullcontext()
+
+    def compact(self) -> None:
+        """Reclaim space held by deleted rows on backends that tombstone them."""
+
+        compact = getattr(self._backend, "compact", None)
+        if compact is not None:
+            compact(force=True)
+
     def close(self) -> None:
         self._backend.close()
 
 
-def _select_backend(base_path: Path, name: str, preferred: str | None) -> VectorIndexBackend:
+def _select_backend(
+    base_path: Path,
+    name: str,
+    preferred: str | None,
+    options: dict[str, object] | None = None,
+) -> VectorIndexBackend:
+    """Instantiate a backend; ``options`` are passed to the local backends only.
+
+    ``shards`` > 1 partitions the index by document across that many
+    independent backends of the requested kind.
+    """
+
+    options = dict(options or {})
+    shards = int(options.pop("shards", None) or 1)
+    if shards > 1:
+        return _ShardedBackend(base_path, name, shards=shards, preferred=preferred, options=options)
     if preferred == "numpy":
-        return _NumpyBackend(base_path, name)
+        return _NumpyBackend(base_path, name, **options)
+    if preferred == "hnsw":
+        return _HnswBackend(base_path, name, **options)
+    if preferred == "ivfpq":
+        return _IvfPqBackend(base_path, name, **options)
+    chroma_options = {
+        key: options[key]
+        for key in ("m", "ef_construction", "ef_search", "batch_size")
+        if key in options
+    }
     if preferred == "chroma":
         if chromadb is None:
             raise RuntimeError("Chroma backend requested but chromadb is not installed")
-        return _ChromaBackend(base_path, name)
+        return _ChromaBackend(base_path, name, **chroma_options)
     if chromadb is not None:
         try:  # pragma: no cover - optional dependency
-            return _ChromaBackend(base_path, name)
+            return _ChromaBackend(base_path, name, **chroma_options)
         except Exception:
-            return _NumpyBackend(base_path, name)
-    return _NumpyBackend(base_path, name)
+            return _NumpyBackend(base_path, name, **options)
+    return _NumpyBackend(base_path, name, **options)
+
+
+@dataclass(slots=True, eq=False)
+class _Segment:
+    """Immutable block of normalised vectors persisted as one ``.npy`` file.
+
+    ``ids`` is a fixed-width byte array and ``hashes``/``order`` a sorted 64-bit
+    hash index over it, both stored in a binary ``.catalog.npz`` written once
+    with the segment, so opening an index never materialises Python id lists.
+    ``metadata`` is read lazily from the JSON sidecar when a rewrite needs it;
+    ``columns`` holds the dictionary-encoded document/section ids and page
+    spans that filtered searches evaluate without touching the metadata.
+    ``codes``/``scale`` hold the approximate copy scored by ``search`` when the
+    index uses ``float16``/``int8`` storage or a dimension prefix. ``dead`` flags tombstoned
+    rows that stay on disk until the segment is compacted or merged.
+    ``hits`` is the decayed number of search results served from the segment
+    and ``hot`` marks segments whose float32 rows are held in RAM.
+    """
+
+    name: str
+    vectors: np.ndarray
+    ids: np.ndarray
+    hashes: np.ndarray
+    order: np.ndarray
+    metadata: list[dict[str, object]] | None = None
+    columns: dict[str, np.ndarray] | None = None
+    codes: np.ndarray | None = None
+    scale: np.ndarray | None = None
+    dead: np.ndarray | None = None
+    dead_rows: int = 0
+    hits: float = 0.0
+    hot: bool = False
+
+    @property
+    def rows(self) -> int:
+        return int(self.ids.shape[0])
+
+    def id_at(self, row: int) -> str:
+        return self.ids[row].decode("utf-8")
+
+    def id_list(self) -> list[str]:
+        return [raw.decode("utf-8") for raw in self.ids.tolist()]
+
+    def live(self) -> np.ndarray:
+        """Indices of rows that have not been tombstoned."""
+
+        if self.dead is None:
+            return np.arange(self.rows)
+        return np.flatnonzero(~self.dead)
+
+    def kill(self, rows: Iterable[int]) -> None:
+        if self.dead is None:
+            self.dead = np.zeros(self.rows, dtype=bool)
+        rows = np.unique(np.fromiter(rows, dtype=np.int64))
+        fresh = rows[~self.dead[rows]]
+        self.dead[fresh] = True
+        self.dead_rows += int(fresh.shape[0])
+
+    def find(self, keys: np.ndarray, raw_ids: np.ndarray) -> np.ndarray:
+        """Return the live row for every ``(key, raw id)`` pair, or ``-1``."""
+
+        rows = np.full(keys.shape[0], -1, dtype=np.int64)
+        if not self.rows:
+            return rows
+        positions = np.searchsorted(self.hashes, keys)
+        for idx in np.flatnonzero(positions < self.rows):
+            pos = int(positions[idx])
+            # 64-bit collisions are vanishingly rare but still checked exactly.
+            while pos < self.rows and self.hashes[pos] == keys[idx]:
+                row = int(self.order[pos])
+                if self.ids[row] == raw_ids[idx] and (self.dead is None or not self.dead[row]):
+                    rows[idx] = row
+                    break
+                pos += 1
+        return rows
+
+
+def _encode_ids(ids: Sequence[str]) -> np.ndarray:
+    encoded = [id_.encode("utf-8") for id_ in ids]
+    width = max((len(raw) for raw in encoded), default=1)
+    return np.array(encoded, dtype=f"S{max(width, 1)}")
+
+
+def _hash_ids(raw_ids: np.ndarray) -> np.ndarray:
+    return np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+            for raw in raw_ids.tolist()
+        ),
+        dtype=np.uint64,
+        count=raw_ids.shape[0],
+    )
+
+
+def _catalog(raw_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Build the sorted ``(hashes, order)`` lookup index for a segment."""
+
+    hashes = _hash_ids(raw_ids)
+    order = np.argsort(hashes, kind="stable").astype(np.int32)
+    return hashes[order], order
 
 
 class _NumpyBackend(VectorIndexBackend):
-    """Persist vectors to disk as normalised NumPy arrays."""
+    """Persist vectors to disk as append-only segments of normalised NumPy arrays.
+
+    Each committed batch becomes a new segment file listed in a small JSON
+    manifest, so writes cost O(batch) instead of rewriting the whole matrix.
+    Trailing segments of the same size tier are merged log-structured style to
+    keep the segment count (and per-query overhead) bounded.
+
+    With ``mmap=True`` segment files are memory-mapped instead of read into RAM,
+    and ``search`` always streams the rows in ``block_rows`` chunks while keeping
+    only a running top-k, so resident memory stays bounded by the block size.
+
+    ``storage`` selects what is held in RAM and scored: ``float32`` (default),
+    ``float16``, or per-dimension scaled ``int8``. Quantised indexes keep the
+    float32 segments memory-mapped on disk and re-rank the best
+    ``rerank_depth`` approximate candidates at full precision. The choice is
+    recorded in the manifest and reused when ``storage`` is not given.
+
+    ``prefix_dims`` adds a Matryoshka-style first pass: only the leading
+    ``prefix_dims`` dimensions of each vector (re-normalised, then stored as
+    ``storage`` says) are held in RAM and scored, and the ``rerank_depth``
+    shortlist is re-scored with the full memory-mapped vectors. Embeddings
+    trained for truncation, such as ``text-embedding-3-*``, keep their ranking
+    under this cut. It is recorded in the manifest like ``storage``.
+
+    Deletes and overwrites only append tombstones to ``<name>_tombstones.jsonl``
+    and mask the rows during ``search``. Once dead rows exceed
+    ``compact_ratio`` of the index, affected segments are rewritten without
+    them, on a background thread unless ``background_compaction`` is off;
+    ``compact`` runs the same pass on demand.
 
-    def __init__(self, base_path: Path, name: str) -> None:
+    ``hot_rows`` enables tiered storage: segments stay memory-mapped (and
+    quantised, if ``storage`` says so) on disk, except for the most-accessed
+    segments, which are loaded into RAM at full precision up to ``hot_rows``
+    rows. Access counts come from the top results ``search`` returns, decay by half
+    every ``retier_interval`` queries, and persist in ``<name>_access.json``.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str,
+        *,
+        merge_factor: int = 8,
+        mmap: bool = False,
+        block_rows: int = 65536,
+        storage: str | None = None,
+        rerank_depth: int = 256,
+        prefix_dims: int | None = None,
+        compact_ratio: float = 0.2,
+        background_compaction: bool = True,
+        hot_rows: int | None = None,
+        retier_interval: int = 256,
+    ) -> None:
+        if merge_factor < 2:
+            raise ValueError("merge_factor must be at least 2")
+        if block_rows < 1:
+            raise ValueError("block_rows must be positive")
+        if storage is not None and storage not in _STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage {storage!r}; expected one of {_STORAGE_TYPES}")
+        if prefix_dims is not None and prefix_dims < 1:
+            raise ValueError("prefix_dims must be positive")
         self.root = Path(base_path)
+        self.name = name
+        self.manifest_path = self.root / f"{name}_manifest.json"
+        self.segments_dir = self.root / f"{name}_segments"
+        self.tombstones_path = self.root / f"{name}_tombstones.jsonl"
+        self.access_path = self.root / f"{name}_access.json"
+        # Legacy single-file layout, converted into a segment on first open.
         self.vectors_path = self.root / f"{name}_vectors.npy"
         self.meta_path = self.root / f"{name}_meta.json"
-        self.ids: list[str] = []
-        self.metadata: dict[str, dict[str, object]] = {}
+        self.merge_factor = merge_factor
+        self.mmap = mmap
+        self.block_rows = block_rows
+        self.storage = storage or "float32"
+        self.rerank_depth = rerank_depth
+        self._requested_storage = storage
+        self.prefix_dims = prefix_dims
+        self._requested_prefix = prefix_dims
+        self.compact_ratio = compact_ratio
+        self.background_compaction = background_compaction
+        self.hot_rows = hot_rows
+        self.retier_interval = max(1, retier_interval)
+        # Only the leading results of a ranking count as accesses.
+        self.access_depth = 10
+        self._queries = 0
+        self._lock = threading.RLock()
+        # Guards the segment list as searches snapshot it. Writers hold it only
+        # for the in-memory swap, never across file I/O, so searches keep running
+        # while a merge or compaction (under ``_lock``) writes its segments.
+        self._view_lock = threading.Lock()
+        self._compactor: threading.Thread | None = None
         self.dimension: int | None = None
-        self.vectors: np.ndarray | None = None
+        self.segments: list[_Segment] = []
+        self._pending: list[tuple[str, np.ndarray, dict[str, object]]] = []
+        self._pending_index: dict[str, int] = {}
+        self._next_segment = 1
+        self._deferred = 0
         self._load()
 
     # ------------------------------------------------------------------
     def _load(self) -> None:
+        if self.manifest_path.exists():
+            payload = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            self.dimension = payload.get("dimension")
+            self._next_segment = int(payload.get("next_segment", 1))
+            self.storage = self._requested_storage or str(payload.get("storage", "float32"))
+            self.prefix_dims = self._requested_prefix or payload.get("prefix_dims")
+            tombstones = self._read_tombstones()
+            for entry in payload.get("segments", []):
+                segment = self._read_segment(str(entry["name"]))
+                if segment.name in tombstones:
+                    segment.kill(tombstones[segment.name])
+                self._register(segment)
+            if self.storage != payload.get("storage", "float32") or self.prefix_dims != payload.get(
+                "prefix_dims"
+            ):
+                self._write_manifest()
+            if self.hot_rows is not None:
+                self._read_access()
+                self.retier(decay=False)
+        elif self.vectors_path.exists() or self.meta_path.exists():
+            self._import_legacy()
+
+    def _import_legacy(self) -> None:
+        payload: dict[str, object] = {}
         if self.meta_path.exists():
             payload = json.loads(self.meta_path.read_text(encoding="utf-8"))
-            self.ids = list(payload.get("ids", []))
-            self.metadata = {str(k): v for k, v in payload.get("metadata", {}).items()}
-            self.dimension = payload.get("dimension")
+        ids = [str(id_) for id_ in payload.get("ids", [])]
+        metadata = payload.get("metadata", {})
+        vectors = np.empty((0, 0), dtype=np.float32)
         if self.vectors_path.exists():
-            self.vectors = np.load(self.vectors_path, allow_pickle=False)
-            if self.vectors.size == 0:
-                self.vectors = np.empty((0, 0), dtype=np.float32)
+            vectors = np.load(self.vectors_path, allow_pickle=False)
+        self.dimension = payload.get("dimension")
+        if vectors.size and self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+        if ids and vectors.size:
+            segment = self._write_segment(
+                np.asarray(vectors, dtype=np.float32),
+                _encode_ids(ids),
+                [dict(metadata.get(id_, {})) for id_ in ids],
+            )
+            self._register(segment)
+        self._write_manifest()
+        self.vectors_path.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+
+    def _segment_paths(self, name: str) -> tuple[Path, Path, Path]:
+        return (
+            self.segments_dir / f"{name}.npy",
+            self.segments_dir / f"{name}.catalog.npz",
+            self.segments_dir / f"{name}.json",
+        )
+
+    def _read_segment(self, name: str) -> _Segment:
+        vectors_path, catalog_path, sidecar_path = self._segment_paths(name)
+        if catalog_path.exists():
+            with np.load(catalog_path, allow_pickle=False) as arrays:
+                raw_ids, hashes, order = arrays["ids"], arrays["hashes"], arrays["order"]
+            metadata = None
         else:
-            self.vectors = np.empty((0, 0), dtype=np.float32)
-        if self.vectors.size and self.dimension is None:
-            self.dimension = int(self.vectors.shape[1])
+            # Segments from before the binary catalog kept ids in the sidecar.
+            sidecar = json.loads(sidecar_path.read_text(encoding="utf-8"))
+            raw_ids = _encode_ids([str(id_) for id_ in sidecar["ids"]])
+            hashes, order = _catalog(raw_ids)
+            self._write_catalog(catalog_path, raw_ids, hashes, order)
+            metadata = [dict(entry) for entry in sidecar["metadata"]]
+        segment = _Segment(
+            name=name,
+            vectors=self._open_vectors(vectors_path),
+            ids=raw_ids,
+            hashes=hashes,
+            order=order,
+            metadata=metadata,
+        )
+        self._attach_codes(segment)
+        return segment
 
-    def _persist(self) -> None:
-        if self.vectors is None:
-            self.vectors = np.empty((0, 0), dtype=np.float32)
-        np.save(self.vectors_path, self.vectors, allow_pickle=False)
+    @staticmethod
+    def _write_catalog(path: Path, raw_ids: np.ndarray, hashes: np.ndarray, order: np.ndarray) -> None:
+        _atomic_savez(path, ids=raw_ids, hashes=hashes, order=order)
+
+    def _segment_columns(self, segment: _Segment) -> dict[str, np.ndarray]:
+        if segment.columns is None:
+            path = self.segments_dir / f"{segment.name}.columns.npz"
+            if path.exists():
+                with np.load(path, allow_pickle=False) as arrays:
+                    segment.columns = dict(arrays)
+            else:
+                segment.columns = _build_columns(self._segment_metadata(segment))
+                if segment.name:
+                    _atomic_savez(path, **segment.columns)
+        return segment.columns
+
+    def _segment_metadata(self, segment: _Segment) -> list[dict[str, object]]:
+        if segment.metadata is None:
+            sidecar_path = self._segment_paths(segment.name)[2]
+            sidecar = json.loads(sidecar_path.read_text(encoding="utf-8"))
+            segment.metadata = [dict(entry) for entry in sidecar["metadata"]]
+        return segment.metadata
+
+    def _attach_codes(self, segment: _Segment) -> None:
+        """Load (or build, after a storage switch) the approximate copy of a segment."""
+
+        if not self._approximate:
+            return
+        suffix = self.storage if self.prefix_dims is None else f"{self.storage}-p{self.prefix_dims}"
+        path = self.segments_dir / f"{segment.name}.{suffix}.npz"
+        if path.exists():
+            with np.load(path, allow_pickle=False) as arrays:
+                segment.codes = arrays["codes"]
+                segment.scale = arrays.get("scale")
+            return
+        source = np.asarray(segment.vectors)
+        if self.prefix_dims is not None:
+            source = _truncate(source, self.prefix_dims)
+        segment.codes, segment.scale = _quantize(source, self.storage)
+        arrays = {"codes": segment.codes}
+        if segment.scale is not None:
+            arrays["scale"] = segment.scale
+        _atomic_savez(path, **arrays)
+
+    def _write_segment(
+        self,
+        vectors: np.ndarray,
+        raw_ids: np.ndarray,
+        metadata: list[dict[str, object]],
+    ) -> _Segment:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        vectors_path, catalog_path, sidecar_path = self._segment_paths(name)
+        hashes, order = _catalog(raw_ids)
+        _atomic_save(vectors_path, vectors)
+        self._write_catalog(catalog_path, raw_ids, hashes, order)
+        _atomic_write_text(sidecar_path, json.dumps({"metadata": metadata}))
+        columns = _build_columns(metadata)
+        _atomic_savez(self.segments_dir / f"{name}.columns.npz", **columns)
+        segment = _Segment(
+            name=name,
+            vectors=vectors,
+            ids=raw_ids,
+            hashes=hashes,
+            order=order,
+            metadata=metadata,
+            columns=columns,
+        )
+        self._attach_codes(segment)
+        if self._mapped:
+            segment.vectors = self._open_vectors(vectors_path)
+        return segment
+
+    @property
+    def _approximate(self) -> bool:
+        """Whether searches score a compact copy before re-ranking."""
+
+        return self.storage != "float32" or self.prefix_dims is not None
+
+    @property
+    def _mapped(self) -> bool:
+        # Approximate indexes only touch float32 rows for re-ranking, so map them;
+        # tiered indexes map everything and load hot segments explicitly.
+        return self.mmap or self._approximate or self.hot_rows is not None
+
+    def _open_vectors(self, path: Path) -> np.ndarray:
+        return np.load(path, mmap_mode="r" if self._mapped else None, allow_pickle=False)
+
+    def _remove_segment_files(self, segment: _Segment) -> None:
+        for path in self.segments_dir.glob(f"{segment.name}.*"):
+            path.unlink(missing_ok=True)
+
+    def _write_manifest(self) -> None:
         payload = {
-            "ids": self.ids,
-            "metadata": self.metadata,
+            "format": 1,
             "dimension": self.dimension,
+            "storage": self.storage,
+            "prefix_dims": self.prefix_dims,
+            "next_segment": self._next_segment,
+            "segments": [{"name": seg.name, "rows": seg.rows} for seg in self.segments],
         }
-        self.meta_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        _atomic_write_text(self.manifest_path, json.dumps(payload))
+
+    def _register(self, segment: _Segment) -> None:
+        with self._view_lock:
+            self.segments.append(segment)
+
+    def _snapshot(self) -> list[_Segment]:
+        with self._view_lock:
+            return list(self.segments)
+
+    def _view(self) -> tuple[list[_Segment], list[tuple[str, np.ndarray, dict[str, object]]]]:
+        """Snapshot the segments and the uncommitted rows together.
+
+        ``flush`` moves rows from ``_pending`` into a new segment under
+        ``_view_lock``, so one snapshot sees every row exactly once.
+        """
+
+        with self._view_lock:
+            return list(self.segments), list(self._pending)
+
+    def _locate(self, ids: Sequence[str]) -> dict[str, tuple[_Segment, int]]:
+        """Map committed, live ``ids`` to their segment row via the catalogs."""
+
+        found: dict[str, tuple[_Segment, int]] = {}
+        segments = self._snapshot()
+        if not ids or not segments:
+            return found
+        wanted = list(dict.fromkeys(ids))
+        raw_ids = _encode_ids(wanted)
+        keys = _hash_ids(raw_ids)
+        unresolved = np.arange(len(wanted))
+        # Newest first: only one live copy of an id exists, usually the latest.
+        for segment in reversed(segments):
+            rows = segment.find(keys[unresolved], raw_ids[unresolved])
+            hit = rows >= 0
+            for idx, row in zip(unresolved[hit].tolist(), rows[hit].tolist()):
+                found[wanted[idx]] = (segment, row)
+            unresolved = unresolved[~hit]
+            if not unresolved.size:
+                break
+        return found
+
+    # Tombstones -------------------------------------------------------
+    def _read_tombstones(self) -> dict[str, set[int]]:
+        tombstones: dict[str, set[int]] = {}
+        if not self.tombstones_path.exists():
+            return tombstones
+        for line in self.tombstones_path.read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # torn final line after a crash
+                continue
+            tombstones.setdefault(str(entry["segment"]), set()).update(entry["rows"])
+        return tombstones
+
+    def _append_tombstones(self, doomed: dict[_Segment, list[int]]) -> None:
+        lines = "".join(
+            json.dumps({"segment": segment.name, "rows": rows}) + "\n"
+            for segment, rows in doomed.items()
+        )
+        with self.tombstones_path.open("a", encoding="utf-8") as handle:
+            handle.write(lines)
+
+    def _rewrite_tombstones(self) -> None:
+        lines = "".join(
+            json.dumps({"segment": seg.name, "rows": np.flatnonzero(seg.dead).tolist()}) + "\n"
+            for seg in self.segments
+            if seg.dead_rows
+        )
+        _atomic_write_text(self.tombstones_path, lines)
+
+    # Group commit -----------------------------------------------------
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer persistence so every write inside the block lands in one segment."""
+
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if self._deferred == 0:
+                self.flush()
+
+    def flush(self) -> None:
+        """Persist pending writes as a new segment and merge small segments."""
+
+        with self._lock:
+            if not self._pending:
+                return
+            vectors = np.vstack([vector for _, vector, _ in self._pending])
+            raw_ids = _encode_ids([id_ for id_, _, _ in self._pending])
+            metadata = [meta for _, _, meta in self._pending]
+            segment = self._write_segment(vectors, raw_ids, metadata)
+            with self._view_lock:
+                self.segments.append(segment)
+                self._pending = []
+                self._pending_index = {}
+            self._maybe_merge()
+            self._write_manifest()
+
+    def _maybe_merge(self) -> None:
+        while len(self.segments) >= self.merge_factor:
+            tail = self.segments[-self.merge_factor :]
+            if len({self._tier(seg.rows) for seg in tail}) != 1:
+                break
+            self._merge(len(self.segments) - self.merge_factor)
+
+    def _tier(self, rows: int) -> int:
+        return int(math.log(max(rows, 1), self.merge_factor))
+
+    def _merge(self, start: int, stop: int | None = None) -> None:
+        stop = len(self.segments) if stop is None else stop
+        self._replace(self.segments[start:stop], combine=True)
+
+    def _replace(self, victims: list[_Segment], *, combine: bool) -> None:
+        """Rewrite ``victims`` without their dead rows, either merged or one by one."""
+
+        if not victims or (combine and len(victims) < 2 and not victims[0].dead_rows):
+            return
+        groups = [victims] if combine else [[seg] for seg in victims]
+        for group in groups:
+            live = [(seg, seg.live()) for seg in group]
+            replacement: list[_Segment] = []
+            if sum(len(keep) for _, keep in live):
+                merged = self._write_segment(
+                    np.vstack([np.asarray(seg.vectors[keep]) for seg, keep in live]),
+                    np.concatenate([seg.ids[keep] for seg, keep in live]),
+                    [self._segment_metadata(seg)[row] for seg, keep in live for row in keep],
+                )
+                merged.hits = sum(seg.hits for seg in group)
+                replacement.append(merged)
+            # one slice assignment, so a concurrent snapshot sees either the old
+            # segments or their replacement, never neither
+            with self._view_lock:
+                position = self.segments.index(group[0])
+                self.segments[position : position + len(group)] = replacement
+        self._write_manifest()
+        if any(seg.dead_rows for seg in victims):
+            self._rewrite_tombstones()
+        for seg in victims:
+            self._remove_segment_files(seg)
+
+    def optimize(self) -> None:
+        """Flush pending writes and merge every segment into a single one."""
+
+        with self._lock:
+            self.flush()
+            self._merge(0)
+
+    def compact(self, *, force: bool = False) -> None:
+        """Rewrite segments whose dead-row share reached ``compact_ratio``.
+
+        ``force`` rewrites every segment holding at least one tombstone.
+        """
+
+        with self._lock:
+            victims = [
+                seg
+                for seg in self.segments
+                if seg.dead_rows and (force or seg.dead_rows >= self.compact_ratio * seg.rows)
+            ]
+            self._replace(victims, combine=False)
+
+    @property
+    def dead_ratio(self) -> float:
+        rows = sum(seg.rows for seg in self.segments)
+        return sum(seg.dead_rows for seg in self.segments) / rows if rows else 0.0
+
+    def _maybe_compact(self) -> None:
+        if self.dead_ratio < self.compact_ratio:
+            return
+        if not self.background_compaction:
+            self.compact()
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(
+            target=self.compact, name=f"{self.name}-compaction", daemon=True
+        )
+        self._compactor.start()
+
+    # Tiering ----------------------------------------------------------
+    def _read_access(self) -> None:
+        if not self.access_path.exists():
+            return
+        try:
+            hits = json.loads(self.access_path.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            return
+        for segment in self.segments:
+            segment.hits = float(hits.get(segment.name, 0.0))
+
+    def _record_access(self, segments: Iterable[_Segment], queries: int) -> None:
+        if self.hot_rows is None:
+            return
+        for segment in segments:
+            segment.hits += 1.0
+        before = self._queries
+        self._queries += queries
+        if self._queries // self.retier_interval != before // self.retier_interval:
+            self.retier()
+
+    def retier(self, *, decay: bool = True) -> None:
+        """Load the most-accessed segments into RAM and map the rest from disk."""
+
+        if self.hot_rows is None:
+            return
+        with self._lock:
+            budget = self.hot_rows
+            ranked = sorted(
+                (seg for seg in self.segments if seg.hits > 0),
+                key=lambda seg: seg.hits / max(seg.rows - seg.dead_rows, 1),
+                reverse=True,
+            )
+            wanted: set[str] = set()
+            for segment in ranked:
+                if segment.rows <= budget:
+                    wanted.add(segment.name)
+                    budget -= segment.rows
+            for segment in self.segments:
+                hot = segment.name in wanted
+                if hot != segment.hot:
+                    path = self._segment_paths(segment.name)[0]
+                    segment.vectors = np.load(path, mmap_mode=None if hot else "r", allow_pickle=False)
+                    segment.hot = hot
+                if decay:
+                    segment.hits /= 2.0
+            _atomic_write_text(
+                self.access_path,
+                json.dumps({seg.name: seg.hits for seg in self.segments if seg.hits}),
+            )
+
+    @property
+    def resident_rows(self) -> int:
+        """Rows whose float32 vectors are held in RAM rather than mapped."""
+
+        if not self._mapped:
+            return sum(seg.rows for seg in self.segments)
+        return sum(seg.rows for seg in self.segments if seg.hot)
+
+    # ------------------------------------------------------------------
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        """Return ``vectors`` (a 2-D batch) scaled to unit length row by row."""
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        if np.any(norms == 0.0):
+            raise ValueError("Cannot index zero-length embedding")
+        if self.dimension is None:
+            self.dimension = int(matrix.shape[1])
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension mismatch: expected {self.dimension}, got {matrix.shape[1]}"
+            )
+        return matrix / norms
+
+    def _drop_rows(self, ids: Iterable[str]) -> bool:
+        """Tombstone committed rows; cost is proportional to the rows removed."""
+
+        doomed: dict[_Segment, list[int]] = {}
+        for segment, row in self._locate(list(ids)).values():
+            doomed.setdefault(segment, []).append(row)
+        if not doomed:
+            return False
+        for segment, rows in doomed.items():
+            segment.kill(rows)
+        self._append_tombstones(doomed)
+        return True
+
+    def _drop_pending(self, ids: Iterable[str]) -> None:
+        remove = {id_ for id_ in ids if id_ in self._pending_index}
+        if not remove:
+            return
+        pending = [entry for entry in self._pending if entry[0] not in remove]
+        with self._view_lock:
+            self._pending = pending
+            self._pending_index = {entry[0]: idx for idx, entry in enumerate(pending)}
 
     # ------------------------------------------------------------------
     def upsert(self, items: list[VectorItem]) -> None:
-        if self.vectors is None or self.vectors.size == 0:
-            self.vectors = np.empty((0, 0), dtype=np.float32)
-        vectors = self.vectors
-        id_to_index = {id_: idx for idx, id_ in enumerate(self.ids)}
+        self.bulk_load(
+            [item.id for item in items],
+            np.stack([np.asarray(item.embedding, dtype=np.float32) for item in items]),
+            [item.metadata for item in items],
+        )
+
+    def bulk_load(
+        self,
+        ids: list[str],
+        vectors: np.ndarray,
+        metadata: list[dict[str, object]],
+    ) -> None:
+        """Normalise ``vectors`` as one matrix and stage its rows for commit."""
+
+        matrix = self._normalize(vectors)
+        with self._lock:
+            with self._view_lock:
+                for id_, vector, meta in zip(ids, matrix, metadata):
+                    entry = (id_, vector, dict(meta))
+                    if id_ in self._pending_index:
+                        self._pending[self._pending_index[id_]] = entry
+                        continue
+                    self._pending_index[id_] = len(self._pending)
+                    self._pending.append(entry)
+            if self._drop_rows(ids):
+                self._maybe_compact()
+            if not self._deferred:
+                self.flush()
+
+    def delete(self, ids: list[str]) -> None:
+        with self._lock:
+            self._drop_pending(ids)
+            if self._drop_rows(ids):
+                self._maybe_compact()
+
+    def _blocks(self) -> Iterator[_Segment]:
+        """Yield committed segments followed by the uncommitted rows, if any."""
+
+        segments, pending = self._view()
+        yield from segments
+        if pending:
+            yield _Segment(
+                name="",
+                vectors=np.vstack([vector for _, vector, _ in pending]),
+                ids=_encode_ids([id_ for id_, _, _ in pending]),
+                hashes=np.empty(0, dtype=np.uint64),
+                order=np.empty(0, dtype=np.int32),
+                metadata=[meta for _, _, meta in pending],
+            )
+
+    def _candidate_rows(self, segment: _Segment, filters: SearchFilter | None) -> np.ndarray | None:
+        """Rows of ``segment`` passing ``filters``; ``None`` means scan all of it."""
+
+        if filters is None:
+            return None
+        mask = _filter_mask(self._segment_columns(segment), filters)
+        if segment.dead is not None:
+            mask &= ~segment.dead
+        return np.flatnonzero(mask)
+
+    def _score(
+        self,
+        segment: _Segment,
+        rows: slice | np.ndarray,
+        queries: np.ndarray,
+        approximate: bool,
+    ) -> np.ndarray:
+        """Score ``rows`` against a ``(dimension, n_queries)`` query matrix."""
+
+        if approximate and segment.codes is not None and not segment.hot:
+            block = segment.codes[rows].astype(np.float32)
+            # Prefix codes are narrower than the queries; their tail is ignored.
+            queries = queries[: block.shape[1]]
+            if segment.scale is not None:
+                scores = block @ (queries * segment.scale[:, None])
+            else:
+                scores = block @ queries
+        else:
+            scores = np.asarray(segment.vectors[rows] @ queries, dtype=np.float32)
+        if segment.dead is not None:
+            scores[segment.dead[rows]] = -np.inf
+        return scores
+
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        return self.search_many(np.asarray(embedding, dtype=np.float32)[None, :], limit, filters)[0]
+
+    def search_many(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Rank every query row of ``embeddings`` in one pass over the segments.
+
+        Each block of stored vectors is multiplied by the whole query matrix,
+        so the segments are streamed once however many queries are batched.
+        """
+
+        return self._search(embeddings, limit, filters, None)[0]
+
+    def search_within(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None,
+        deadline: float,
+    ) -> tuple[list[list[tuple[str, float]]], bool]:
+        """Best-effort search: blocks are scanned hottest first until ``deadline``."""
+
+        return self._search(embeddings, limit, filters, deadline)
+
+    def _search(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None,
+        deadline: float | None,
+    ) -> tuple[list[list[tuple[str, float]]], bool]:
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        output: list[list[tuple[str, float]]] = [[] for _ in range(embeddings.shape[0])]
+        norms = np.linalg.norm(embeddings, axis=1)
+        valid = np.flatnonzero(norms > 0)
+        if not valid.size:
+            return output, False
+        queries = np.ascontiguousarray((embeddings[valid] / norms[valid, None]).T)
+        plan: list[tuple[_Segment, np.ndarray | None]] = []
+        total = 0
+        for segment in self._blocks():
+            rows = self._candidate_rows(segment, filters)
+            matches = segment.rows - segment.dead_rows if rows is None else rows.shape[0]
+            if matches:
+                plan.append((segment, rows))
+                total += matches
+        if total == 0:
+            return output, False
+        if deadline is not None:
+            # Under a deadline, scan the segments most likely to hold answers first.
+            plan.sort(key=lambda entry: (not entry[0].hot, -entry[0].hits / max(entry[0].rows, 1)))
+        limit = min(limit or total, total)
+        # Ranking everything gains nothing from quantised scores, so go exact.
+        approximate = self._approximate and limit < total
+        depth = min(total, max(limit, self.rerank_depth)) if approximate else limit
+        offsets: list[int] = []
+        blocks: list[_Segment] = []
+        topk = _RunningTopK(depth, queries.shape[1])
+        base = 0
+        partial = False
+        for segment, rows in plan:
+            offsets.append(base)
+            blocks.append(segment)
+            span = segment.rows if rows is None else rows.shape[0]
+            for start in range(0, span, self.block_rows):
+                if deadline is not None and time.monotonic() >= deadline:
+                    partial = True
+                    break
+                if rows is None:
+                    window = slice(start, min(start + self.block_rows, segment.rows))
+                    scores = self._score(segment, window, queries, approximate)
+                    topk.push(scores, np.arange(base + window.start, base + window.stop))
+                else:
+                    chunk = rows[start : start + self.block_rows]
+                    topk.push(self._score(segment, chunk, queries, approximate), base + chunk)
+            base += segment.rows
+            if partial:
+                break
+        served: list[_Segment] = []
+        for column, ranked in enumerate(topk.results()):
+            located: list[tuple[_Segment, int, float]] = []
+            for row, score in ranked:
+                if score == -np.inf:  # tombstoned rows, only reachable in a cut-short scan
+                    continue
+                block = bisect_right(offsets, row) - 1
+                located.append((blocks[block], row - offsets[block], score))
+            if approximate and located:
+                query = queries[:, column]
+                exact = np.stack([segment.vectors[row] for segment, row, _ in located]) @ query
+                order = np.argsort(-exact, kind="stable")[:limit]
+                located = [(located[idx][0], located[idx][1], float(exact[idx])) for idx in order]
+            output[int(valid[column])] = [(segment.id_at(row), score) for segment, row, score in located]
+            served.extend(segment for segment, _, _ in located[: self.access_depth] if segment.name)
+        self._record_access(served, queries.shape[1])
+        return output, partial
+
+    def count(self) -> int:
+        segments, pending = self._view()
+        return sum(seg.rows - seg.dead_rows for seg in segments) + len(pending)
+
+    def ids(self) -> list[str]:
+        segments, pending = self._view()
+        output = [raw.decode("utf-8") for seg in segments for raw in seg.ids[seg.live()].tolist()]
+        output.extend(id_ for id_, _, _ in pending)
+        return output
+
+    def _vectors(self, ids: Sequence[str]) -> dict[str, np.ndarray]:
+        # Read the uncommitted rows before ``_locate`` snapshots the segments, so
+        # a row flushed in between is found in one or the other.
+        _, pending = self._view()
+        staged = {id_: vector for id_, vector, _ in pending}
+        output: dict[str, np.ndarray] = {}
+        committed: list[str] = []
+        for id_ in ids:
+            if id_ in staged:
+                output[id_] = staged[id_]
+            else:
+                committed.append(id_)
+        for id_, (segment, row) in self._locate(committed).items():
+            output[id_] = np.asarray(segment.vectors[row])
+        return output
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
+        return self._vectors(list(ids))
+
+    def close(self) -> None:
+        """Wait for background compaction and persist writes pending from a batch."""
+        if self._compactor is not None:
+            self._compactor.join()
+        self.flush()
+
+
+_STORAGE_TYPES = ("float32", "float16", "int8")
+
+
+def _quantize(vectors: np.ndarray, storage: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """Return ``(codes, per-dimension scale)`` for the requested scalar storage."""
+
+    if storage == "float32":
+        return np.ascontiguousarray(vectors, dtype=np.float32), None
+    if storage == "float16":
+        return vectors.astype(np.float16), None
+    if storage == "int8":
+        scale = np.abs(vectors).max(axis=0) / 127.0 if vectors.size else np.ones(0)
+        scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        return codes, scale
+    raise ValueError(f"Unsupported quantised storage {storage!r}")
+
+
+def _truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """Leading ``dims`` dimensions of each row, re-normalised to unit length."""
+
+    prefix = np.asarray(vectors[:, :dims], dtype=np.float32)
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms > 0, norms, 1.0)
+
+
+def _dictionary_encode(values: Sequence[object]) -> tuple[np.ndarray, np.ndarray]:
+    """Return ``(distinct values, int32 codes)``; missing values get code ``-1``."""
+
+    present = sorted({str(value) for value in values if value is not None})
+    lookup = {value: code for code, value in enumerate(present)}
+    codes = np.fromiter(
+        (-1 if value is None else lookup[str(value)] for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return _encode_ids(present), codes
+
+
+def _page(value: object) -> int:
+    return -1 if value is None else int(value)
+
+
+def _build_columns(metadata: Sequence[dict[str, object]]) -> dict[str, np.ndarray]:
+    """Columnar filter attributes for a block of rows."""
+
+    documents, document_codes = _dictionary_encode([meta.get("document_id") for meta in metadata])
+    sections, section_codes = _dictionary_encode([meta.get("section_id") for meta in metadata])
+    start = np.array([_page(meta.get("start_page")) for meta in metadata], dtype=np.int32)
+    end = np.array(
+        [_page(meta.get("end_page", meta.get("start_page"))) for meta in metadata], dtype=np.int32
+    )
+    end = np.where(end < 0, start, end)
+    return {
+        "documents": documents,
+        "document_codes": document_codes,
+        "sections": sections,
+        "section_codes": section_codes,
+        "start_page": start,
+        "end_page": end,
+    }
+
+
+_COLUMN_KEYS = ("documents", "document_codes", "sections", "section_codes", "start_page", "end_page")
+
+
+def _column_metadata(columns: dict[str, np.ndarray], row: int) -> dict[str, object]:
+    """Inverse of ``_build_columns`` for one row: the filter attributes it encodes."""
+
+    metadata: dict[str, object] = {}
+    for key, dictionary, codes in (
+        ("document_id", "documents", "document_codes"),
+        ("section_id", "sections", "section_codes"),
+    ):
+        code = int(columns[codes][row])
+        if code >= 0:
+            metadata[key] = columns[dictionary][code].decode("utf-8")
+    start = int(columns["start_page"][row])
+    if start >= 0:
+        metadata["start_page"] = start
+        metadata["end_page"] = int(columns["end_page"][row])
+    return metadata
+
+
+def _filter_mask(columns: dict[str, np.ndarray], filters: SearchFilter) -> np.ndarray:
+    """Boolean mask of the rows in a column block that pass ``filters``."""
+
+    mask = np.ones(columns["start_page"].shape[0], dtype=bool)
+    for wanted, dictionary, codes in (
+        (filters.document_ids, "documents", "document_codes"),
+        (filters.section_ids, "sections", "section_codes"),
+    ):
+        if wanted is None:
+            continue
+        matched = np.flatnonzero(np.isin(columns[dictionary], _encode_ids(sorted(wanted))))
+        if not matched.size:
+            return np.zeros_like(mask)
+        mask &= np.isin(columns[codes], matched)
+    if filters.pages is not None:
+        first, last = filters.pages
+        start, end = columns["start_page"], columns["end_page"]
+        mask &= (start >= 0) & (end >= first) & (start <= last)
+    return mask
+
+
+class _RunningTopK:
+    """Accumulate scored row blocks for ``width`` queries, holding ~2k candidates each."""
+
+    def __init__(self, k: int, width: int = 1) -> None:
+        self.k = k
+        self.width = width
+        self._scores: list[np.ndarray] = []
+        self._rows: list[np.ndarray] = []
+        self._held = 0
+
+    def push(self, scores: np.ndarray, rows: np.ndarray) -> None:
+        """Add a ``(rows, width)`` score block for the given global ``rows``."""
+
+        if scores.shape[0] == 0:
+            return
+        scores = scores.reshape(scores.shape[0], self.width).T
+        rows = np.asarray(rows, dtype=np.int64)
+        self._scores.append(scores)
+        self._rows.append(np.broadcast_to(rows, scores.shape))
+        self._held += scores.shape[1]
+        if self._held > 2 * self.k:
+            self._compact()
+
+    def _compact(self) -> None:
+        scores = np.concatenate(self._scores, axis=1)
+        rows = np.concatenate(self._rows, axis=1)
+        if scores.shape[1] > self.k:
+            keep = np.argpartition(scores, -self.k, axis=1)[:, -self.k :]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        self._scores, self._rows = [scores], [rows]
+        self._held = scores.shape[1]
+
+    def results(self) -> list[list[tuple[int, float]]]:
+        """Return per query ``(row, score)`` pairs ordered by descending score."""
+
+        if not self._scores:
+            return [[] for _ in range(self.width)]
+        self._compact()
+        scores, rows = self._scores[0], self._rows[0]
+        order = np.argsort(-scores, axis=1, kind="stable")
+        output: list[list[tuple[int, float]]] = []
+        for column in range(self.width):
+            ranked = order[column]
+            output.append(
+                list(zip(rows[column, ranked].tolist(), scores[column, ranked].astype(float).tolist()))
+            )
+        return output
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _atomic_save(path: Path, array: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as handle:
+        np.save(handle, array, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def _atomic_savez(path: Path, **arrays: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as handle:
+        np.savez(handle, **arrays)
+    os.replace(tmp, path)
+
+
+class _HnswBackend(VectorIndexBackend):
+    """Approximate cosine search over an HNSW graph persisted beside the NumPy store.
+
+    Deletes and overwrites tombstone graph nodes; once more than
+    ``rebuild_ratio`` of the nodes are dead the graph is rebuilt from the live
+    vectors. Unbounded searches (``limit`` of ``None`` or the whole index) fall
+    back to an exact scan so callers that rank everything stay correct.
+
+    The graph is persisted as a change log: each flush appends one part to
+    ``<name>_hnsw_parts`` holding the new nodes (vectors, links, binary ids and
+    filter columns), the rewritten links of older neighbours, and the nodes
+    deleted since the previous flush. Once the logged rows outgrow the graph,
+    or after a rebuild, the log is checkpointed into a single snapshot part.
+    Filters are evaluated on the per-part columns, like NumPy segments.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str,
+        *,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        rebuild_ratio: float = 0.5,
+    ) -> None:
+        self.root = Path(base_path)
+        self.manifest_path = self.root / f"{name}_hnsw_manifest.json"
+        self.parts_dir = self.root / f"{name}_hnsw_parts"
+        # Legacy layout rewritten in full on every flush, converted on open.
+        self.graph_path = self.root / f"{name}_hnsw.npz"
+        self.meta_path = self.root / f"{name}_hnsw.json"
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.rebuild_ratio = rebuild_ratio
+        self.graph: HnswGraph | None = None
+        self.node_ids: list[str] = []
+        self._nodes: dict[str, int] = {}
+        # Filter columns per persisted part as ``(first node, columns)``; nodes
+        # added since the last flush keep their metadata in ``_pending``.
+        self._columns: list[tuple[int, dict[str, np.ndarray]]] = []
+        self._pending: list[dict[str, object]] = []
+        self._parts: list[str] = []
+        self._next_part = 0
+        self._logged = 0
+        self._persisted = 0
+        self._rewrite = False
+        self._deferred = 0
+        self._dirty = False
+        self._load()
+
+    # ------------------------------------------------------------------
+    def _load(self) -> None:
+        if self.manifest_path.exists():
+            payload = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            self._parts = list(payload["parts"])
+            self._next_part = int(payload["next_part"])
+            self._logged = int(payload["logged"])
+            records: list[dict[str, np.ndarray]] = []
+            for name in self._parts:
+                with np.load(self.parts_dir / f"{name}.npz", allow_pickle=False) as arrays:
+                    record = dict(arrays)
+                self._columns.append((len(self.node_ids), {key: record[key] for key in _COLUMN_KEYS}))
+                self.node_ids.extend(raw.decode("utf-8") for raw in record["ids"].tolist())
+                records.append(record)
+            if records:
+                self.graph = HnswGraph.from_changes(records)
+        elif self.graph_path.exists() and self.meta_path.exists():
+            with np.load(self.graph_path, allow_pickle=False) as arrays:
+                self.graph = HnswGraph.from_arrays(dict(arrays))
+            payload = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            self.node_ids = [str(id_) for id_ in payload["ids"]]
+            self._pending = [dict(entry) for entry in payload["metadata"]]
+            self._rewrite = True
+            self._persist()
+            self.graph_path.unlink(missing_ok=True)
+            self.meta_path.unlink(missing_ok=True)
+        if self.graph is not None:
+            live = np.flatnonzero(~self.graph.deleted[: self.graph.size]).tolist()
+            self._nodes = {self.node_ids[node]: node for node in live}
+            self._persisted = self.graph.size
+
+    def _blocks(self) -> list[tuple[int, dict[str, np.ndarray]]]:
+        """Filter columns covering every node, including those not yet persisted."""
+
+        if not self._pending:
+            return self._columns
+        return [*self._columns, (self._persisted, _build_columns(self._pending))]
+
+    def _metadata(self, nodes: Sequence[int]) -> list[dict[str, object]]:
+        """Filter attributes of ``nodes`` (ascending) decoded from the columns."""
+
+        output: list[dict[str, object]] = []
+        blocks = self._blocks()
+        index = 0
+        for node in nodes:
+            while index + 1 < len(blocks) and blocks[index + 1][0] <= node:
+                index += 1
+            first, columns = blocks[index]
+            output.append(_column_metadata(columns, node - first))
+        return output
+
+    def _write_part(self, start: int, metadata: list[dict[str, object]]) -> str:
+        assert self.graph is not None
+        name = f"part{self._next_part:08d}"
+        self._next_part += 1
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        columns = _build_columns(metadata)
+        _atomic_savez(
+            self.parts_dir / f"{name}.npz",
+            ids=_encode_ids(self.node_ids[start:]),
+            **self.graph.changes(start),
+            **columns,
+        )
+        self._columns.append((start, columns))
+        return name
+
+    def _persist(self) -> None:
+        graph = self.graph
+        if graph is None:
+            if self._parts:
+                self._checkpoint()
+            return
+        changed = graph.size - self._persisted + len(graph.touched)
+        if self._rewrite or self._logged + changed > graph.size:
+            self._checkpoint()
+        elif changed or graph.removed:
+            metadata, self._pending = self._pending, []
+            self._parts.append(self._write_part(self._persisted, metadata))
+            self._logged += changed
+            self._write_manifest()
+        graph.mark_saved()
+        self._persisted = graph.size
+
+    def _checkpoint(self) -> None:
+        """Replace the change log with a single snapshot part."""
+
+        retired = self._parts
+        self._parts = []
+        if self.graph is not None:
+            metadata = self._metadata(range(self.graph.size))
+            self._columns, self._pending = [], []
+            self._parts.append(self._write_part(0, metadata))
+        self._logged = 0
+        self._rewrite = False
+        self._write_manifest()
+        for name in retired:
+            (self.parts_dir / f"{name}.npz").unlink(missing_ok=True)
+
+    def _write_manifest(self) -> None:
+        payload = {"parts": self._parts, "next_part": self._next_part, "logged": self._logged}
+        _atomic_write_text(self.manifest_path, json.dumps(payload))
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer persistence so every write inside the block is saved once."""
+
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if self._deferred == 0:
+                self.flush()
+
+    def flush(self) -> None:
+        if self._dirty:
+            self._persist()
+            self._dirty = False
+
+    def _written(self) -> None:
+        self._dirty = True
+        if not self._deferred:
+            self.flush()
+
+    # ------------------------------------------------------------------
+    def _add(self, id_: str, vector: np.ndarray, metadata: dict[str, object]) -> None:
+        if self.graph is None:
+            self.graph = HnswGraph(
+                vector.shape[0], m=self.m, ef_construction=self.ef_construction
+            )
+        if vector.shape[0] != self.graph.dimension:
+            raise ValueError(
+                f"Embedding dimension mismatch: expected {self.graph.dimension}, got {vector.shape[0]}"
+            )
+        node = self.graph.add(vector)
+        self.node_ids.append(id_)
+        self._pending.append(metadata)
+        self._nodes[id_] = node
+
+    def _rebuild(self) -> None:
+        assert self.graph is not None
+        live = sorted(self._nodes.values())
+        vectors = self.graph.vectors[live]
+        ids = [self.node_ids[node] for node in live]
+        metadata = self._metadata(live)
+        self.graph = None
+        self.node_ids, self._nodes = [], {}
+        self._columns, self._pending = [], []
+        self._persisted = 0
+        self._rewrite = True
+        for id_, vector, meta in zip(ids, vectors, metadata):
+            self._add(id_, vector, meta)
+
+    def upsert(self, items: list[VectorItem]) -> None:
         for item in items:
             vector = np.asarray(item.embedding, dtype=np.float32)
             norm = float(np.linalg.norm(vector))
             if norm == 0.0:
                 raise ValueError("Cannot index zero-length embedding")
-            vector = vector / norm
-            if self.dimension is None:
-                self.dimension = vector.shape[0]
-            if vector.shape[0] != self.dimension:
-                raise ValueError(
-                    f"Embedding dimension mismatch: expected {self.dimension}, got {vector.shape[0]}"
-                )
-            if item.id in id_to_index:
-                idx = id_to_index[item.id]
-                vectors[idx] = vector
-            else:
-                if vectors.size == 0:
-                    vectors = vector.reshape(1, -1)
-                else:
-                    if vector.shape[0] != vectors.shape[1]:
-                        raise ValueError(
-                            f"Embedding dimension mismatch: expected {vectors.shape[1]}, got {vector.shape[0]}"
-                        )
-                    vectors = np.vstack([vectors, vector])
-                self.ids.append(item.id)
-                id_to_index[item.id] = len(self.ids) - 1
-            self.metadata[item.id] = dict(item.metadata)
-        self.vectors = vectors
-        self._persist()
+            previous = self._nodes.pop(item.id, None)
+            if previous is not None and self.graph is not None:
+                self.graph.mark_deleted(previous)
+            self._add(item.id, vector / norm, dict(item.metadata))
+        self._maybe_rebuild()
+        self._written()
 
     def delete(self, ids: list[str]) -> None:
-        if self.vectors is None or not self.ids:
+        if self.graph is None:
+            return
+        removed = False
+        for id_ in ids:
+            node = self._nodes.pop(id_, None)
+            if node is not None:
+                self.graph.mark_deleted(node)
+                removed = True
+        if removed:
+            self._maybe_rebuild()
+            self._written()
+
+    def _maybe_rebuild(self) -> None:
+        if self.graph is None or not self.graph.size:
             return
-        remove = {id_ for id_ in ids}
-        keep_indices = [idx for idx, id_ in enumerate(self.ids) if id_ not in remove]
-        if len(keep_indices) == len(self.ids):
+        if 1.0 - len(self._nodes) / self.graph.size > self.rebuild_ratio:
+            self._rebuild()
+
+    def compact(self, *, force: bool = False) -> None:
+        """Rebuild the graph without tombstoned nodes."""
+
+        if self.graph is None or len(self._nodes) == self.graph.size:
             return
-        if keep_indices:
-            self.vectors = self.vectors[keep_indices]
+        if force:
+            self._rebuild()
         else:
-            self.vectors = np.empty((0, self.vectors.shape[1] if self.vectors.size else 0), dtype=np.float32)
-        self.ids = [self.ids[idx] for idx in keep_indices]
-        for id_ in ids:
-            self.metadata.pop(id_, None)
-        self._persist()
+            self._maybe_rebuild()
+        self._written()
 
-    def search(self, embedding: Sequence[float], limit: int | None) -> list[tuple[str, float]]:
-        if self.vectors is None or self.vectors.size == 0:
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        total = self.count()
+        if self.graph is None or total == 0:
             return []
         query = np.asarray(embedding, dtype=np.float32)
         norm = float(np.linalg.norm(query))
         if norm == 0.0:
             return []
         query = query / norm
-        scores = self.vectors @ query
-        limit = limit or scores.shape[0]
-        limit = min(limit, scores.shape[0])
-        order = np.argsort(scores)[::-1][:limit]
-        return [(self.ids[idx], float(scores[idx])) for idx in order]
+        if filters is not None or limit is None or limit >= total:
+            # Scoped queries are answered exactly over the matching nodes only.
+            mask = ~self.graph.deleted[: self.graph.size]
+            if filters is not None:
+                for first, columns in self._blocks():
+                    rows = columns["start_page"].shape[0]
+                    mask[first : first + rows] &= _filter_mask(columns, filters)
+            nodes = np.flatnonzero(mask)
+            scores = self.graph.vectors[nodes] @ query
+            order = np.argsort(-scores, kind="stable")[:limit]
+            return [(self.node_ids[int(nodes[idx])], float(scores[idx])) for idx in order]
+        hits = self.graph.search(query, limit, max(self.ef_search, limit))
+        return [(self.node_ids[node], sim) for node, sim in hits]
 
     def count(self) -> int:
-        return len(self.ids)
+        return len(self._nodes)
 
-    def get_embeddings(self, ids: Iterable[str]) -> dict[str, list[float]]:
-        if self.vectors is None or self.vectors.size == 0:
-            return {}
-        id_to_index = {id_: idx for idx, id_ in enumerate(self.ids)}
-        output: dict[str, list[float]] = {}
+    def ids(self) -> list[str]:
+        return list(self._nodes)
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
+        output: dict[str, np.ndarray] = {}
+        if self.graph is None:
+            return output
         for id_ in ids:
-            idx = id_to_index.get(id_)
-            if idx is None:
+            node = self._nodes.get(id_)
+            if node is not None:
+                output[id_] = self.graph.vectors[node].copy()
+        return output
+
+    def close(self) -> None:
+        """Persist any writes still pending from an open batch."""
+        self.flush()
+
+
+class _IvfPqBackend(VectorIndexBackend):
+    """Compressed approximate search over IVF lists of product-quantised residuals.
+
+    Only the ``uint8`` PQ codes and list assignments live in RAM; the
+    normalised float vectors go to a memory-mapped ``_NumpyBackend`` used for
+    exact scans before training, ``get_embeddings``, and the optional exact
+    re-rank of the shortlist. The codec is trained automatically once
+    ``min_train_rows`` vectors exist, or on demand through ``train``.
+
+    Codes are append-only like the NumPy segments: each flush writes the new
+    rows (codes, lists and a binary id column) as one part listed in
+    ``<name>_ivfpq_manifest.json``. Deletes and overwrites mark the old rows
+    dead and append their row numbers to ``<name>_ivfpq_tombstones.jsonl``;
+    once dead rows exceed ``compact_ratio`` the live rows are rewritten as a
+    single part.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str,
+        *,
+        nlist: int | None = None,
+        nprobe: int = 8,
+        pq_m: int | None = None,
+        rerank: bool = True,
+        rerank_factor: int = 10,
+        rerank_floor: int = 100,
+        min_train_rows: int = 1024,
+        max_train_rows: int = 65536,
+        compact_ratio: float = 0.2,
+        mmap: bool = True,
+        block_rows: int = 65536,
+    ) -> None:
+        self.root = Path(base_path)
+        self.codebook_path = self.root / f"{name}_ivfpq_codebooks.npz"
+        self.manifest_path = self.root / f"{name}_ivfpq_manifest.json"
+        self.parts_dir = self.root / f"{name}_ivfpq_parts"
+        self.tombstones_path = self.root / f"{name}_ivfpq_tombstones.jsonl"
+        # Legacy layout rewritten in full on every flush, converted on open.
+        self.codes_path = self.root / f"{name}_ivfpq_codes.npz"
+        self.ids_path = self.root / f"{name}_ivfpq_ids.json"
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.rerank_factor = max(1, rerank_factor)
+        self.rerank_floor = rerank_floor
+        self.min_train_rows = min_train_rows
+        self.max_train_rows = max_train_rows
+        self.compact_ratio = compact_ratio
+        self.full = _NumpyBackend(self.root, f"{name}_full", mmap=mmap, block_rows=block_rows)
+        self.codec: IvfPqCodec | None = None
+        self.row_ids: list[str] = []
+        # Row buffers grow geometrically; ``lists``/``codes``/``dead`` view the used rows.
+        self._lists = np.empty(0, dtype=np.int32)
+        self._codes = np.empty((0, 0), dtype=np.uint8)
+        self._dead = np.empty(0, dtype=bool)
+        self._size = 0
+        self.dead_rows = 0
+        self._rows: dict[str, int] = {}
+        self._inverted: tuple[np.ndarray, np.ndarray] | None = None
+        self._parts: list[dict[str, object]] = []
+        self._next_part = 0
+        self._persisted = 0
+        self._doomed: list[int] = []
+        self._rewrite = False
+        self._deferred = 0
+        self._dirty = False
+        self._load()
+
+    @property
+    def lists(self) -> np.ndarray:
+        return self._lists[: self._size]
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[: self._size]
+
+    @property
+    def dead(self) -> np.ndarray:
+        return self._dead[: self._size]
+
+    # ------------------------------------------------------------------
+    def _load(self) -> None:
+        if not self.codebook_path.exists():
+            return
+        with np.load(self.codebook_path, allow_pickle=False) as arrays:
+            self.codec = IvfPqCodec.from_arrays(dict(arrays))
+        if self.manifest_path.exists():
+            payload = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            self._parts = list(payload["parts"])
+            self._next_part = int(payload["next_part"])
+            lists: list[np.ndarray] = []
+            codes: list[np.ndarray] = []
+            for part in self._parts:
+                with np.load(self.parts_dir / f"{part['name']}.npz", allow_pickle=False) as arrays:
+                    lists.append(arrays["lists"])
+                    codes.append(arrays["codes"])
+                    self.row_ids.extend(raw.decode("utf-8") for raw in arrays["ids"].tolist())
+            if lists:
+                self._reset(np.concatenate(lists), np.concatenate(codes), self.row_ids)
+            self._persisted = self._size
+            for row in self._read_tombstones():
+                if row < self._size and not self._dead[row]:
+                    self._dead[row] = True
+                    self.dead_rows += 1
+            self._rows = {self.row_ids[row]: row for row in np.flatnonzero(~self.dead).tolist()}
+        elif self.codes_path.exists() and self.ids_path.exists():
+            with np.load(self.codes_path, allow_pickle=False) as arrays:
+                stored_lists, stored_codes = arrays["lists"], arrays["codes"]
+            stored = json.loads(self.ids_path.read_text(encoding="utf-8"))
+            self._reset(stored_lists, stored_codes, [str(id_) for id_ in stored])
+            self._rewrite = True
+            self._persist()
+            self.codes_path.unlink(missing_ok=True)
+            self.ids_path.unlink(missing_ok=True)
+
+    def _reset(self, lists: np.ndarray, codes: np.ndarray, ids: list[str]) -> None:
+        """Replace every row with ``ids`` and their codes, all live."""
+
+        self._lists = np.asarray(lists, dtype=np.int32)
+        self._codes = np.asarray(codes, dtype=np.uint8)
+        self._dead = np.zeros(len(ids), dtype=bool)
+        self._size = len(ids)
+        self.dead_rows = 0
+        self.row_ids = list(ids)
+        self._rows = {id_: row for row, id_ in enumerate(self.row_ids)}
+        self._doomed = []
+
+    def _read_tombstones(self) -> list[int]:
+        rows: list[int] = []
+        if not self.tombstones_path.exists():
+            return rows
+        for line in self.tombstones_path.read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.extend(json.loads(line)["rows"])
+            except json.JSONDecodeError:  # torn final line after a crash
                 continue
-            output[id_] = self.vectors[idx].astype(float).tolist()
+        return rows
+
+    def _write_part(self, start: int, stop: int) -> dict[str, object]:
+        name = f"part{self._next_part:08d}"
+        self._next_part += 1
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        _atomic_savez(
+            self.parts_dir / f"{name}.npz",
+            lists=self.lists[start:stop],
+            codes=self.codes[start:stop],
+            ids=_encode_ids(self.row_ids[start:stop]),
+        )
+        return {"name": name, "rows": stop - start}
+
+    def _persist(self) -> None:
+        if self.codec is None:
+            return
+        if self._rewrite:
+            retired = self._parts
+            self._parts = [self._write_part(0, self._size)] if self._size else []
+            self._write_manifest()
+            dead = np.flatnonzero(self.dead).tolist()
+            _atomic_write_text(self.tombstones_path, json.dumps({"rows": dead}) + "\n" if dead else "")
+            for part in retired:
+                (self.parts_dir / f"{part['name']}.npz").unlink(missing_ok=True)
+            self._rewrite = False
+        else:
+            if self._size > self._persisted:
+                self._parts.append(self._write_part(self._persisted, self._size))
+                self._write_manifest()
+            if self._doomed:
+                with self.tombstones_path.open("a", encoding="utf-8") as handle:
+                    handle.write(json.dumps({"rows": self._doomed}) + "\n")
+        self._persisted = self._size
+        self._doomed = []
+
+    def _write_manifest(self) -> None:
+        payload = {"parts": self._parts, "next_part": self._next_part}
+        _atomic_write_text(self.manifest_path, json.dumps(payload))
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer persistence of codes and full vectors until the block exits."""
+
+        self._deferred += 1
+        try:
+            with self.full.batch():
+                yield
+        finally:
+            self._deferred -= 1
+            if self._deferred == 0:
+                self.flush()
+
+    def flush(self) -> None:
+        self.full.flush()
+        if self._dirty:
+            self._persist()
+            self._dirty = False
+
+    def _written(self) -> None:
+        self._dirty = True
+        self._inverted = None
+        if not self._deferred:
+            self.flush()
+
+    # ------------------------------------------------------------------
+    def train(self) -> None:
+        """(Re)train the coarse quantiser and PQ codebooks on the stored vectors."""
+
+        vectors: list[np.ndarray] = []
+        ids: list[str] = []
+        for segment in self.full._blocks():
+            keep = segment.live()
+            if not keep.size:
+                continue
+            vectors.append(np.asarray(segment.vectors[keep], dtype=np.float32))
+            ids.extend(raw.decode("utf-8") for raw in segment.ids[keep].tolist())
+        if not ids:
+            return
+        matrix = np.vstack(vectors)
+        sample = matrix
+        if matrix.shape[0] > self.max_train_rows:
+            rng = np.random.default_rng(0)
+            sample = matrix[rng.choice(matrix.shape[0], self.max_train_rows, replace=False)]
+        dimension = matrix.shape[1]
+        nlist = self.nlist or int(np.clip(4 * math.sqrt(matrix.shape[0]), 1, 65536))
+        subspaces = self.pq_m or max(1, dimension // 16)
+        while dimension % subspaces:
+            subspaces -= 1
+        self.codec = IvfPqCodec.train(sample, nlist=nlist, subspaces=subspaces)
+        _atomic_savez(self.codebook_path, **self.codec.to_arrays())
+        lists, codes = self.codec.encode(matrix)
+        self._reset(lists, codes, ids)
+        self._rewrite = True
+        self._written()
+
+    def _reserve(self, extra: int, width: int) -> None:
+        need = self._size + extra
+        if need <= self._lists.shape[0] and self._codes.shape[1] == width:
+            return
+        capacity = max(need, 2 * self._lists.shape[0], 1024)
+        lists = np.empty(capacity, dtype=np.int32)
+        codes = np.empty((capacity, width), dtype=np.uint8)
+        dead = np.zeros(capacity, dtype=bool)
+        lists[: self._size] = self.lists
+        codes[: self._size] = self.codes
+        dead[: self._size] = self.dead
+        self._lists, self._codes, self._dead = lists, codes, dead
+
+    def _kill(self, row: int) -> None:
+        self._dead[row] = True
+        self.dead_rows += 1
+        self._doomed.append(row)
+
+    def _append(self, ids: list[str], vectors: np.ndarray) -> None:
+        """Append codes for ``ids``; rows they overwrite are marked dead."""
+
+        assert self.codec is not None
+        lists, codes = self.codec.encode(vectors)
+        self._reserve(len(ids), codes.shape[1])
+        start, stop = self._size, self._size + len(ids)
+        self._lists[start:stop] = lists
+        self._codes[start:stop] = codes
+        self._dead[start:stop] = False
+        self._size = stop
+        self.row_ids.extend(ids)
+        for row, id_ in enumerate(ids, start):
+            previous = self._rows.get(id_)
+            if previous is not None:
+                self._kill(previous)
+            self._rows[id_] = row
+
+    def _maybe_compact(self, *, force: bool = False) -> None:
+        if not self.dead_rows or (not force and self.dead_rows < self.compact_ratio * self._size):
+            return
+        live = np.flatnonzero(~self.dead)
+        self._reset(self.lists[live], self.codes[live], [self.row_ids[row] for row in live.tolist()])
+        self._rewrite = True
+
+    def upsert(self, items: list[VectorItem]) -> None:
+        self.full.upsert(items)
+        if self.codec is None:
+            if self.full.count() >= self.min_train_rows:
+                self.train()
+            return
+        ids = [item.id for item in items]
+        found = self.full._vectors(ids)
+        vectors = np.stack([found[id_] for id_ in ids])
+        self._append(ids, vectors)
+        self._maybe_compact()
+        self._written()
+
+    def delete(self, ids: list[str]) -> None:
+        self.full.delete(ids)
+        doomed = [self._rows.pop(id_) for id_ in ids if id_ in self._rows]
+        if not doomed:
+            return
+        for row in doomed:
+            self._kill(row)
+        self._maybe_compact()
+        self._written()
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._inverted is None:
+            assert self.codec is not None
+            live = np.flatnonzero(~self.dead)
+            order = live[np.argsort(self.lists[live], kind="stable")]
+            bounds = np.searchsorted(self.lists[order], np.arange(self.codec.nlist + 1))
+            self._inverted = (order, bounds)
+        return self._inverted
+
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        total = self.count()
+        if self.codec is None or filters is not None or limit is None or limit >= total:
+            # Filtered scans touch only matching rows of the exact store.
+            return self.full.search(embedding, limit, filters)
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return []
+        query = query / norm
+        probed, coarse_scores = self.codec.probe(query, self.nprobe)
+        order, bounds = self._inverted_lists()
+        rows = np.concatenate([order[bounds[list_] : bounds[list_ + 1]] for list_ in probed])
+        if rows.size == 0:
+            return []
+        scores = self.codec.score(
+            self.codes[rows], self.lists[rows], coarse_scores, self.codec.lookup_table(query)
+        )
+        shortlist = limit
+        if self.rerank:
+            shortlist = max(limit * self.rerank_factor, self.rerank_floor)
+        shortlist = min(shortlist, rows.size)
+        top = np.argpartition(scores, -shortlist)[-shortlist:]
+        rows, scores = rows[top], scores[top]
+        if self.rerank:
+            shortlist_ids = [self.row_ids[row] for row in rows]
+            found = self.full._vectors(shortlist_ids)
+            # rows whose tombstone a crash lost are gone from the exact store
+            kept = [idx for idx, id_ in enumerate(shortlist_ids) if id_ in found]
+            if not kept:
+                return []
+            rows = rows[kept]
+            exact = np.stack([found[shortlist_ids[idx]] for idx in kept]) @ query
+            scores = exact.astype(np.float32)
+        best = np.argsort(-scores, kind="stable")[:limit]
+        return [(self.row_ids[int(rows[idx])], float(scores[idx])) for idx in best]
+
+    def search_many(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        if self.codec is None or filters is not None or limit is None or limit >= self.count():
+            return self.full.search_many(embeddings, limit, filters)
+        return [self.search(query, limit) for query in embeddings]
+
+    def compact(self, *, force: bool = False) -> None:
+        """Compact the exact store, and the codes once dead rows reach ``compact_ratio``."""
+
+        self.full.compact(force=force)
+        if self.codec is not None:
+            self._maybe_compact(force=force)
+            if self._rewrite:
+                self._written()
+
+    def count(self) -> int:
+        return self.full.count()
+
+    def ids(self) -> list[str]:
+        return self.full.ids()
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
+        return self.full.get_embeddings(ids)
+
+    def close(self) -> None:
+        """Persist any writes still pending from an open batch."""
+        self.flush()
+
+
+class _ShardedBackend:
+    """Partition vectors by document across independent backends searched in parallel.
+
+    Rows are routed by a stable hash of their ``document_id`` so a document's
+    writes, deletes and re-ingests touch a single shard. Searches fan out over
+    a thread pool (NumPy releases the GIL inside the matrix products) and the
+    per-shard top-k lists are merged. The shard count is recorded in
+    ``<name>_shards.json`` because changing it requires a rebuild.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str,
+        *,
+        shards: int,
+        preferred: str | None = None,
+        options: dict[str, object] | None = None,
+    ) -> None:
+        self.root = Path(base_path)
+        self.name = name
+        layout_path = self.root / f"{name}_shards.json"
+        if layout_path.exists():
+            recorded = int(json.loads(layout_path.read_text())["shards"])
+            if recorded != shards:
+                raise ValueError(
+                    f"Index {name!r} was built with {recorded} shards, not {shards}; rebuild it to reshard"
+                )
+        else:
+            _atomic_write_text(layout_path, json.dumps({"shards": shards}))
+        options = dict(options or {})
+        if options.get("hot_rows"):
+            # The RAM budget is for the whole index, not for every shard.
+            options["hot_rows"] = max(1, int(options["hot_rows"]) // shards)
+        self.shards: list[VectorIndexBackend] = [
+            _select_backend(self.root, f"{name}_shard{idx:02d}", preferred, options)
+            for idx in range(shards)
+        ]
+        self._pool = ThreadPoolExecutor(
+            max_workers=min(shards, os.cpu_count() or 1), thread_name_prefix=f"{name}-shard"
+        )
+        self._placement: dict[str, int] | None = None
+
+    def _shard_of(self, document_id: object) -> int:
+        digest = hashlib.blake2b(str(document_id).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % len(self.shards)
+
+    def _targets(self, filters: SearchFilter | None) -> list[VectorIndexBackend]:
+        """Shards that can hold matches; document filters prune the others."""
+
+        if filters is None or filters.document_ids is None:
+            return self.shards
+        wanted = {self._shard_of(document_id) for document_id in filters.document_ids}
+        return [shard for idx, shard in enumerate(self.shards) if idx in wanted]
+
+    def _fan_out(self, shards: Sequence[VectorIndexBackend], call) -> list:
+        if len(shards) == 1:
+            return [call(shards[0])]
+        return list(self._pool.map(call, shards))
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        with ExitStack() as stack:
+            for shard in self.shards:
+                batch = getattr(shard, "batch", None)
+                if batch is not None:
+                    stack.enter_context(batch())
+            yield
+
+    def flush(self) -> None:
+        for shard in self.shards:
+            flush = getattr(shard, "flush", None)
+            if flush is not None:
+                flush()
+
+    def _placements(self) -> dict[str, int]:
+        """Map of every stored id to its shard, read from the shards on first write."""
+
+        if self._placement is None:
+            self._placement = {
+                id_: idx for idx, shard in enumerate(self.shards) for id_ in shard.ids()
+            }
+        return self._placement
+
+    def _delete_by_shard(self, ids: Iterable[str]) -> None:
+        placement = self._placements()
+        doomed: dict[int, list[str]] = {}
+        for id_ in ids:
+            idx = placement.pop(id_, None)
+            if idx is not None:
+                doomed.setdefault(idx, []).append(id_)
+        for idx, shard_ids in doomed.items():
+            self.shards[idx].delete(shard_ids)
+
+    def upsert(self, items: list[VectorItem]) -> None:
+        placement = self._placements()
+        routed: dict[int, list[VectorItem]] = {}
+        # The last write of a repeated id wins, so it can only land in one shard.
+        for item in {item.id: item for item in items}.values():
+            key = item.metadata.get("document_id", item.id)
+            routed.setdefault(self._shard_of(key), []).append(item)
+        # An id that moved to another document must not linger in its old shard.
+        self._delete_by_shard(
+            item.id
+            for idx, shard_items in routed.items()
+            for item in shard_items
+            if placement.get(item.id, idx) != idx
+        )
+        for idx, shard_items in routed.items():
+            self.shards[idx].upsert(shard_items)
+            placement.update((item.id, idx) for item in shard_items)
+
+    def delete(self, ids: list[str]) -> None:
+        self._delete_by_shard(ids)
+
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        return self.search_many(np.asarray([embedding], dtype=np.float32), limit, filters)[0]
+
+    def search_many(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        def run(shard: VectorIndexBackend) -> list[list[tuple[str, float]]]:
+            search_many = getattr(shard, "search_many", None)
+            if search_many is not None:
+                return search_many(embeddings, limit, filters)
+            return [shard.search(query, limit, filters) for query in embeddings]
+
+        return self._merge(self._fan_out(self._targets(filters), run), len(embeddings), limit)
+
+    def search_within(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None,
+        deadline: float,
+    ) -> tuple[list[list[tuple[str, float]]], bool]:
+        def run(shard: VectorIndexBackend) -> tuple[list[list[tuple[str, float]]], bool]:
+            search_within = getattr(shard, "search_within", None)
+            if search_within is not None:
+                return search_within(embeddings, limit, filters, deadline)
+            return [shard.search(query, limit, filters) for query in embeddings], False
+
+        results = self._fan_out(self._targets(filters), run)
+        merged = self._merge([hits for hits, _ in results], len(embeddings), limit)
+        return merged, any(partial for _, partial in results)
+
+    @staticmethod
+    def _merge(
+        partials: list[list[list[tuple[str, float]]]], queries: int, limit: int | None
+    ) -> list[list[tuple[str, float]]]:
+        output: list[list[tuple[str, float]]] = []
+        for column in range(queries):
+            merged = [hit for partial in partials for hit in partial[column]]
+            merged.sort(key=lambda hit: hit[1], reverse=True)
+            output.append(merged[:limit] if limit is not None else merged)
+        return output
+
+    def compact(self, *, force: bool = False) -> None:
+        for shard in self.shards:
+            compact = getattr(shard, "compact", None)
+            if compact is not None:
+                compact(force=force)
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards)
+
+    def ids(self) -> list[str]:
+        return [id_ for shard in self.shards for id_ in shard.ids()]
+
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
+        ids = list(ids)
+        output: dict[str, np.ndarray] = {}
+        for shard in self.shards:
+            output.update(shard.get_embeddings(ids))
         return output
 
     def close(self) -> None:
-        """No-op close hook for API parity with other backends."""
-        return None
+        self._pool.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+
+class _ChromaBackend(VectorIndexBackend):
+    """Chroma collection in cosine space, written in server-sized batches.
 
+    Vectors are normalised before they are sent so scores stay cosine even on
+    collections created by older releases with the default L2 space. The row
+    count is cached and invalidated by writes, which saves a round trip per
+    query. ``client`` replaces the persistent client under ``base_path``.
+    """
 
-class _ChromaBackend(VectorIndexBackend):  # pragma: no cover - optional dependency
-    def __init__(self, base_path: Path, name: str) -> None:
+    _DEFAULT_BATCH = 5000
+
+    def __init__(
+        self,
+        base_path: Path,
+        name: str,
+        *,
+        m: int | None = None,
+        ef_construction: int | None = None,
+        ef_search: int | None = None,
+        batch_size: int | None = None,
+        client: object | None = None,
+    ) -> None:
         self.root = Path(base_path) / "chroma"
         self.root.mkdir(parents=True, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=str(self.root))
-        self.collection = self.client.get_or_create_collection(name)
+        self.client = client if client is not None else chromadb.PersistentClient(path=str(self.root))
+        params: dict[str, object] = {"hnsw:space": "cosine"}
+        for key, value in (
+            ("hnsw:M", m),
+            ("hnsw:construction_ef", ef_construction),
+            ("hnsw:search_ef", ef_search),
+        ):
+            if value is not None:
+                params[key] = int(value)
+        try:
+            existing = self.client.get_collection(name)
+        except _CHROMA_NOT_FOUND:
+            existing = None
+        if existing is None:
+            self.collection = self.client.get_or_create_collection(name, metadata=params)
+            self.space = str(params["hnsw:space"])
+        else:
+            # the space is fixed at creation, and get_or_create_collection may
+            # echo the requested metadata rather than what the collection uses
+            self.collection = existing
+            self.space = str((existing.metadata or {}).get("hnsw:space", "l2"))
+        limit = getattr(self.client, "get_max_batch_size", None)
+        server_batch = int(limit()) if callable(limit) else self._DEFAULT_BATCH
+        self.batch_size = max(1, min(batch_size or server_batch, server_batch))
+        self._count: int | None = None
+
+    def _score(self, distance: float) -> float:
+        if self.space in ("cosine", "ip"):
+            return 1.0 - distance
+        # squared L2 between unit vectors is 2 - 2cos
+        return 1.0 - distance / 2.0
 
     def upsert(self, items: list[VectorItem]) -> None:
-        self.collection.upsert(
-            ids=[item.id for item in items],
-            embeddings=[list(map(float, item.embedding)) for item in items],
-            metadatas=[dict(item.metadata) for item in items],
-        )
+        vectors = np.asarray([item.embedding for item in items], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        if np.any(norms == 0.0):
+            raise ValueError("Cannot index zero-length embedding")
+        vectors = vectors / norms
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start : start + self.batch_size]
+            self.collection.upsert(
+                ids=[item.id for item in chunk],
+                embeddings=vectors[start : start + len(chunk)],
+                metadatas=[_chroma_metadata(item.metadata) for item in chunk],
+            )
+        self._count = None
 
     def delete(self, ids: list[str]) -> None:
+        for start in range(0, len(ids), self.batch_size):
+            self.collection.delete(ids=ids[start : start + self.batch_size])
         if ids:
-            self.collection.delete(ids=ids)
+            self._count = None
 
-    def search(self, embedding: Sequence[float], limit: int | None) -> list[tuple[str, float]]:
-        count = self.collection.count()
+    def search(
+        self,
+        embedding: Sequence[float],
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[tuple[str, float]]:
+        return self.search_many(np.asarray([embedding], dtype=np.float32), limit, filters)[0]
+
+    def search_many(
+        self,
+        embeddings: np.ndarray,
+        limit: int | None,
+        filters: SearchFilter | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        count = self.count()
         if count == 0:
-            return []
-        limit = limit or count
-        result = self.collection.query(query_embeddings=[list(map(float, embedding))], n_results=min(limit, count))
-        ids = result.get("ids", [[]])[0]
-        distances = result.get("distances", [[]])[0]
-        scores = [1.0 - float(dist) for dist in distances]
-        return list(zip(ids, scores))
+            return [[] for _ in range(len(embeddings))]
+        result = self.collection.query(
+            query_embeddings=np.asarray(embeddings, dtype=np.float32),
+            n_results=min(limit or count, count),
+            where=_chroma_where(filters),
+            include=["distances"],
+        )
+        output: list[list[tuple[str, float]]] = []
+        for ids, distances in zip(result.get("ids", []), result.get("distances", [])):
+            output.append([(id_, self._score(float(dist))) for id_, dist in zip(ids, distances)])
+        return output
 
     def count(self) -> int:
-        return self.collection.count()
+        if self._count is None:
+            self._count = self.collection.count()
+        return self._count
+
+    def ids(self) -> list[str]:
+        return list(self.collection.get(include=[]).get("ids", []))
 
-    def get_embeddings(self, ids: Iterable[str]) -> dict[str, list[float]]:
+    def get_embeddings(self, ids: Iterable[str]) -> dict[str, np.ndarray]:
         ids = list(ids)
         if not ids:
             return {}
         result = self.collection.get(ids=ids, include=["embeddings"])
-        output: dict[str, list[float]] = {}
+        output: dict[str, np.ndarray] = {}
+        embeddings = result.get("embeddings")
+        if embeddings is None:
+            return output
         for idx, id_ in enumerate(result.get("ids", [])):
-            embeddings = result.get("embeddings", [])
             if idx < len(embeddings):
-                output[id_] = list(map(float, embeddings[idx]))
+                output[id_] = np.asarray(embeddings[idx], dtype=np.float32)
         return output
 
     def close(self) -> None:
@@ -277,7 +2345,39 @@ class _ChromaBackend(VectorIndexBackend):  # pragma: no cover - optional depende
             pass
 
 
+def _chroma_metadata(metadata: dict[str, object]) -> dict[str, object]:
+    """Metadata as stored in Chroma, which rejects ``None`` values.
+
+    ``end_page`` defaults to ``start_page`` so single-page chunks still match
+    the page clause of ``_chroma_where``.
+    """
+
+    stored = {key: value for key, value in metadata.items() if value is not None}
+    if "start_page" in stored:
+        stored.setdefault("end_page", stored["start_page"])
+    return stored
+
+
+def _chroma_where(filters: SearchFilter | None) -> dict[str, object] | None:
+    """Translate ``filters`` into a Chroma metadata ``where`` clause."""
+
+    if filters is None:
+        return None
+    clauses: list[dict[str, object]] = []
+    if filters.document_ids is not None:
+        clauses.append({"document_id": {"$in": sorted(filters.document_ids)}})
+    if filters.section_ids is not None:
+        clauses.append({"section_id": {"$in": sorted(filters.section_ids)}})
+    if filters.pages is not None:
+        clauses.append({"end_page": {"$gte": filters.pages[0]}})
+        clauses.append({"start_page": {"$lte": filters.pages[1]}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
 __all__ = [
+    "SearchFilter",
     "VectorIndex",
     "VectorIndexBackend",
     "VectorItem",
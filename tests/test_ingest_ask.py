@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import time
+from itertools import pairwise
 from pathlib import Path
 from shutil import copyfile
 
+import numpy as np
 import pytest
 
 from pdfqanda.config import get_settings
@@ -11,6 +14,7 @@ from pdfqanda.retrieval import Retriever, format_answer
 from pdfqanda.util.cache import FileCache, stable_hash
 from pdfqanda.util.db import Database
 from pdfqanda.util.embeddings import EmbeddingClient
+from pdfqanda.util.vector_index import SearchFilter
 
 SAMPLE = Path(__file__).resolve().parents[1] / "input" / "sample.pdf"
 
@@ -74,4 +78,92 @@ def test_ingest_and_ask(temp_db, tmp_path, openai_embedder):
 
 def test_embedding_dimension(openai_embedder):
     vector = openai_embedder.embed_query("hello world")
-    assert len(vector) == 1536
+    assert vector.dtype == np.float32 and vector.shape == (1536,)
+    # embeddings are cached as raw float32 arrays, not JSON lists
+    (cached,) = openai_embedder.cache.base_dir.rglob("*.npy")
+    assert np.array_equal(np.load(cached), vector)
+    assert np.array_equal(openai_embedder.embed_query("hello world"), vector)
+
+
+def test_retriever_deadline_falls_back_to_lexical(temp_db):
+    class SlowEmbedder:
+        def embed_matrix(self, texts):
+            time.sleep(0.5)
+            return np.ones((len(texts), 2), dtype=np.float32)
+
+    temp_db.insert_markdowns(
+        [
+            {
+                "id": "chunk",
+                "document_id": "doc",
+                "section_id": "sec",
+                "content": "Budget rules",
+                "token_count": 2,
+                "start_page": 0,
+                "end_page": 0,
+                "emb": [1.0, 0.0],
+                "tsv": "budget rules",
+            }
+        ]
+    )
+    retriever = Retriever(temp_db, embedder=SlowEmbedder())
+    hits = retriever.search("budget rules", k=3, deadline_ms=50)
+    assert hits.lexical_only and hits.partial
+    assert [hit.content for hit in hits] == ["Budget rules"]
+    assert not retriever.search("budget rules", k=3).partial
+    retriever.close()
+    assert retriever._embed_pool is None
+
+
+def test_ingest_stores_paragraphs_once_and_chunks_as_ranges(temp_db, tmp_path, openai_embedder, monkeypatch):
+    monkeypatch.setenv("CHUNK_TARGET_TOKENS", "8")
+    monkeypatch.setenv("CHUNK_OVERLAP_RATIO", "0.3")
+    get_settings.cache_clear()
+    pdf = tmp_path / "notes.pdf"
+    pdf.write_bytes(b"%PDF-1.4 paragraph test")
+    pages = [
+        "Budget rules apply to travel.\n\nMeals are capped per day.",
+        "Lodging needs a receipt.\n\nMileage uses the federal rate.",
+    ]
+    ingestor = PdfIngestor(temp_db, embedder=openai_embedder)
+    monkeypatch.setattr(ingestor, "_load_pages", lambda path, sha256: pages)
+    result = ingestor.ingest(pdf)
+
+    cursor = temp_db.sqlite_conn.cursor()
+    assert cursor.execute("SELECT COUNT(*) FROM kb_paragraphs").fetchone()[0] == 4
+    assert cursor.execute("SELECT COUNT(*) FROM kb_markdowns WHERE content IS NOT NULL").fetchone()[0] == 0
+    ranges = cursor.execute("SELECT paragraph_start, paragraph_end FROM kb_markdowns ORDER BY paragraph_start").fetchall()
+    assert result.chunk_count == len(ranges) > 1
+    assert any(prev[1] >= nxt[0] for prev, nxt in pairwise(ranges))  # overlap shares paragraphs
+
+    hits = temp_db.lexical_search(["receipt"], limit=5)
+    assert hits and all("Lodging needs a receipt." in hit["content"] for hit in hits)
+    cited = temp_db.fetch_paragraphs(result.document_id, hits[0]["paragraph_start"], hits[0]["paragraph_end"])
+    assert "\n\n".join(row["content"] for row in cited) == hits[0]["content"]
+    assert [row["page"] for row in temp_db.fetch_paragraphs(result.document_id)] == [0, 0, 1, 1]
+
+
+def test_identical_chunks_share_one_embedding_across_documents(temp_db, tmp_path, openai_embedder, monkeypatch):
+    pages = ["Lodging needs a receipt.\n\nMileage uses the federal rate."]
+    ingestor = PdfIngestor(temp_db, embedder=openai_embedder)
+    monkeypatch.setattr(ingestor, "_load_pages", lambda path, sha256: pages)
+    results = []
+    for name in ("policy.pdf", "policy-copy.pdf"):
+        pdf = tmp_path / name
+        pdf.write_bytes(b"%PDF-1.4 " + name.encode())
+        results.append(ingestor.ingest(pdf))
+    first, second = results
+
+    assert first.reused_chunks == 0 and second.dedup_ratio == 1.0
+    assert temp_db.index.count() == first.chunk_count
+    query = openai_embedder.embed_matrix(["receipt"])[0]
+    hit = temp_db.vector_search(query, limit=1)[0]
+    assert {location["document_id"] for location in hit["locations"]} == {first.document_id, second.document_id}
+    scoped = temp_db.vector_search(query, limit=1, filters=SearchFilter(document_ids=[second.document_id]))[0]
+    assert [location["document_id"] for location in scoped["locations"]] == [second.document_id]
+    assert scoped["document_id"] == second.document_id
+
+    temp_db.delete_document(first.sha256)
+    assert temp_db.index.count() == first.chunk_count
+    hit = temp_db.lexical_search(["receipt"], limit=5)[0]
+    assert [location["document_id"] for location in hit["locations"]] == [second.document_id]
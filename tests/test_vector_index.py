@@ -1,7 +1,49 @@
 from __future__ import annotations
 
-from pdfqanda.util.db import Database
-from pdfqanda.util.vector_index import VectorIndex, VectorItem
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pdfqanda.util.db import _MIGRATIONS, Database, decode_embedding
+from pdfqanda.util.migrations import apply_migrations
+from pdfqanda.util.routing import CentroidRouter, adaptive_cut
+from pdfqanda.util.vector_index import (
+    SearchFilter,
+    VectorIndex,
+    VectorItem,
+    _atomic_save,
+    _chroma_where,
+    _ChromaBackend,
+    _NumpyBackend,
+)
+
+
+@pytest.fixture()
+def database(tmp_path):
+    db = Database(str(tmp_path / "kb.sqlite"), index_options={"preferred": "numpy"})
+    db.initialize()
+    yield db
+    db.close()
+
+
+def _chunk(chunk_id: str, emb: list[float], content: str = "text", **fields: object) -> dict[str, object]:
+    """A ``Database.insert_markdowns`` row with test defaults for the other columns."""
+
+    row: dict[str, object] = {
+        "id": chunk_id,
+        "document_id": "doc",
+        "section_id": None,
+        "content": content,
+        "token_count": 1,
+        "emb": emb,
+        "tsv": content.lower(),
+    }
+    row.update(fields)
+    return row
 
 
 def test_vector_index_round_trip(tmp_path):
@@ -87,3 +129,896 @@ def test_initialize_applies_migrations(tmp_path):
     applied = cursor.fetchone()[0]
     assert applied >= 2
     database.close()
+
+
+def test_numpy_backend_appends_segments(tmp_path):
+    backend = _NumpyBackend(tmp_path, "kb", merge_factor=4)
+    backend.upsert([VectorItem(id="a", embedding=[1.0, 0.0], metadata={})])
+    first = backend.segments_dir / f"{backend.segments[0].name}.npy"
+    first_mtime = first.stat().st_mtime_ns
+    with backend.batch():
+        backend.upsert([VectorItem(id="b", embedding=[0.0, 1.0], metadata={})])
+        backend.upsert([VectorItem(id="c", embedding=[1.0, 1.0], metadata={})])
+        assert len(backend.segments) == 1
+        assert backend.search([0.0, 1.0], limit=1)[0][0] == "b"
+    assert len(backend.segments) == 2
+    assert first.stat().st_mtime_ns == first_mtime
+
+    for idx in range(2):
+        backend.upsert([VectorItem(id=f"d{idx}", embedding=[1.0, float(idx)], metadata={})])
+    # four single-tier segments collapse into one on the fourth commit
+    assert len(backend.segments) == 1
+    assert backend.count() == 5
+
+    reopened = _NumpyBackend(tmp_path, "kb", merge_factor=4)
+    assert reopened.count() == 5
+    assert reopened.search([0.0, 1.0], limit=1)[0][0] == "b"
+
+
+def test_numpy_backend_imports_legacy_layout(tmp_path):
+    np.save(tmp_path / "kb_vectors.npy", np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+    (tmp_path / "kb_meta.json").write_text(
+        json.dumps({"ids": ["a", "b"], "metadata": {"a": {}, "b": {}}, "dimension": 2})
+    )
+    backend = _NumpyBackend(tmp_path, "kb")
+    assert backend.count() == 2
+    assert backend.search([0.0, 1.0], limit=1)[0][0] == "b"
+    assert not (tmp_path / "kb_vectors.npy").exists()
+    assert backend.manifest_path.exists()
+
+
+def test_numpy_backend_mmap_block_search_matches_full_scan(tmp_path):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    backend = _NumpyBackend(tmp_path, "kb")
+    backend.upsert(
+        [VectorItem(id=f"v{idx}", embedding=vec, metadata={}) for idx, vec in enumerate(vectors)]
+    )
+    query = rng.normal(size=8).astype(np.float32)
+    expected = backend.search(query, limit=5)
+
+    mapped = _NumpyBackend(tmp_path, "kb", mmap=True, block_rows=7)
+    assert isinstance(mapped.segments[0].vectors, np.memmap)
+    hits = mapped.search(query, limit=5)
+    assert [id_ for id_, _ in hits] == [id_ for id_, _ in expected]
+    assert len(mapped.search(query, limit=None)) == 50
+
+
+def test_hnsw_backend_search_delete_and_reload(tmp_path):
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(200, 16)).astype(np.float32)
+    index = VectorIndex(tmp_path, preferred="hnsw", m=8, ef_search=50)
+    index.upsert(
+        VectorItem(id=f"v{idx}", embedding=vec, metadata={}) for idx, vec in enumerate(vectors)
+    )
+    assert (tmp_path / "kb_hnsw_manifest.json").exists()
+    hits = index.search(vectors[17], limit=3)
+    assert hits[0][0] == "v17"
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+
+    index.delete(["v17"])
+    assert "v17" not in {id_ for id_, _ in index.search(vectors[17], limit=5)}
+    assert index.count() == 199
+    index.close()
+
+    reopened = VectorIndex(tmp_path, preferred="hnsw")
+    assert reopened.count() == 199
+    assert reopened.search(vectors[42], limit=1)[0][0] == "v42"
+    assert len(reopened.search(vectors[42])) == 199
+
+
+def test_hnsw_backend_appends_change_parts(tmp_path):
+    rng = np.random.default_rng(4)
+    vectors = rng.normal(size=(210, 16)).astype(np.float32)
+
+    def item(idx):
+        metadata = {"document_id": f"d{idx % 4}", "start_page": idx, "end_page": idx + 1}
+        return VectorItem(id=f"v{idx}", embedding=vectors[idx], metadata=metadata)
+
+    index = VectorIndex(tmp_path, preferred="hnsw", m=8, ef_search=50)
+    index.upsert(item(idx) for idx in range(200))
+    backend = index._backend
+    (first,) = backend.parts_dir.iterdir()
+    written = first.stat().st_mtime_ns
+
+    index.upsert(item(idx) for idx in range(200, 205))
+    index.delete(["v1", "v2"])
+    # earlier parts are never rewritten; each flush only appends its changes
+    assert len(list(backend.parts_dir.iterdir())) == 3
+    assert first.stat().st_mtime_ns == written
+    scoped = SearchFilter(document_ids=frozenset({"d1"}), pages=(0, 100))
+    expected = index.search(vectors[5], limit=10, filters=scoped)
+    assert {id_ for id_, _ in expected} <= {f"v{idx}" for idx in range(5, 100, 4)}
+    index.close()
+
+    reopened = VectorIndex(tmp_path, preferred="hnsw", m=8, ef_search=50)
+    assert reopened.count() == 203
+    assert reopened.search(vectors[5], limit=10, filters=scoped) == expected
+    assert reopened.search(vectors[203], limit=1)[0][0] == "v203"
+    reopened.compact()
+    backend = reopened._backend
+    assert len(list(backend.parts_dir.iterdir())) == 1 and backend.graph.size == 203
+    assert reopened.search(vectors[5], limit=10, filters=scoped) == expected
+    reopened.close()
+
+    # graphs written with the old full-rewrite layout are converted on open
+    legacy = backend.graph.changes(0)
+    legacy["params"] = legacy["params"][:4]
+    legacy["deleted"] = np.zeros(backend.graph.size, dtype=bool)
+    np.savez(tmp_path / "kb_hnsw.npz", **legacy)
+    metadata = [{"document_id": f"d{int(id_[1:]) % 4}", "start_page": int(id_[1:])} for id_ in backend.node_ids]
+    (tmp_path / "kb_hnsw.json").write_text(json.dumps({"ids": backend.node_ids, "metadata": metadata}))
+    for path in (backend.manifest_path, *backend.parts_dir.iterdir()):
+        path.unlink()
+    converted = VectorIndex(tmp_path, preferred="hnsw")
+    assert converted.count() == 203 and backend.manifest_path.exists()
+    assert not (tmp_path / "kb_hnsw.json").exists()
+    assert converted.search(vectors[5], limit=10, filters=scoped) == expected
+
+
+def test_ivfpq_backend_trains_compresses_and_reranks(tmp_path):
+    rng = np.random.default_rng(5)
+    vectors = rng.normal(size=(300, 32)).astype(np.float32)
+    index = VectorIndex(tmp_path, preferred="ivfpq", nlist=8, nprobe=8, min_train_rows=256)
+    with index.batch():
+        index.upsert(
+            VectorItem(id=f"v{idx}", embedding=vec, metadata={}) for idx, vec in enumerate(vectors)
+        )
+    backend = index._backend
+    assert backend.codec is not None
+    assert backend.codes.dtype == np.uint8 and backend.codes.shape == (300, 2)
+    hits = index.search(vectors[11], limit=3)
+    assert hits[0][0] == "v11"
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+
+    index.delete(["v11"])
+    assert "v11" not in {id_ for id_, _ in index.search(vectors[11], limit=5)}
+    index.close()
+
+    reopened = VectorIndex(tmp_path, preferred="ivfpq", nprobe=8)
+    assert reopened.count() == 299
+    assert reopened.search(vectors[99], limit=1)[0][0] == "v99"
+
+
+def test_ivfpq_backend_trains_only_on_live_rows(tmp_path):
+    rng = np.random.default_rng(6)
+    vectors = rng.normal(size=(300, 32)).astype(np.float32)
+    index = VectorIndex(tmp_path, preferred="ivfpq", nlist=4, nprobe=4, min_train_rows=250)
+    index.upsert(
+        VectorItem(id=f"v{idx}", embedding=vec, metadata={})
+        for idx, vec in enumerate(vectors[:200])
+    )
+    deleted = {f"v{idx}" for idx in range(20)}
+    index.delete(deleted)
+    index.upsert(
+        VectorItem(id=f"v{idx}", embedding=vectors[idx], metadata={}) for idx in range(200, 300)
+    )
+
+    backend = index._backend
+    assert backend.codec is not None
+    live = sorted(f"v{idx}" for idx in range(20, 300))
+    assert sorted(backend.row_ids) == live
+    assert sorted(index.ids()) == live
+    assert backend.codes.shape[0] == 280
+    for idx in (3, 150, 250):
+        hits = index.search(vectors[idx], limit=5)
+        assert not deleted & {id_ for id_, _ in hits}
+    assert index.search(vectors[150], limit=1)[0][0] == "v150"
+    index.close()
+
+
+def test_ivfpq_backend_appends_code_parts_and_tombstones(tmp_path):
+    rng = np.random.default_rng(8)
+    vectors = rng.normal(size=(300, 32)).astype(np.float32)
+    index = VectorIndex(tmp_path, preferred="ivfpq", nlist=4, nprobe=4, min_train_rows=200)
+    index.upsert(VectorItem(id=f"v{idx}", embedding=vectors[idx], metadata={}) for idx in range(250))
+    backend = index._backend
+    (first,) = backend.parts_dir.iterdir()
+    written = first.stat().st_mtime_ns
+
+    index.upsert(VectorItem(id=f"v{idx}", embedding=vectors[idx], metadata={}) for idx in range(250, 300))
+    index.delete(["v0", "v1"])
+    index.upsert([VectorItem(id="v5", embedding=vectors[6], metadata={})])
+    # earlier parts are never rewritten; deletes and overwrites only add tombstones
+    assert len(list(backend.parts_dir.iterdir())) == 3
+    assert first.stat().st_mtime_ns == written
+    assert backend.dead_rows == 3 and len(backend.tombstones_path.read_text().splitlines()) == 2
+    assert not {"v0", "v1"} & {id_ for id_, _ in index.search(vectors[0], limit=10)}
+    index.close()
+
+    reopened = VectorIndex(tmp_path, preferred="ivfpq", nprobe=4)
+    backend = reopened._backend
+    assert backend.dead_rows == 3 and len(backend._rows) == 298
+    assert reopened.search(vectors[200], limit=1)[0][0] == "v200"
+    reopened.compact()
+    assert backend.dead_rows == 0 and backend.codes.shape[0] == 298
+    assert len(list(backend.parts_dir.iterdir())) == 1 and backend.tombstones_path.read_text() == ""
+    reopened.close()
+
+    # indexes written with the old full-rewrite layout are converted on open
+    live = list(backend.row_ids)
+    np.savez(tmp_path / "kb_ivfpq_codes.npz", lists=backend.lists, codes=backend.codes)
+    (tmp_path / "kb_ivfpq_ids.json").write_text(json.dumps(live))
+    for path in (backend.manifest_path, backend.tombstones_path, *backend.parts_dir.iterdir()):
+        path.unlink()
+    legacy = VectorIndex(tmp_path, preferred="ivfpq", nprobe=4)
+    assert legacy._backend.row_ids == live and backend.manifest_path.exists()
+    assert not (tmp_path / "kb_ivfpq_ids.json").exists()
+    assert legacy.search(vectors[200], limit=1)[0][0] == "v200"
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_numpy_backend_quantized_storage_reranks_exactly(tmp_path, storage):
+    rng = np.random.default_rng(11)
+    vectors = rng.normal(size=(120, 16)).astype(np.float32)
+    backend = _NumpyBackend(tmp_path, "kb", storage=storage, rerank_depth=20)
+    backend.upsert(
+        [VectorItem(id=f"v{idx}", embedding=vec, metadata={}) for idx, vec in enumerate(vectors)]
+    )
+    segment = backend.segments[0]
+    assert segment.codes is not None and segment.codes.dtype == np.dtype(storage)
+    assert json.loads(backend.manifest_path.read_text())["storage"] == storage
+
+    query = rng.normal(size=16).astype(np.float32)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = normalized @ (query / np.linalg.norm(query))
+    hits = backend.search(query, limit=5)
+    assert [id_ for id_, _ in hits] == [f"v{idx}" for idx in np.argsort(-exact)[:5]]
+    assert hits[0][1] == pytest.approx(float(exact.max()), abs=1e-5)
+
+    reopened = _NumpyBackend(tmp_path, "kb")
+    assert reopened.storage == storage
+    assert reopened.segments[0].codes is not None
+
+
+def test_numpy_backend_tombstones_and_compaction(tmp_path):
+    backend = _NumpyBackend(tmp_path, "kb", compact_ratio=0.5, background_compaction=False)
+    backend.upsert(
+        [VectorItem(id=f"v{idx}", embedding=[1.0, float(idx)], metadata={}) for idx in range(10)]
+    )
+    segment_file = backend.segments_dir / f"{backend.segments[0].name}.npy"
+    backend.delete(["v9", "v8"])
+    assert segment_file.exists()
+    assert backend.tombstones_path.exists()
+    assert backend.count() == 8
+    hits = backend.search([0.0, 1.0], limit=8)
+    assert {id_ for id_, _ in hits} == {f"v{idx}" for idx in range(8)}
+    assert backend.get_embeddings(["v9"]) == {}
+
+    reopened = _NumpyBackend(tmp_path, "kb", compact_ratio=0.5, background_compaction=False)
+    assert reopened.count() == 8
+    assert reopened.search([0.0, 1.0], limit=1)[0][0] == "v7"
+
+    # crossing the dead-row threshold rewrites the segment without tombstones
+    reopened.delete([f"v{idx}" for idx in range(3)])
+    assert reopened.dead_ratio == 0.0
+    assert not segment_file.exists()
+    assert reopened.tombstones_path.read_text() == ""
+    assert reopened.count() == 5
+    assert reopened.search([0.0, 1.0], limit=1)[0][0] == "v7"
+
+
+def test_numpy_backend_serves_searches_while_compaction_writes(tmp_path, monkeypatch):
+    backend = _NumpyBackend(tmp_path, "kb", compact_ratio=0.9, background_compaction=False)
+    backend.upsert([VectorItem(id=f"v{idx}", embedding=[1.0, float(idx)], metadata={}) for idx in range(100)])
+    backend.delete([f"v{idx}" for idx in range(20)])
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_save(path, array):
+        writing.set()
+        release.wait(5)
+        _atomic_save(path, array)
+
+    monkeypatch.setattr("pdfqanda.util.vector_index._atomic_save", slow_save)
+    compactor = threading.Thread(target=backend.compact, kwargs={"force": True})
+    compactor.start()
+    try:
+        assert writing.wait(5)
+        # the merged segment is still being written: the old one must stay visible
+        assert backend.count() == 80
+        assert len(backend.search([1.0, 50.0], limit=10)) == 10
+    finally:
+        release.set()
+        compactor.join()
+    assert backend.dead_ratio == 0.0 and backend.count() == 80
+
+
+def test_numpy_backend_binary_catalog(tmp_path):
+    backend = _NumpyBackend(tmp_path, "kb")
+    backend.upsert(
+        [VectorItem(id=f"chunk-{idx}", embedding=[1.0, float(idx)], metadata={}) for idx in range(5)]
+    )
+    name = backend.segments[0].name
+    with np.load(backend.segments_dir / f"{name}.catalog.npz") as catalog:
+        assert catalog["ids"].dtype.kind == "S"
+        assert np.all(np.diff(catalog["hashes"].astype(np.float64)) >= 0)
+    sidecar = json.loads((backend.segments_dir / f"{name}.json").read_text())
+    assert "ids" not in sidecar
+
+    reopened = _NumpyBackend(tmp_path, "kb")
+    assert reopened.segments[0].metadata is None  # metadata stays on disk until needed
+    assert set(reopened.get_embeddings(["chunk-3", "missing"])) == {"chunk-3"}
+    reopened.upsert([VectorItem(id="chunk-3", embedding=[0.0, 1.0], metadata={})])
+    assert reopened.count() == 5
+    assert reopened.get_embeddings(["chunk-3"])["chunk-3"] == pytest.approx([0.0, 1.0])
+
+
+@pytest.mark.parametrize("preferred", ["numpy", "hnsw"])
+def test_vector_index_filtered_search(tmp_path, preferred):
+    index = VectorIndex(tmp_path / "index", preferred=preferred)
+    index.upsert(
+        VectorItem(
+            id=f"c{idx}",
+            embedding=[1.0, float(idx)],
+            metadata={
+                "document_id": f"doc{idx % 2}",
+                "section_id": f"sec{idx % 3}",
+                "start_page": idx,
+                "end_page": idx + 1,
+            },
+        )
+        for idx in range(12)
+    )
+    hits = index.search([0.0, 1.0], limit=3, filters=SearchFilter(document_ids=["doc0"]))
+    assert [id_ for id_, _ in hits] == ["c10", "c8", "c6"]
+    hits = index.search([0.0, 1.0], filters=SearchFilter(section_ids={"sec1"}, pages=(2, 5)))
+    assert [id_ for id_, _ in hits] == ["c4", "c1"]
+    assert index.search([0.0, 1.0], filters=SearchFilter(document_ids=["nope"])) == []
+    index.close()
+
+
+@pytest.mark.parametrize("storage", [None, "int8"])
+def test_search_many_matches_single_queries(tmp_path, storage):
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    index = VectorIndex(tmp_path / "index", preferred="numpy", storage=storage, block_rows=64)
+    index.upsert(VectorItem(id=f"v{idx}", embedding=vector.tolist(), metadata={}) for idx, vector in enumerate(vectors))
+    index.delete(["v5"])
+    queries = np.vstack([vectors[:4], np.zeros((1, 16), dtype=np.float32)])
+    batched = index.search_many(queries, limit=7)
+    assert len(batched) == 5 and batched[-1] == []
+    for query, hits in zip(queries[:4], batched):
+        expected = index.search(query, limit=7)
+        assert [id_ for id_, _ in hits] == [id_ for id_, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=1e-5)
+    assert batched[0][0][0] == "v0"
+    index.close()
+
+
+def test_sharded_index_routes_by_document_and_merges(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    vectors = rng.normal(size=(120, 8)).astype(np.float32)
+    items = [
+        VectorItem(id=f"v{idx}", embedding=vector.tolist(), metadata={"document_id": f"doc{idx % 6}"})
+        for idx, vector in enumerate(vectors)
+    ]
+    single = VectorIndex(tmp_path / "single", preferred="numpy")
+    sharded = VectorIndex(tmp_path / "sharded", preferred="numpy", shards=3)
+    single.upsert(items)
+    sharded.upsert(items)
+    assert sharded.count() == 120
+    backend = sharded._backend
+    assert all(0 < shard.count() < 120 for shard in backend.shards)
+    for query in vectors[:5]:
+        assert [id_ for id_, _ in sharded.search(query, limit=5)] == [
+            id_ for id_, _ in single.search(query, limit=5)
+        ]
+
+    scoped = SearchFilter(document_ids=["doc2"])
+    assert len(backend._targets(scoped)) == 1
+    assert {id_ for id_, _ in sharded.search(vectors[0], filters=scoped)} == {
+        f"v{idx}" for idx in range(2, 120, 6)
+    }
+
+    deletes: list[int] = []
+    for idx, shard in enumerate(backend.shards):
+
+        def recording(ids, idx=idx, delete=shard.delete):
+            deletes.append(idx)
+            delete(ids)
+
+        monkeypatch.setattr(shard, "delete", recording)
+    # new ids touch only their own shard
+    sharded.upsert([VectorItem(id="v120", embedding=vectors[0].tolist(), metadata={"document_id": "doc2"})])
+    assert deletes == [] and sharded.count() == 121
+
+    # moving a chunk to another document re-routes it without leaving a copy behind,
+    # deleting only from the shard that held it
+    old = backend._shard_of("doc0")
+    target = next(f"doc{n}" for n in range(1, 6) if backend._shard_of(f"doc{n}") != old)
+    sharded.upsert([VectorItem(id="v0", embedding=vectors[0].tolist(), metadata={"document_id": target})])
+    assert deletes == [old] and sharded.count() == 121
+    sharded.delete(["v120", "missing"])
+    assert deletes == [old, backend._shard_of("doc2")] and sharded.count() == 120
+    sharded.close()
+    single.close()
+    with pytest.raises(ValueError):
+        VectorIndex(tmp_path / "sharded", preferred="numpy", shards=2)
+    assert VectorIndex(tmp_path / "sharded", preferred="numpy", shards=3).count() == 120
+
+
+def test_numpy_backend_tiers_segments_by_access(tmp_path):
+    backend = _NumpyBackend(tmp_path, "kb", storage="int8", hot_rows=25, retier_interval=4)
+    for doc in range(3):
+        backend.upsert(
+            [
+                VectorItem(id=f"d{doc}-{idx}", embedding=[float(doc == axis) for axis in range(3)] + [idx / 100], metadata={})
+                for idx in range(20)
+            ]
+        )
+    assert backend.resident_rows == 0
+    for _ in range(4):
+        hits = backend.search([0.0, 1.0, 0.0, 0.0], limit=3)
+    assert hits[0][0].startswith("d1-")
+    hot = [seg for seg in backend.segments if seg.hot]
+    assert len(hot) == 1 and backend.resident_rows == 20
+    assert not isinstance(hot[0].vectors, np.memmap)
+    assert all(isinstance(seg.vectors, np.memmap) for seg in backend.segments if not seg.hot)
+    backend.close()
+
+    reopened = _NumpyBackend(tmp_path, "kb", hot_rows=25)
+    assert [seg.name for seg in reopened.segments if seg.hot] == [hot[0].name]
+    assert reopened.search([0.0, 1.0, 0.0, 0.0], limit=1)[0][0].startswith("d1-")
+
+
+def test_numpy_backend_prefix_first_pass_reranks_full_vectors(tmp_path):
+    rng = np.random.default_rng(11)
+    # Matryoshka-like vectors: most of the energy sits in the leading dimensions.
+    vectors = (rng.normal(size=(400, 64)) * np.exp(-np.arange(64) / 12.0)).astype(np.float32)
+    items = [VectorItem(id=f"v{idx}", embedding=vector.tolist(), metadata={}) for idx, vector in enumerate(vectors)]
+    exact = _NumpyBackend(tmp_path / "exact", "kb")
+    exact.upsert(items)
+    backend = _NumpyBackend(tmp_path / "prefix", "kb", prefix_dims=16, rerank_depth=40)
+    backend.upsert(items)
+    assert backend.segments[0].codes.shape == (400, 16)
+    for query in vectors[:10]:
+        expected = exact.search(query, limit=5)
+        hits = backend.search(query, limit=5)
+        assert [id_ for id_, _ in hits] == [id_ for id_, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=1e-5)
+    backend.close()
+    assert _NumpyBackend(tmp_path / "prefix", "kb").prefix_dims == 16
+
+
+def test_adaptive_cut_keeps_every_candidate_without_a_clear_gap():
+    assert adaptive_cut([0.5] * 4, 4) == 4
+    assert adaptive_cut([0.9, 0.89, 0.88, 0.87, 0.86], 5) == 5
+    assert adaptive_cut([0.9, 0.895, 0.5, 0.49], 4) == 2
+    assert adaptive_cut([0.6, 0.59, 0.585], 3, min_gap=0.05) == 3
+    assert adaptive_cut([0.5] * 6, 4) == 4
+
+
+def test_database_routes_through_document_centroids(tmp_path):
+    assert adaptive_cut([0.9, 0.2, 0.1], 3) == 1
+    assert adaptive_cut([0.9, 0.85, 0.8, 0.1], 4) == 3
+    assert adaptive_cut([0.9, 0.2, 0.1], 3, min_m=2) == 2
+
+    rng = np.random.default_rng(2)
+    centres = np.eye(8, dtype=np.float32)[:4] * 4.0
+    router = CentroidRouter(tmp_path / "routes", max_documents=3)
+    database = Database(str(tmp_path / "kb.sqlite"), router=router)
+    database.initialize()
+    for doc, centre in enumerate(centres):
+        database.insert_document(doc_id=f"doc{doc}", title="T", sha256=f"sha{doc}", created_at="now")
+        database.insert_markdowns(
+            [
+                {
+                    "id": f"doc{doc}-{idx}",
+                    "document_id": f"doc{doc}",
+                    "section_id": f"doc{doc}-sec",
+                    "content": "text",
+                    "token_count": 1,
+                    "start_page": 0,
+                    "end_page": 0,
+                    "emb": (centre + rng.normal(scale=0.3, size=8)).tolist(),
+                    "tsv": "text",
+                }
+                for idx in range(10)
+            ]
+        )
+    assert router.documents.count() == 4 and router.sections.count() == 4
+
+    query = centres[2] + rng.normal(scale=0.3, size=8)
+    hits = database.vector_search(query.tolist(), limit=50)
+    assert {hit["document_id"] for hit in hits} == {"doc2"}
+    assert database.routing_accuracy(centres + 0.1, k=5) == 1.0
+    # without queries, stored chunk embeddings are sampled instead
+    assert database.routing_accuracy(k=5) == 1.0
+
+    database.delete_document("sha2")
+    assert router.documents.count() == 3 and router.sections.count() == 3
+    database.close()
+
+
+def test_section_routing_keeps_chunks_without_a_section(tmp_path):
+    rng = np.random.default_rng(4)
+    centres = np.eye(8, dtype=np.float32)[:2] * 4.0
+    router = CentroidRouter(tmp_path / "routes", max_documents=1, max_sections=2)
+    database = Database(str(tmp_path / "kb.sqlite"), router=router)
+    database.initialize()
+    database.insert_document(doc_id="doc", title="T", sha256="sha", created_at="now")
+    database.insert_markdowns(
+        [
+            {
+                "id": f"chunk-{idx}",
+                "document_id": "doc",
+                "section_id": "sec" if idx < 5 else None,
+                "content": f"text {idx}",
+                "token_count": 1,
+                "start_page": 0,
+                "end_page": 0,
+                "emb": (centres[idx // 5] + rng.normal(scale=0.3, size=8)).tolist(),
+                "tsv": "text",
+            }
+            for idx in range(10)
+        ]
+    )
+    assert router.sections.count() == 2
+    # a sectioned query narrows to its section ...
+    assert router.route(centres[0]).section_ids == frozenset({"sec"})
+    # ... but chunks outside any section stay reachable at document level
+    scope = router.route(centres[1])
+    assert scope.document_ids == frozenset({"doc"}) and scope.section_ids is None
+    hits = database.vector_search(centres[1].tolist(), limit=3)
+    assert {hit["section_id"] for hit in hits} == {None}
+
+    database.delete_document("sha")
+    assert router.documents.count() == 0 and router.sections.count() == 0
+    database.close()
+
+
+def test_vector_index_bulk_load_round_trips_ndarrays(tmp_path):
+    matrix = np.arange(1, 13, dtype=np.float32).reshape(4, 3)
+    index = VectorIndex(tmp_path / "index", preferred="numpy")
+    index.bulk_load(["a", "b", "c", "a"], matrix, [{"document_id": "doc"}] * 4)
+    assert index.count() == 3
+    found = index.get_embeddings(["a", "c"])
+    assert isinstance(found["a"], np.ndarray) and found["a"].dtype == np.float32
+    np.testing.assert_allclose(found["a"], matrix[3] / np.linalg.norm(matrix[3]), rtol=1e-6)
+    with pytest.raises(ValueError):
+        index.bulk_load(["z"], np.zeros((1, 3), dtype=np.float32))
+    index.close()
+
+
+def test_database_deadline_returns_partial_results(tmp_path):
+    database = Database(str(tmp_path / "kb.sqlite"), index_options={"preferred": "numpy", "block_rows": 4})
+    database.initialize()
+    database.insert_markdowns(
+        [
+            {
+                "id": f"chunk{idx}",
+                "document_id": "doc",
+                "section_id": "sec",
+                "content": "alpha beta" if idx % 2 else "gamma",
+                "token_count": 1,
+                "start_page": 0,
+                "end_page": 0,
+                "emb": [1.0, float(idx)],
+                "tsv": "alpha beta" if idx % 2 else "gamma",
+            }
+            for idx in range(20)
+        ]
+    )
+    complete = database.vector_search([0.0, 1.0], limit=5, deadline_ms=60_000)
+    assert not complete.partial and complete[0]["id"] == "chunk19"
+    expired = database.vector_search([0.0, 1.0], limit=5, deadline_ms=0)
+    assert expired.partial and len(expired) < 5
+
+    lexical = database.lexical_search(["alpha", "delta"], limit=3)
+    assert lexical.lexical_only and len(lexical) == 3
+    assert all(hit["content"] == "alpha beta" and hit["score"] > 0 for hit in lexical)
+    database.close()
+
+
+def test_initialize_converts_json_embeddings_to_blobs(tmp_path):
+    db_path = tmp_path / "kb.sqlite"
+    legacy = sqlite3.connect(db_path)
+    apply_migrations(legacy, _MIGRATIONS[:2])
+    legacy.execute(
+        "INSERT INTO kb_markdowns (id, document_id, section_id, content, token_count, emb, tsv)"
+        " VALUES ('old', 'doc', NULL, 'legacy', 1, ?, 'legacy')",
+        (json.dumps([0.25, -1.5]),),
+    )
+    legacy.commit()
+    legacy.close()
+
+    database = Database(str(db_path))
+    database.initialize()
+    database.insert_markdowns(
+        [_chunk("new", [1.0, 0.0], "fresh")]
+    )
+    cursor = database.sqlite_conn.cursor()
+    cursor.execute("SELECT id, typeof(emb), emb FROM kb_chunks ORDER BY id")
+    rows = cursor.fetchall()
+    assert [row[1] for row in rows] == ["blob", "blob"]
+    assert decode_embedding(rows[1][2]).tolist() == [0.25, -1.5]
+    assert database.convert_embeddings() == 0
+    database.close()
+
+
+def test_lexical_search_uses_fts5_bm25_phrases_and_prefixes(database):
+    contents = {
+        "zone": "Rates for zone 5 apply to ground shipments. Zone 5 surcharges vary.",
+        "form": "Attach Form 1040-SR when filing.",
+        "other": "Ground shipments within one zone.",
+    }
+    database.insert_markdowns(
+        [
+            _chunk(chunk_id, [1.0, float(idx)], content, document_id=chunk_id)
+            for idx, (chunk_id, content) in enumerate(contents.items())
+        ]
+    )
+    ranked = database.lexical_search(["zone 5"], limit=5)
+    assert [hit["id"] for hit in ranked] == ["zone"]
+    assert [contents["zone"][start:end] for start, end in ranked[0]["offsets"]] == ["zone 5", "Zone 5"]
+    assert [hit["id"] for hit in database.lexical_search(["zon*"], limit=5)] == ["zone", "other"]
+    assert database.lexical_search(["1040*"], limit=5, filters=SearchFilter(document_ids=["zone"])) == []
+
+    hits = database.vector_search([1.0, 0.0], limit=2, keywords=["ground"])
+    assert {hit["id"] for hit in hits} == {"zone", "other"}
+    with database.transaction() as connection:
+        connection.execute("DELETE FROM kb_markdowns WHERE id = 'other'")
+    assert [hit["id"] for hit in database.lexical_search(["ground"], limit=5)] == ["zone"]
+
+
+def test_vector_search_pages_candidates_until_keywords_match(database):
+    database.insert_markdowns(
+        [_chunk(f"chunk{idx:03d}", [1.0, float(idx)], "common rare" if idx >= 100 else "common") for idx in range(200)]
+    )
+    pages: list[int] = []
+    search = database._index_search
+    database._index_search = lambda queries, limit, *args: pages.append(limit) or search(queries, limit, *args)
+
+    hits = database.vector_search([1.0, 0.0], limit=2, keywords=["rare"])
+    assert [hit["id"] for hit in hits] == ["chunk100", "chunk101"]
+    assert pages == [2, 8, 32, 128]
+
+    pages.clear()
+    assert len(database.vector_search([1.0, 0.0], limit=3, keywords=["common"])) == 3
+    assert pages == [3]
+    assert database.vector_search([1.0, 0.0], limit=3, keywords=["absent"]) == []
+
+
+def test_planner_goes_lexical_first_for_rare_keywords(database, monkeypatch):
+    database.insert_markdowns(
+        [
+            _chunk(f"chunk{idx:03d}", [1.0, float(idx)], "zone Z47 surcharge" if idx in (150, 180) else "zone rates")
+            for idx in range(200)
+        ]
+    )
+    rare = database.explain(["z47"], limit=2)
+    assert rare.strategy == "lexical-first" and rare.estimated_matches == 2
+    assert "2 of 200 chunks" in rare.describe()
+    assert database.explain(["zone"], limit=2).strategy == "vector-first"
+    assert database.explain(["surch*"], limit=2).estimated_matches == 2
+
+    database._index_search = None  # a lexical-first plan never touches the index
+    hits = database.vector_search([1.0, 0.0], limit=2, keywords=["Z47"])
+    assert [hit["id"] for hit in hits] == ["chunk150", "chunk180"]
+
+    # the deadline also bounds scoring the keyword matches
+    monkeypatch.setattr("pdfqanda.util.db._LEXICAL_BATCH", 1)
+    late = database.vector_search([1.0, 0.0], limit=2, keywords=["Z47"], deadline_ms=0)
+    assert late.partial and len(late) == 1
+    assert not database.vector_search([1.0, 0.0], limit=2, keywords=["Z47"], deadline_ms=60_000).partial
+
+
+def test_transaction_ties_index_writes_to_the_sql_commit(database):
+    assert database.sqlite_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    with pytest.raises(RuntimeError), database.transaction():
+        database.insert_document(doc_id="doc", title="Doc", sha256="abc", created_at="now")
+        database.insert_markdowns([_chunk("lost", [1.0, 0.0])])
+        raise RuntimeError("ingest failed")
+    assert database.sqlite_conn.execute("SELECT COUNT(*) FROM kb_markdowns").fetchone()[0] == 0
+    assert database.index.count() == 0
+
+    with database.transaction():
+        database.insert_document(doc_id="doc", title="Doc", sha256="abc", created_at="now")
+        with database.transaction():
+            database.insert_markdowns([_chunk("kept", [1.0, 0.0])])
+        assert database.index.count() == 0
+    assert database.index.count() == 1
+    assert [hit["id"] for hit in database.vector_search([1.0, 0.0], limit=1)] == ["kept"]
+
+    # a nested block that raises is rolled back to its savepoint, hooks included
+    with database.transaction():
+        database.insert_document(doc_id="other", title="Other", sha256="def", created_at="now")
+        with pytest.raises(RuntimeError), database.transaction():
+            database.insert_document(doc_id="inner", title="Inner", sha256="ghi", created_at="now")
+            database.insert_markdowns([_chunk("dropped", [0.0, 1.0], document_id="inner")])
+            raise RuntimeError("inner failed")
+        database.insert_markdowns([_chunk("after", [0.0, 1.0], document_id="other")])
+    documents = {row[0] for row in database.sqlite_conn.execute("SELECT id FROM kb_documents")}
+    assert documents == {"doc", "other"}
+    assert sorted(database.index.ids()) == ["after", "kept"]
+
+
+def test_database_serves_reads_from_pooled_readonly_connections(database):
+    database.insert_markdowns([_chunk(f"chunk{idx}", [1.0, float(idx)], "shared text") for idx in range(8)])
+
+    with database.connect() as reader:
+        assert reader is not database.sqlite_conn
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("DELETE FROM kb_markdowns")
+
+    with database.transaction():
+        database.insert_markdowns([_chunk("pending", [0.0, 1.0], "shared text")])
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # other threads read committed data only, without waiting on the writer
+            assert pool.submit(lambda: len(database.lexical_search(["shared"], limit=20))).result() == 8
+        with database.connect() as connection:
+            assert connection.execute("SELECT COUNT(*) FROM kb_markdowns").fetchone()[0] == 9
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda idx: database.vector_search([1.0, float(idx)], limit=1), range(32)))
+    assert all(len(hits) == 1 for hits in results)
+    assert len(database.pool._readers) <= 4
+
+
+def test_rebuild_index_repairs_drift_from_sqlite(database, tmp_path, monkeypatch):
+    monkeypatch.setattr("pdfqanda.util.db._REBUILD_BATCH", 2)
+    database.insert_markdowns([_chunk(f"chunk{idx}", [1.0, float(idx)]) for idx in range(5)])
+    # simulate a crash between the SQL commit and the index write, plus a stray index row
+    database.index.delete(["chunk3"])
+    database.index.upsert([VectorItem(id="ghost", embedding=[0.0, 1.0], metadata={"document_id": "gone"})])
+
+    report = database.verify_index()
+    assert (report.expected, report.indexed) == (5, 5)
+    assert report.missing == ("chunk3",) and report.orphaned == ("ghost",)
+
+    assert database.rebuild_index() == report
+    assert database.verify_index().consistent
+    assert database.vector_search([1.0, 3.0], limit=1)[0]["id"] == "chunk3"
+    assert not any(path.name.endswith((".rebuild", ".old")) for path in tmp_path.iterdir())
+
+
+def test_rebuild_index_swaps_only_when_no_search_is_running(database):
+    database.insert_markdowns([_chunk(f"chunk{idx}", [1.0, float(idx)]) for idx in range(5)])
+    retired = database.index
+    swapped = threading.Event()
+
+    def rebuild():
+        database.rebuild_index()
+        swapped.set()
+
+    worker = threading.Thread(target=rebuild)
+    with database.connect():
+        # a search in flight keeps the old index open until it returns its reader
+        worker.start()
+        assert not swapped.wait(0.3)
+        assert database.index is retired
+        assert [id_ for id_, _ in retired.search([1.0, 2.0], limit=1)] == ["chunk2"]
+    worker.join()
+    assert swapped.is_set() and database.index is not retired
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        searches = [pool.submit(database.vector_search, [1.0, float(idx % 5)], limit=1) for idx in range(64)]
+        database.rebuild_index()
+        assert all(len(future.result()) == 1 for future in searches)
+
+
+def test_database_recovers_an_index_swap_interrupted_by_a_crash(tmp_path):
+    path = tmp_path / "kb.sqlite"
+    database = Database(str(path), index_options={"preferred": "numpy"})
+    database.initialize()
+    database.insert_markdowns([_chunk(f"chunk{idx}", [1.0, float(idx)]) for idx in range(3)])
+    database.close()
+    # the live index was retired but the rebuilt one never renamed into place
+    index_dir = tmp_path / "kb.sqlite.index"
+    index_dir.rename(tmp_path / "kb.sqlite.index.old")
+
+    reopened = Database(str(path), index_options={"preferred": "numpy"})
+    assert reopened.verify_index().consistent
+    assert not (tmp_path / "kb.sqlite.index.old").exists()
+    reopened.close()
+
+    (tmp_path / "kb.sqlite.index.old").mkdir()
+    Database(str(path), index_options={"preferred": "numpy"}).close()
+    assert not (tmp_path / "kb.sqlite.index.old").exists()
+
+
+class _FakeCollection:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.calls: list[tuple[str, dict]] = []
+        self.distances: list[float] = []
+
+    def upsert(self, **kwargs):
+        self.calls.append(("upsert", kwargs))
+
+    def delete(self, **kwargs):
+        self.calls.append(("delete", kwargs))
+
+    def count(self):
+        return 3
+
+    def query(self, **kwargs):
+        self.calls.append(("query", kwargs))
+        return {"ids": [["a", "b"]], "distances": [self.distances]}
+
+
+class _FakeChromaClient:
+    def __init__(self, existing=None, max_batch=4):
+        self.existing = existing
+        self.created: _FakeCollection | None = None
+        self.max_batch = max_batch
+
+    def get_collection(self, name):
+        if isinstance(self.existing, Exception):
+            raise self.existing
+        if self.existing is None:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.existing
+
+    def get_or_create_collection(self, name, metadata=None):
+        self.created = _FakeCollection(metadata)
+        return self.created
+
+    def get_max_batch_size(self):
+        return self.max_batch
+
+
+def test_chroma_where_translates_search_filters():
+    assert _chroma_where(None) is None
+    assert _chroma_where(SearchFilter()) is None
+    assert _chroma_where(SearchFilter(document_ids={"b", "a"})) == {"document_id": {"$in": ["a", "b"]}}
+    assert _chroma_where(SearchFilter(section_ids={"s1"}, pages=(2, 4))) == {
+        "$and": [
+            {"section_id": {"$in": ["s1"]}},
+            {"end_page": {"$gte": 2}},
+            {"start_page": {"$lte": 4}},
+        ]
+    }
+
+
+def test_chroma_backend_scores_by_the_existing_collection_space(tmp_path):
+    client = _FakeChromaClient()
+    backend = _ChromaBackend(tmp_path, "kb", client=client, m=24)
+    assert client.created is not None and client.created.metadata == {"hnsw:space": "cosine", "hnsw:M": 24}
+    assert backend.space == "cosine"
+    client.created.distances = [0.0, 0.25]
+    assert backend.search([1.0, 0.0], limit=2) == [("a", 1.0), ("b", 0.75)]
+
+    # an older collection keeps its L2 space whatever metadata is requested now
+    legacy = _FakeCollection(None)
+    legacy.distances = [0.0, 0.5]
+    backend = _ChromaBackend(tmp_path, "kb", client=_FakeChromaClient(existing=legacy))
+    assert backend.collection is legacy and backend.space == "l2"
+    hits = backend.search([1.0, 0.0], limit=5, filters=SearchFilter(document_ids={"d"}))
+    assert hits == [("a", 1.0), ("b", 0.75)]
+    query = legacy.calls[-1][1]
+    assert query["n_results"] == 3 and query["where"] == {"document_id": {"$in": ["d"]}}
+
+    # only "collection not found" falls through to creating one
+    with pytest.raises(ConnectionError):
+        _ChromaBackend(tmp_path, "kb", client=_FakeChromaClient(existing=ConnectionError("server down")))
+
+
+def test_chroma_backend_writes_normalised_batches_without_none_metadata(tmp_path):
+    client = _FakeChromaClient(max_batch=2)
+    backend = _ChromaBackend(tmp_path, "kb", client=client, batch_size=10)
+    assert backend.batch_size == 2
+    backend.upsert(
+        [
+            VectorItem(id=f"v{idx}", embedding=[3.0, 4.0], metadata={"document_id": "d", "section_id": None})
+            for idx in range(5)
+        ]
+    )
+    writes = [kwargs for name, kwargs in client.created.calls if name == "upsert"]
+    assert [len(kwargs["ids"]) for kwargs in writes] == [2, 2, 1]
+    assert [id_ for kwargs in writes for id_ in kwargs["ids"]] == [f"v{idx}" for idx in range(5)]
+    assert all(meta == {"document_id": "d"} for kwargs in writes for meta in kwargs["metadatas"])
+    np.testing.assert_allclose(writes[0]["embeddings"], [[0.6, 0.8], [0.6, 0.8]], rtol=1e-6)
+
+    # a missing end page is stored as the start page so page filters still match
+    backend.upsert(
+        [VectorItem(id="page", embedding=[1.0, 0.0], metadata={"start_page": 3, "end_page": None})]
+    )
+    assert client.created.calls[-1][1]["metadatas"] == [{"start_page": 3, "end_page": 3}]
+
+    backend.delete([f"v{idx}" for idx in range(3)])
+    deletes = [kwargs["ids"] for name, kwargs in client.created.calls if name == "delete"]
+    assert deletes == [["v0", "v1"], ["v2"]]
+    with pytest.raises(ValueError):
+        backend.upsert([VectorItem(id="zero", embedding=[0.0, 0.0], metadata={})])